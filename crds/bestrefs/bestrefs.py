@@ -7,12 +7,14 @@ For more details on the several modes of operations and command line parameters
 """
 import sys
 import os
-from collections import namedtuple, OrderedDict
+import multiprocessing
+from collections import namedtuple, OrderedDict, Counter, deque
 
 # ===================================================================
 
 import crds
 from crds.core import log, config, utils, timestamp, cmdline, heavy_client
+from crds.core.exceptions import CrdsError
 from crds import diff, matches
 from . import table_effects, headers
 from crds.client import api
@@ -284,6 +286,7 @@ than errors as the default.
 
         self.skip_filekinds = [typ.lower() for typ in self.args.skip_types]
         self.affected_instruments = None
+        self.affected_predicates = None   # { instrument : { filekind : [ AffectedPredicate, ...] or None } }
 
         # See also complex_init()
         self.new_context = None     # Mapping filename
@@ -305,6 +308,12 @@ than errors as the default.
         self.datasets_since = self.args.datasets_since
 
         self.active_header = None   # new or old header last processed with bestrefs
+
+        self.batch_bestrefs = {}    # { (context, dataset) : bestrefs } precomputed by compute_batch_bestrefs()
+
+        self.worker_events = None   # in --jobs workers,  [ output event, ... ] deferred to the parent for replay
+        self.worker_output = None   # in --jobs workers,  log.CaptureHandler saving log output
+
     def complex_init(self):
         """Complex init tasks run inside any --pdb environment,  also unfortunately --profile."""
 
@@ -331,6 +340,10 @@ than errors as the default.
                      "-->", repr(self.new_context), "affect:\n",
                      log.PP(self.affected_instruments))
             self.instruments = self.affected_instruments.keys()
+            if self.args.incremental_diffs:
+                self.affected_predicates = differ.get_affected_predicates()
+                if self.affected_predicates is None:
+                    log.info("Context header differences affect all datasets,  --incremental-diffs has no effect.")
             if not self.instruments:
                 log.info("No instruments were affected.")
                 return False
@@ -446,10 +459,13 @@ than errors as the default.
                           help="Instruments to compute best references for, all historical datasets in database.")
 
         self.add_argument("-p", "--load-pickles", nargs="*", default=None,
-                          help="Load dataset headers and prior bestrefs from pickle files,  in worst-to-best update order.  Can also load .json files.")
+                          help="Load dataset headers and prior bestrefs from pickle files,  in worst-to-best update order.  Can also load .json and columnar .npz files.")
 
         self.add_argument("-a", "--save-pickle", default=None,
-                          help="Write out the combined dataset headers to the specified pickle file.  Can also store .json file.")
+                          help="Write out the combined dataset headers to the specified pickle file.  Can also store .json or columnar .npz file.")
+
+        self.add_argument("--minimize-headers", action="store_true",
+                          help="Load only the header keywords needed by the new and old contexts from columnar .npz --load-pickles files.")
 
         self.add_argument("-t", "--types", nargs="+",  metavar="REFERENCE_TYPES",  default=(),
                           help="Explicitly define the list of reference types to process, --skip-types also still applies.")
@@ -463,6 +479,9 @@ than errors as the default.
         self.add_argument("--diffs-only", action="store_true", default=None,
                           help="For context-to-context comparison, choose only instruments and types from context differences.")
 
+        self.add_argument("--incremental-diffs", action="store_true",
+                          help="With --diffs-only,  only re-evaluate types for datasets whose parameters fall within changed rmap rules.")
+
         self.add_argument("--datasets-since", default=None, type=reformat_date_or_auto,
                           help="Cut-off date for datasets, none earlier than this.  Use 'auto' to exploit reference USEAFTER.  OFF by default.")
 
@@ -534,6 +553,15 @@ than errors as the default.
         self.add_argument("-z", "--optimize-tables", action="store_true",
                           help="If set, apply row-based optimizations to screen out inconsequential table updates.")
 
+        self.add_argument("--batch-size", type=int, default=1000,
+                          help="In database and pickle modes, number of datasets to compute bestrefs for together. 1 means one at a time.")
+
+        self.add_argument("-j", "--jobs", type=int, default=1,
+                          help="Number of worker processes used to compute bestrefs.  Results and messages are merged in dataset order.")
+
+        self.add_argument("--prefetch-depth", type=int, default=0,
+                          help="In database mode, number of dataset header segments to request from the server ahead of processing in background threads. 0 (default) disables prefetching.")
+
         self.add_argument("--eliminate-duplicate-cases", action="store_true",
                           help="Categorize unique bestrefs results as errors to determine representative test cases...  Replaces normal error counts with coverage counts and ids.")
 
@@ -619,7 +647,8 @@ than errors as the default.
             self.require_server_connection()
             log.info("Computing bestrefs for db datasets for", repr(list(self.instruments)))
             the_headers = headers.InstrumentHeaderGenerator(
-                context, self.instruments, datasets_since, self.args.save_pickle, self.server_info)
+                context, self.instruments, datasets_since, self.args.save_pickle, self.server_info,
+                prefetch_depth=self.args.prefetch_depth)
         elif self.args.load_pickles:
             the_headers = None
         else:
@@ -629,15 +658,23 @@ than errors as the default.
             sys.exit(-1)
         if self.args.load_pickles:
             self.pickle_headers = headers.PickleHeaderGenerator(
-                context, self.args.load_pickles, only_ids=self.only_ids, datasets_since=datasets_since)
+                context, self.args.load_pickles, only_ids=self.only_ids, datasets_since=datasets_since,
+                keys=self.minimized_header_keys())
             if the_headers:   # combine partial correction headers field-by-field
                 log.verbose("Augmenting primary parameter sets with pickle overrides.")
-                the_headers.update_headers(self.pickle_headers.headers, only_ids=self.only_ids)
+                the_headers.update_headers(self.pickle_headers.all_headers(), only_ids=self.only_ids)
             else:   # assume pickles-only sources are all complete snapshots
                 log.verbose("Computing bestrefs solely from pickle files:", repr(self.args.load_pickles))
                 the_headers = self.pickle_headers
         return the_headers
 
+    def minimized_header_keys(self):
+        """Return the header keywords to load from columnar pickles for --minimize-headers,  or None."""
+        if not self.args.minimize_headers:
+            return None
+        contexts = [ctx for ctx in (self.new_context, self.old_context) if ctx]
+        return headers.context_header_keys(contexts)
+
     def init_comparison(self, datasets_since):
         """Interpret command line parameters to determine comparison mode."""
         assert not (self.args.old_context and self.args.compare_source_bestrefs), \
@@ -668,11 +705,21 @@ than errors as the default.
         """Compute bestrefs for datasets."""
         # Finish __init__() inside --pdb
         if self.complex_init():
-            for i, dataset in enumerate(self.new_headers):
-                if i != 0 and i % 1000 == 0:
-                    log.verbose(self.get_stat("datasets"), "sources processed", verbosity=5)
-                self.process(dataset)
-            self.post_processing()
+            try:
+                if self.jobs > 1:
+                    self.process_parallel()
+                else:
+                    i = 0
+                    for batch in self.dataset_batches(self.batch_size):
+                        self.compute_batch_bestrefs(batch)
+                        for dataset in batch:
+                            self.log_progress(i)
+                            self.process(dataset)
+                            i += 1
+                self.post_processing()
+            finally:
+                self.close_headers()
+                table_effects.clear_cache()
         self.report_stats()
         if self.args.eliminate_duplicate_cases:
             log.warning("Running in --eliminate-duplicate-cases mode;  even successful bestrefs are categorized as errors for analysis.")
@@ -681,6 +728,190 @@ than errors as the default.
         log.standard_status()
         return log.errors()
 
+    def close_headers(self):
+        """Stop any background header fetching and release header files once all datasets
+        are processed and saved.
+        """
+        self.new_headers.close()
+        if self.compare_prior and self.old_headers is not self.new_headers:
+            self.old_headers.close()
+
+    @property
+    def batch_size(self):
+        """Return the number of datasets to compute bestrefs for at once,  or 1 for one-at-a-time.
+
+        Batching applies to the database and pickle modes,  when bestrefs are computed locally
+        and without the verbose bookkeeping of getrecommendations().   Batches never exceed the
+        header segment size of the database source so they can be served from memory.
+        """
+        if (self.args.files or self.args.datasets or self.args.batch_size <= 1 or
+            log.get_verbose() >= 50 or self.server_info.effective_mode == "remote"):
+            return 1
+        return min(self.args.batch_size, getattr(self.new_headers, "segment_size", self.args.batch_size))
+
+    def log_progress(self, i):
+        """Periodically report how many datasets have been processed before processing the i-th."""
+        if i != 0 and i % 1000 == 0:
+            log.verbose(self.get_stat("datasets"), "sources processed", verbosity=5)
+
+    def dataset_batches(self, batch_size):
+        """Yield lists of dataset ids from self.new_headers,  `batch_size` ids at a time."""
+        batch = []
+        for dataset in self.new_headers:
+            batch.append(dataset)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def compute_batch_bestrefs(self, batch):
+        """Compute the new and old context bestrefs for the datasets in `batch` together,  saving
+        them in self.batch_bestrefs for get_bestrefs().   Datasets which cannot be batched,  or
+        batches which fail,  are left to the normal one-at-a-time computation and error handling.
+        """
+        self.batch_bestrefs = {}
+        if len(batch) <= 1:
+            return
+        contexts = [(self.new_context, self.new_headers)]
+        if self.compare_prior and self.args.old_context:
+            contexts.append((self.old_context, self.old_headers))
+        for context, the_headers in contexts:
+            lookup_headers, reftypes = {}, {}
+            for dataset in batch:
+                if dataset in self.drop_ids or (self.only_ids and dataset not in self.only_ids):
+                    continue
+                try:
+                    header = the_headers.get_lookup_parameters(dataset)
+                    instrument = utils.header_to_instrument(header)
+                    types = self.determine_reftypes(instrument, dataset, context, header)
+                except Exception:
+                    continue   # repeated and reported by get_bestrefs()
+                if types is None:
+                    self.batch_bestrefs[(context, dataset)] = {}
+                else:
+                    lookup_headers[dataset], reftypes[dataset] = header, types
+            with log.verbose_warning_on_exception("Batch bestrefs failed for", len(lookup_headers),
+                                                  "datasets, computing them one at a time"):
+                _mode, final_context = heavy_client.get_processing_mode(self.observatory, context)
+                results = heavy_client.get_best_references_batch(final_context, lookup_headers, reftypes)
+                for dataset, bestrefs in results.items():
+                    self.batch_bestrefs[(context, dataset)] = {key.upper(): value for (key, value) in bestrefs.items()}
+
+    @property
+    def jobs(self):
+        """Return the number of worker processes to use,  1 for serial processing in this process.
+
+        --update-pickle mutates the headers as they're processed and remote bestrefs are already
+        computed elsewhere,  so both are always serial.
+        """
+        if self.args.jobs <= 1 or self.args.update_pickle or self.server_info.effective_mode == "remote":
+            return 1
+        return self.args.jobs
+
+    @property
+    def chunk_size(self):
+        """Return the number of datasets handed to a --jobs worker at a time."""
+        if self.args.files:
+            return max(1, min(self.args.batch_size, len(self.files) // (4 * self.jobs)))
+        return max(1, min(self.args.batch_size, getattr(self.new_headers, "segment_size", self.args.batch_size)))
+
+    def process_parallel(self):
+        """Process datasets in self.jobs worker processes.   Workers are forked from this process and
+        receive datasets and their headers in chunks.   Each worker returns the updates, kill list,
+        stats,  and log output of each dataset which are merged here in dataset order,  so the results
+        and output are the same as serial processing.   No more than two chunks per worker are
+        outstanding at once to limit the headers held in memory.
+        """
+        log.verbose("Computing bestrefs with", self.jobs, "worker processes.")
+        pool_context = multiprocessing.get_context("fork")
+        i = 0
+        pending = deque()
+        with pool_context.Pool(self.jobs, initializer=_init_worker, initargs=(self,)) as pool:
+            for chunk in self.dataset_chunks():
+                pending.append(pool.apply_async(_process_chunk, (chunk,)))
+                while len(pending) >= 2 * self.jobs:
+                    i = self.merge_chunk(pending.popleft().get(), i)
+            while pending:
+                i = self.merge_chunk(pending.popleft().get(), i)
+
+    def dataset_chunks(self):
+        """Yield (datasets, new_headers, old_headers) chunks of work for process_chunk(),  where the
+        headers are { dataset : header } for the datasets of the chunk.
+        """
+        separate_old = self.compare_prior and self.old_headers is not self.new_headers
+        for datasets in self.dataset_batches(self.chunk_size):
+            new_headers = _chunk_headers(self.new_headers, datasets)
+            old_headers = _chunk_headers(self.old_headers, datasets) if separate_old else None
+            yield datasets, new_headers, old_headers
+
+    def init_worker(self):
+        """Prepare a forked copy of this script to run as a --jobs worker:  load the context pickles
+        once and capture log output for the parent rather than writing it.
+        """
+        log.remove_console_handler()
+        self.worker_output = log.add_capture_handler()
+        for context in (self.new_context, self.old_context):
+            if context:
+                with log.verbose_warning_on_exception("Failed preloading", repr(context), "in worker"):
+                    crds.get_pickled_mapping(context)   # reviewed
+
+    def process_chunk(self, chunk):
+        """In a --jobs worker,  process the datasets of `chunk` from dataset_chunks().
+
+        Returns [ (dataset, updates, kill_list, stats, log_counts, events), ... ]
+        """
+        datasets, new_headers, old_headers = chunk
+        self.new_headers.headers = new_headers
+        if old_headers is not None:
+            self.old_headers.headers = old_headers
+        if self.batch_size > 1:
+            self.compute_batch_bestrefs(datasets)
+        return [self.process_captured(dataset) for dataset in datasets]
+
+    def process_captured(self, dataset):
+        """Process `dataset` as process() does,  capturing its results and output for merge_chunk()."""
+        self.updates, self.kill_list = OrderedDict(), OrderedDict()
+        self.worker_events = []
+        stats = Counter(self.stats.counts)
+        log_counts = log.status()
+        self.process(dataset)
+        self.flush_worker_output()
+        stats = Counter(self.stats.counts) - stats
+        log_counts = tuple(after - before for (after, before) in zip(log.status(), log_counts))
+        events, self.worker_events = self.worker_events, None
+        return (dataset, self.updates.get(dataset), self.kill_list.get(dataset), stats, log_counts, events)
+
+    def flush_worker_output(self):
+        """Move any log output captured in a --jobs worker into the event list."""
+        if self.worker_output.messages:
+            self.worker_events.append(("output", self.worker_output.messages))
+            self.worker_output.messages = []
+
+    def merge_chunk(self, results, i):
+        """Merge the per-dataset `results` of a --jobs worker chunk,  replaying output and tracked
+        errors in order.   `i` is the count of datasets merged so far.   Returns the updated count.
+        """
+        for (dataset, updates, kill_list, stats, (errors, warnings, infos), events) in results:
+            self.log_progress(i)
+            i += 1
+            for event in events:
+                if event[0] == "output":
+                    log.replay(event[1])
+                else:
+                    _kind, self.active_header, pars, keys = event
+                    self.log_and_track_error(*pars, **keys)
+            for name, amount in stats.items():
+                self.increment_stat(name, amount)
+            log.increment_errors(errors)
+            log.increment_warnings(warnings)
+            log.increment_infos(infos)
+            if updates:
+                self.updates[dataset] = updates
+            if kill_list:
+                self.kill_list[dataset] = kill_list
+        return i
+
     def process(self, dataset):
         """Process best references for `dataset`,  printing dataset output,  collecting stats, trapping exceptions."""
         with log.error_on_exception("Failed processing", repr(dataset)):
@@ -725,6 +956,8 @@ than errors as the default.
 
     def get_bestrefs(self, instrument, dataset, context, header):
         """Compute the bestrefs for `dataset` with respect to loaded mapping/context `ctx`."""
+        if (context, dataset) in self.batch_bestrefs:
+            return self.batch_bestrefs.pop((context, dataset))
         with log.augment_exception("Failed determining reference types for", repr(dataset),
                                    "with respect to", (instrument, context, header)):
             reftypes = self.determine_reftypes(instrument, dataset, context, header)
@@ -755,6 +988,8 @@ than errors as the default.
             types = set(self.affected_instruments[instrument.lower()])
             if applicable_types:
                 types &= applicable_types
+            if self.affected_predicates:
+                types = self.filter_affected_types(instrument, types, header)
             if not types:
                 return None
         elif self.args.types:
@@ -769,6 +1004,16 @@ than errors as the default.
         types = sorted(list(types))
         return types
 
+    def filter_affected_types(self, instrument, types, header):
+        """Return the subset of `types` whose changed rmap rules `header` could select for --incremental-diffs."""
+        predicates = self.affected_predicates.get(instrument.lower(), {})
+        affected = set()
+        for filekind in types:
+            tests = predicates.get(filekind)
+            if tests is None or any(test(header) for test in tests):
+                affected.add(filekind)
+        return affected
+
     @property
     def update_promise(self):
         """Return a string identifying that and update would or will occurr, depending on --update-bestrefs."""
@@ -905,6 +1150,10 @@ than errors as the default.
         """Track and categorize the specified error,  printing out the dataset header
         if requested on the command line.
         """
+        if self.worker_events is not None:   # --jobs worker,  defer to the parent to keep error counts and order
+            self.flush_worker_output()
+            self.worker_events.append(("error", self.active_header, (dataset,) + pars, keys))
+            return None
         parts = dataset.split(":")
         if parts[0] == parts[-1]:  # no guarantee len() == 2
             dataset = parts[0]
@@ -1039,6 +1288,33 @@ than errors as the default.
 
 # ============================================================================
 
+_WORKER_SCRIPT = None
+
+def _init_worker(script):
+    """Pool initializer for BestrefsScript --jobs workers."""
+    global _WORKER_SCRIPT
+    _WORKER_SCRIPT = script
+    script.init_worker()
+
+def _process_chunk(chunk):
+    """Pool task for BestrefsScript --jobs workers."""
+    return _WORKER_SCRIPT.process_chunk(chunk)
+
+def _chunk_headers(the_headers, datasets):
+    """Return { dataset : header } from HeaderGenerator `the_headers` for `datasets`.   Datasets
+    whose headers can't be fetched are carried as a CrdsError with the same message,  which the
+    worker's HeaderGenerator.header() raises instead of fetching the header again.
+    """
+    chunk = {}
+    for dataset in datasets:
+        try:
+            chunk[dataset] = the_headers.header(dataset)
+        except Exception as exc:
+            chunk[dataset] = CrdsError(str(exc))
+    return chunk
+
+# ============================================================================
+
 def sreprlow(s):
     """Squash unicode and return the repr() of string `s` as lower case."""
     return repr(str(s)).lower()
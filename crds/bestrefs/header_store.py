@@ -0,0 +1,431 @@
+"""This module implements a streaming store of dataset headers for bestrefs so
+that very large header snapshots can be processed without first loading every
+header into memory.
+
+The data file is the bestrefs JSON-lines format written by --save-pickle,  one
+{ dataset_id : header } per line.   A sidecar index file,  <data file>.idx,
+lists the dataset ids in sorted order with the byte offset and length of each
+header's line so individual headers,  or runs of consecutive ids,  can be read
+by seeking rather than parsing the whole file.
+
+Header snapshots can also be stored as columnar .npz files with one dictionary
+encoded column per keyword,  see save_columnar() and ColumnarHeaderStore.   These
+are much smaller and faster to load than .json or .pkl files since each distinct
+keyword value is stored and decoded once,  and they can be loaded with only the
+keywords needed by a context.
+
+The index is binary:  a header of INDEX_HEADER_FORMAT (magic, version, id width,
+record count, data file size, data file mtime_ns) followed by one record per
+dataset of the id encoded as utf-8 and NUL padded to the id width,  followed by
+RECORD_FORMAT (offset, length).    An index which is missing or doesn't match
+the size and modification time of its data file is rebuilt in memory by
+scanning the data file once.   Lines holding more than one header,  notably
+legacy .json files written as a single { dataset_id : header, ... } object on
+one line,  are kept as parsed by the scan rather than re-parsed for each header.
+
+>>> import tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), "headers.json")
+>>> with HeaderStoreWriter(path) as writer:
+...     writer.write("J8CB01U3Q:J8CB01U3Q", {"INSTRUME": "ACS", "DETECTOR": "HRC"})
+...     writer.write("I9ZF01010:I9ZF01010", {"INSTRUME": "WFC3"})
+...     writer.write("J8CB01U4Q:J8CB01U4Q", "NOT FOUND dataset missing")
+
+>>> store = HeaderStore(path)
+>>> len(store), list(store)
+(3, ['I9ZF01010:I9ZF01010', 'J8CB01U3Q:J8CB01U3Q', 'J8CB01U4Q:J8CB01U4Q'])
+>>> store["J8CB01U3Q:J8CB01U3Q"]
+{'INSTRUME': 'ACS', 'DETECTOR': 'HRC'}
+>>> "J8CB01U5Q:J8CB01U5Q" in store, store.position("J8CB01U3Q:J8CB01U3Q")
+(False, 1)
+>>> list(store.items(1, 3))
+[('J8CB01U3Q:J8CB01U3Q', {'INSTRUME': 'ACS', 'DETECTOR': 'HRC'}), ('J8CB01U4Q:J8CB01U4Q', 'NOT FOUND dataset missing')]
+>>> store.close()
+
+Files written without an index,  in any id order,  are indexed when opened:
+
+>>> os.remove(index_path(path))
+>>> with open(path, "a") as handle:
+...     _ = handle.write('{"A1234567Q:A1234567Q": {"INSTRUME": "STIS"}}\\n')
+>>> store = HeaderStore(path)
+>>> list(store)[0], store["A1234567Q:A1234567Q"]
+('A1234567Q:A1234567Q', {'INSTRUME': 'STIS'})
+>>> store.close()
+
+A whole-object file on one line is parsed once,  not once per header:
+
+>>> from unittest import mock
+>>> with open(path, "w") as handle:
+...     _ = handle.write(json.dumps({"J8CB01U3Q:J8CB01U3Q": {"INSTRUME": "ACS"}, "I9ZF01010:I9ZF01010": {"INSTRUME": "WFC3"}}))
+>>> with mock.patch.object(json, "loads", side_effect=json.loads) as loads:
+...     store = HeaderStore(path)
+...     list(store.items()), store["J8CB01U3Q:J8CB01U3Q"]
+([('I9ZF01010:I9ZF01010', {'INSTRUME': 'WFC3'}), ('J8CB01U3Q:J8CB01U3Q', {'INSTRUME': 'ACS'})], {'INSTRUME': 'ACS'})
+>>> loads.call_count
+1
+>>> store.close()
+
+Files which aren't JSON-lines cannot be indexed:
+
+>>> with open(path, "w") as handle:
+...     _ = handle.write('{\\n"A1234567Q:A1234567Q": {"INSTRUME": "STIS"}\\n}\\n')
+>>> HeaderStore(path)
+Traceback (most recent call last):
+...
+ValueError: Not a JSON-lines header file: ...
+
+Columnar snapshots:
+
+>>> npz_path = os.path.join(os.path.dirname(path), "headers.npz")
+>>> save_columnar(npz_path, [
+...     ("J8CB01U3Q:J8CB01U3Q", {"INSTRUME": "ACS", "DETECTOR": "HRC", "CCDGAIN": 2.0}),
+...     ("I9ZF01010:I9ZF01010", {"INSTRUME": "WFC3"}),
+...     ("J8CB01U4Q:J8CB01U4Q", "NOT FOUND dataset missing")])
+>>> store = ColumnarHeaderStore(npz_path)
+>>> list(store)
+['I9ZF01010:I9ZF01010', 'J8CB01U3Q:J8CB01U3Q', 'J8CB01U4Q:J8CB01U4Q']
+>>> store["J8CB01U3Q:J8CB01U3Q"], store["I9ZF01010:I9ZF01010"]
+({'INSTRUME': 'ACS', 'DETECTOR': 'HRC', 'CCDGAIN': 2.0}, {'INSTRUME': 'WFC3'})
+>>> list(store.items(1)) == [(key, store[key]) for key in list(store)[1:]]
+True
+>>> ColumnarHeaderStore(npz_path, keys=["instrume", "ccdgain"])["J8CB01U3Q:J8CB01U3Q"]
+{'INSTRUME': 'ACS', 'CCDGAIN': 2.0}
+"""
+import os
+import abc
+import json
+import mmap
+import struct
+import bisect
+from collections.abc import Mapping
+
+import numpy as np
+
+# ============================================================================
+
+from crds.core import log
+
+# ============================================================================
+
+INDEX_MAGIC = b"CRDSHDX\0"
+INDEX_VERSION = 1
+INDEX_HEADER_FORMAT = "<8sHIQQQ"
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER_FORMAT)
+RECORD_FORMAT = "<QI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# ============================================================================
+
+def index_path(path):
+    """Return the path of the sidecar index of JSON-lines header file `path`."""
+    return path + ".idx"
+
+def _data_stamp(path):
+    """Return the (size, mtime_ns) of `path` recorded in its index to detect stale indices."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def dumps_index(entries, stamp):
+    """Return the bytes of an index for `entries` [ (id_bytes, offset, length), ...] of
+    a data file with (size, mtime_ns) `stamp`.   Later entries for the same id win.
+    """
+    latest = {}
+    for dataset_id, offset, length in entries:
+        latest[dataset_id] = (offset, length)
+    width = max([len(dataset_id) for dataset_id in latest] or [1])
+    parts = [struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, width, len(latest), *stamp)]
+    for dataset_id in sorted(latest):
+        parts.append(dataset_id.ljust(width, b"\0") + struct.pack(RECORD_FORMAT, *latest[dataset_id]))
+    return b"".join(parts)
+
+# ============================================================================
+
+class _IndexIds:
+    """Sequence view of the sorted,  padded dataset ids of an index,  for bisect."""
+
+    def __init__(self, index, width, count):
+        self.index = index
+        self.width = width
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = INDEX_HEADER_SIZE + i * (self.width + RECORD_SIZE)
+        return self.index[start : start + self.width]
+
+
+class SortedHeaderMapping(Mapping):
+    """Read-only mapping { dataset_id : header } which iterates in dataset id order and
+    supports access to runs of consecutive ids by ordinal position.
+    """
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.path) + ")"
+
+    def __contains__(self, dataset_id):
+        return self.position(dataset_id) is not None
+
+    def __getitem__(self, dataset_id):
+        position = self.position(dataset_id)
+        if position is None:
+            raise KeyError(dataset_id)
+        return self._read(position)[1]
+
+    @abc.abstractmethod
+    def position(self, dataset_id):
+        """Return the ordinal of `dataset_id` in the sorted ids of this mapping,  or None."""
+
+    def items(self, start=0, stop=None):
+        """Yield (dataset_id, header) for the dataset ids from ordinal `start` up to `stop`."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(max(start, 0), stop):
+            yield self._read(i)
+
+    @abc.abstractmethod
+    def _read(self, i):
+        """Return (dataset_id, header) for the i-th dataset id."""
+
+    def close(self):
+        """Release any resources held by this mapping."""
+
+
+class HeaderStore(SortedHeaderMapping):
+    """Read-only mapping { dataset_id : header } backed by the JSON-lines header file
+    at `path`.   Iteration yields dataset ids in sorted order.   Headers are parsed
+    from the file each time they're accessed,  except those on lines holding more than
+    one header which are kept as parsed when the file is indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._loaded = {}   # offset : { dataset_id : header } of lines with several headers
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size:
+                self._data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            else:   # empty files cannot be mapped
+                self._data = b""
+        self._index = self._load_index()
+        _magic, _version, self._width, self._count, _size, _mtime = struct.unpack_from(INDEX_HEADER_FORMAT, self._index)
+        self._ids = _IndexIds(self._index, self._width, self._count)
+
+    def _load_index(self):
+        """Return the index of self.path from its sidecar file if it is current,  otherwise
+        by scanning the data file.
+        """
+        ipath = index_path(self.path)
+        try:
+            with open(ipath, "rb") as handle:
+                index = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, _width, _count, size, mtime = struct.unpack_from(INDEX_HEADER_FORMAT, index)
+            if (magic, version) == (INDEX_MAGIC, INDEX_VERSION) and (size, mtime) == _data_stamp(self.path):
+                return index
+            log.verbose("Header index", repr(ipath), "is out of date.  Re-indexing.")
+        except (OSError, ValueError, struct.error):
+            pass
+        return dumps_index(self._scan(), _data_stamp(self.path))
+
+    def _scan(self):
+        """Return [ (id_bytes, offset, length), ...] for every header in the data file."""
+        entries = []
+        offset, data = 0, self._data
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            end = len(data) if end < 0 else end
+            line = data[offset:end]
+            if line.strip():
+                try:
+                    headers = json.loads(line)
+                    if not isinstance(headers, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as exc:
+                    raise ValueError("Not a JSON-lines header file: " + repr(self.path)) from exc
+                for dataset_id in headers:
+                    entries.append((dataset_id.encode("utf-8"), offset, len(line)))
+                if len(headers) > 1:
+                    self._loaded[offset] = headers
+            offset = end + 1
+        return entries
+
+    def close(self):
+        """Release the memory mappings of the data and index files and any parsed lines."""
+        self._loaded = {}
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._ids[i].rstrip(b"\0").decode("utf-8")
+
+    def position(self, dataset_id):
+        """Return the ordinal of `dataset_id` in the sorted ids of this store,  or None."""
+        if not isinstance(dataset_id, str):
+            return None
+        key = dataset_id.encode("utf-8")
+        if len(key) > self._width:
+            return None
+        key = key.ljust(self._width, b"\0")
+        i = bisect.bisect_left(self._ids, key)
+        return i if i < self._count and self._ids[i] == key else None
+
+    def _read(self, i):
+        """Return (dataset_id, header) for the i-th dataset id."""
+        dataset_id = self._ids[i]
+        record = INDEX_HEADER_SIZE + i * (self._width + RECORD_SIZE) + self._width
+        offset, length = struct.unpack_from(RECORD_FORMAT, self._index, record)
+        dataset_id = dataset_id.rstrip(b"\0").decode("utf-8")
+        headers = self._loaded.get(offset)
+        if headers is None:
+            return dataset_id, json.loads(self._data[offset : offset + length])[dataset_id]
+        header = headers[dataset_id]
+        return dataset_id, dict(header) if isinstance(header, dict) else header
+
+
+class HeaderStoreWriter:
+    """Incrementally writes { dataset_id : header } lines to the JSON-lines header file
+    at `path`,  then its sidecar index when closed.   Use as a context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = []
+        self._handle = open(path, "wb+")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, dataset_id, header):
+        """Append `header` for `dataset_id` to the data file."""
+        line = json.dumps({dataset_id: header}).encode("utf-8")
+        self._entries.append((dataset_id.encode("utf-8"), self._handle.tell(), len(line)))
+        self._handle.write(line + b"\n")
+
+    def close(self):
+        """Close the data file and write its index."""
+        if self._handle.closed:
+            return
+        self._handle.close()
+        ipath = index_path(self.path)
+        try:
+            with open(ipath, "wb+") as handle:
+                handle.write(dumps_index(self._entries, _data_stamp(self.path)))
+        except OSError as exc:
+            log.verbose_warning("Failed writing header index", repr(ipath), ":", str(exc))
+        self._entries = []
+
+# ============================================================================
+
+# Columnar .npz snapshots store the same headers as numpy arrays:  "ids" is the
+# sorted dataset ids,  "keys" the keyword names,  and for the i-th keyword
+# "values_<i>" is its distinct JSON encoded values and "codes_<i>" the index of
+# each dataset's value in "values_<i>" or -1 if the dataset has no such keyword.
+# Headers which are error strings rather than dicts are encoded the same way in
+# "codes_errors" and "values_errors".
+
+COLUMNAR_VERSION = 1
+
+def save_columnar(path, headers):
+    """Write the (dataset_id, header) pairs of iterable `headers` to columnar .npz snapshot `path`."""
+    ids, columns, errors = [], {}, ([], {})
+    for dataset_id, header in headers:
+        if isinstance(header, str):
+            _encode(errors, len(ids), header)
+        else:
+            for key, value in header.items():
+                _encode(columns.setdefault(key, ([], {})), len(ids), value)
+        ids.append(dataset_id)
+    order = np.argsort(np.array(ids, dtype=str), kind="stable")
+    arrays = dict(
+        version = np.array(COLUMNAR_VERSION),
+        ids = np.array(ids, dtype=str)[order],
+        keys = np.array(list(columns), dtype=str),
+    )
+    for i, column in enumerate(columns.values()):
+        arrays["codes_" + str(i)], arrays["values_" + str(i)] = _column_arrays(column, len(ids), order)
+    arrays["codes_errors"], arrays["values_errors"] = _column_arrays(errors, len(ids), order)
+    with open(path, "wb+") as handle:
+        np.savez_compressed(handle, **arrays)
+
+def _encode(column, position, value):
+    """Record `value` for the dataset at `position` in dictionary encoded `column`."""
+    codes, values = column
+    codes.extend([-1] * (position - len(codes)))
+    codes.append(values.setdefault(json.dumps(value), len(values)))
+
+def _column_arrays(column, count, order):
+    """Return the (codes, values) arrays of `column` for `count` datasets in sorted `order`."""
+    codes, values = column
+    codes = np.array(codes + [-1] * (count - len(codes)), dtype=np.int32)
+    return codes[order] if count else codes, np.array(list(values), dtype=str)
+
+
+class ColumnarHeaderStore(SortedHeaderMapping):
+    """Read-only mapping { dataset_id : header } loaded from the columnar .npz snapshot
+    at `path`.   If `keys` is specified,  only those keywords are loaded and returned,
+    regardless of case.
+    """
+
+    def __init__(self, path, keys=None):
+        self.path = path
+        wanted = None if keys is None else {key.upper() for key in keys}
+        try:
+            with np.load(path, allow_pickle=False) as snapshot:
+                if int(snapshot["version"]) != COLUMNAR_VERSION:
+                    raise ValueError("unsupported version " + repr(int(snapshot["version"])))
+                self._ids = snapshot["ids"]
+                self._columns = [
+                    (str(key), snapshot["codes_" + str(i)], [json.loads(value) for value in snapshot["values_" + str(i)]])
+                    for (i, key) in enumerate(snapshot["keys"])
+                    if wanted is None or key.upper() in wanted]
+                self._errors = (snapshot["codes_errors"], [json.loads(value) for value in snapshot["values_errors"]])
+        except (OSError, KeyError, ValueError) as exc:
+            raise ValueError("Not a columnar header snapshot: " + repr(path) + " : " + str(exc)) from exc
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for dataset_id in self._ids:
+            yield str(dataset_id)
+
+    def position(self, dataset_id):
+        """Return the ordinal of `dataset_id` in the sorted ids of this snapshot,  or None."""
+        if not isinstance(dataset_id, str):
+            return None
+        i = int(np.searchsorted(self._ids, dataset_id))
+        return i if i < len(self._ids) and self._ids[i] == dataset_id else None
+
+    def _read(self, i):
+        """Return (dataset_id, header) for the i-th dataset id."""
+        codes, values = self._errors
+        if codes[i] >= 0:
+            return str(self._ids[i]), values[codes[i]]
+        header = {}
+        for key, codes, values in self._columns:
+            if codes[i] >= 0:
+                header[key] = values[codes[i]]
+        return str(self._ids[i]), header
+
+    def items(self, start=0, stop=None):
+        """Yield (dataset_id, header) for the dataset ids from ordinal `start` up to `stop`,
+        decoding each column for the whole range at once.
+        """
+        start = max(start, 0)
+        stop = len(self) if stop is None else min(stop, len(self))
+        headers = [{} for _ in range(start, stop)]
+        for key, codes, values in self._columns:
+            for header, code in zip(headers, codes[start:stop].tolist()):
+                if code >= 0:
+                    header[key] = values[code]
+        codes, values = self._errors
+        for i, code in enumerate(codes[start:stop].tolist()):
+            if code >= 0:
+                headers[i] = values[code]
+        yield from zip(self._ids[start:stop].tolist(), headers)
@@ -7,6 +7,8 @@ For more details on the several modes of operations and command line parameters
 """
 import json
 import gc
+import heapq
+from concurrent import futures
 
 # ===================================================================
 
@@ -15,6 +17,7 @@ from crds.core import log, utils, heavy_client
 from crds.core.exceptions import CrdsError
 from crds import data_file, matches
 from crds.client import api
+from . import header_store
 
 import pickle
 
@@ -46,7 +49,7 @@ class HeaderGenerator:
 
     def __iter__(self):
         """Return the sources from self with EXPTIME >= self.datasets_since."""
-        for source in sorted(self.sources):
+        for source in self.sorted_sources():
             with log.error_on_exception("Failed loading source", repr(source),
                                         "from", repr(self.__class__.__name__)):
                 instrument = utils.header_to_instrument(self.header(source))
@@ -60,6 +63,13 @@ class HeaderGenerator:
                                 "with EXPTIME =", repr(exptime),
                                 "< --datasets-since =", repr(since))
 
+    def sorted_sources(self):
+        """Return the sources of this generator in sorted order."""
+        return sorted(self.sources)
+
+    def close(self):
+        """Release any resources held for generating headers."""
+
     def datasets_since(self, instrument):
         """Return the earliest dataset processed cut-off date for `instrument`.
 
@@ -75,10 +85,14 @@ class HeaderGenerator:
             return self._datasets_since
 
     def header(self, source):
-        """Return the full header corresponding to `source`.   If header is a string, raise an exception."""
+        """Return the full header corresponding to `source`.   If header is a string, raise an exception.
+        If header is an exception,  e.g. a fetch failure carried to a bestrefs --jobs worker,  raise it.
+        """
         header = self._header(source)
         if isinstance(header, str):
             raise CrdsError("Failed to fetch header for " + repr(source) + ": " + repr(header))
+        elif isinstance(header, Exception):
+            raise header
         else:
             return dict(header)
 
@@ -108,21 +122,29 @@ class HeaderGenerator:
         return result
 
     def save_pickle(self, outpath, only_ids=None):
-        """Write out headers to `outpath` file which can be a Python pickle or .json"""
-        if only_ids is None:
-            only_hdrs = self.headers
-        else:
-            only_hdrs = {dataset_id: hdr for (dataset_id, hdr) in self.headers.items() if dataset_id in only_ids}
+        """Write out headers to `outpath` file which can be a Python pickle or .json
+
+        .json files are written one header at a time with a sidecar index,  .npz files are
+        columnar snapshots,  see header_store.
+        """
         log.info("Writing all headers to", repr(outpath))
         if outpath.endswith(".json"):
-            with open(outpath, "w+") as pick:
-                for dataset, header in sorted(only_hdrs.items()):
-                    pick.write(json.dumps({dataset: header}) + "\n")
+            with header_store.HeaderStoreWriter(outpath) as store:
+                for dataset, header in self.saved_headers(only_ids):
+                    store.write(dataset, header)
+        elif outpath.endswith(".npz"):
+            header_store.save_columnar(outpath, self.saved_headers(only_ids))
         elif outpath.endswith(".pkl"):
             with open(outpath, "wb+") as pick:
-                pickle.dump(only_hdrs, pick)
+                pickle.dump(dict(self.saved_headers(only_ids)), pick)
         log.info("Done writing", repr(outpath))
 
+    def saved_headers(self, only_ids=None):
+        """Yield (dataset_id, header) in dataset_id order for the headers written by save_pickle()."""
+        for dataset_id, header in sorted(self.headers.items()):
+            if only_ids is None or dataset_id in only_ids:
+                yield dataset_id, header
+
     def update_headers(self, headers2, only_ids=None):
         """Incorporate `headers2` updated values into `self.headers`.  Since `headers2` may be incomplete,
         do param-by-param update.   Nominally,  this is to add OPUS bestrefs corrections (definitive) to DADSOPS
@@ -258,12 +280,21 @@ def _normalize_jwst_id_part(part):
 class InstrumentHeaderGenerator(HeaderGenerator):
     """Generates lookup parameters and historical best references from a list of instrument names.  Server/DB based."""
 
-    def __init__(self, context, instruments, datasets_since, save_pickles, server_info):
-        """"Contact the CRDS server and get headers for the list of `instruments` names with respect to `context`."""
+    def __init__(self, context, instruments, datasets_since, save_pickles, server_info, prefetch_depth=0):
+        """"Contact the CRDS server and get headers for the list of `instruments` names with respect to `context`.
+
+        `prefetch_depth` is the number of segments following the one being processed which are
+        requested from the server in background threads,  overlapping network latency with bestrefs.
+        0 fetches each segment only when it is first needed.
+        """
         super(InstrumentHeaderGenerator, self).__init__(context, [], datasets_since)
         self.instruments = instruments
         self.sources = self.determine_source_ids()
         self.save_pickles = save_pickles
+        self.prefetch_depth = max(0, prefetch_depth)
+        self._previous_segment = {}
+        self._prefetched = {}   # segment index : Future of segment headers
+        self._executor = None
         try:
             self.segment_size = server_info.max_headers_per_rpc
         except Exception:
@@ -293,12 +324,31 @@ class InstrumentHeaderGenerator(HeaderGenerator):
             self.fetch_source_segment(source)
         return self.headers[source]
 
+    @property
+    def segment_count(self):
+        """The number of segments needed to fetch all of self.sources."""
+        return (len(self.sources) + self.segment_size - 1) // self.segment_size
+
     def fetch_source_segment(self, source):
-        """Return the segment of dataset ids which surrounds id `source`."""
+        """Fetch the segment of dataset ids which surrounds id `source`,  starting background
+        requests for the following self.prefetch_depth segments.
+        """
         try:
             index = self.sources.index(source) // self.segment_size
         except ValueError as exc:
             raise CrdsError("Unknown dataset id " + repr(source)) from exc
+        future = self._prefetched.pop(index, None)
+        self.prefetch_segments(index + 1)
+        dumped_headers = future.result() if future is not None else self.fetch_segment(index)
+        if self.save_pickles:  # keep all headers,  causes memory problems with multiple instruments on ~8G ram.
+            self.headers.update(dumped_headers)
+        else:  # conserve memory by keeping only the last two segments,  enough for a bestrefs batch to span them
+            self.headers = dict(self._previous_segment)
+            self.headers.update(dumped_headers)
+            self._previous_segment = dumped_headers
+
+    def fetch_segment(self, index):
+        """Return the headers of the dataset ids in segment `index` of self.sources."""
         lower = index * self.segment_size
         upper = (index + 1) * self.segment_size
         segment_ids = self.sources[lower:upper]
@@ -306,38 +356,176 @@ class InstrumentHeaderGenerator(HeaderGenerator):
                     lower + len(segment_ids), verbosity=20)
         dumped_headers = api.get_dataset_headers_by_id(self.context, segment_ids)
         log.verbose("Dumped", len(dumped_headers), "datasets", verbosity=20)
-        if self.save_pickles:  # keep all headers,  causes memory problems with multiple instruments on ~8G ram.
-            self.headers.update(dumped_headers)
-        else:  # conserve memory by keeping only the last N headers
-            self.headers = dumped_headers
+        return dumped_headers
+
+    def prefetch_segments(self, first):
+        """Ensure segments `first` through `first` + self.prefetch_depth - 1 are being fetched in
+        the background,  abandoning any prefetched segments before `first` - 1.   At most
+        self.prefetch_depth segments are held in reserve,  bounding memory use.
+        """
+        if not self.prefetch_depth:
+            return
+        for index in [index for index in self._prefetched if index < first - 1]:
+            self._prefetched.pop(index).cancel()
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=self.prefetch_depth, thread_name_prefix="crds-headers")
+        for index in range(first, min(first + self.prefetch_depth, self.segment_count)):
+            if index not in self._prefetched:
+                self._prefetched[index] = self._executor.submit(self.fetch_segment, index)
+
+    def close(self):
+        """Abandon any prefetched segments and stop the background fetch threads."""
+        for future in self._prefetched.values():
+            future.cancel()
+        self._prefetched = {}
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
 
 class PickleHeaderGenerator(HeaderGenerator):
     """Generates lookup parameters and historical best references from a list of pickle files (or .json files)
     using successive updates to sets of header dictionaries.  Trailing pickles override leading pickles.
+
+    JSON-lines .json files are read lazily through a HeaderStore,  keeping only the headers of the
+    current and previous segments of sorted dataset ids in memory,  so memory use doesn't grow with
+    the number of datasets.   self.headers holds only headers which have been updated or assigned.
     """
 
-    def __init__(self, context, pickles, datasets_since, only_ids=None):
-        """"Contact the CRDS server and get headers for the list of `datasets` ids with respect to `context`."""
+    segment_size = 5000
+
+    def __init__(self, context, pickles, datasets_since, only_ids=None, keys=None):
+        """"Contact the CRDS server and get headers for the list of `datasets` ids with respect to `context`.
+
+        If `keys` is specified,  columnar .npz snapshots are loaded with only those keywords.
+        """
         super(PickleHeaderGenerator, self).__init__(context, pickles, datasets_since)
+        self.only_ids = only_ids
+        self.stores = []    # [ complete headers,  partial header updates, ... ]
+        self._segment_headers = {}
+        self._previous_segment = {}
         for pickle in pickles:
             log.info("Loading file", repr(pickle))
-            pick_headers = load_bestrefs_headers(pickle)
-            if not self.headers:
+            pick_headers = open_bestrefs_headers(pickle, keys=keys)
+            if not sum(len(store) for store in self.stores):
                 log.info("Loaded", len(pick_headers), "datasets from file", repr(pickle),
                          "completely replacing existing headers.")
-                self.headers.update(pick_headers)   # replace all of dataset_id
+                self.stores = [pick_headers]   # replace all of dataset_id
             else:  # OPUS bestrefs don't include original matching parameters,  so full replacement doesn't work.
                 log.info("Loaded", len(pick_headers), "datasets from file", repr(pickle),
                          "augmenting existing headers.")
-                self.update_headers(pick_headers, only_ids=only_ids)
-        self.sources = only_ids or self.headers.keys()
+                self.stores.append(pick_headers)
+        self.sources = only_ids
+
+    def sorted_sources(self):
+        """Return the dataset ids of --only-ids or of the loaded files in sorted order,  without
+        loading their headers.
+        """
+        if self.sources:
+            return sorted(self.sources)
+        return self._stored_ids()
+
+    def _stored_ids(self):
+        """Yield the unique ids of all loaded files in sorted order.   Ids found only in the update
+        files are dropped if --only-ids is specified or their headers are bad.
+        """
+        streams = [store if isinstance(store, header_store.SortedHeaderMapping) else sorted(store)
+                   for store in self.stores]
+        previous = None
+        for dataset_id in heapq.merge(*streams):
+            if dataset_id != previous:
+                previous = dataset_id
+                if (dataset_id in self.stores[0] or dataset_id in self.headers or
+                    self._stored_header(dataset_id) is not None):
+                    yield dataset_id
+
+    def _header(self, source):
+        """Return the header of dataset id `source` from updated headers or the loaded files."""
+        if source in self.headers:
+            return self.headers[source]
+        header = self._stored_header(source)
+        if header is None:
+            raise KeyError(source)
+        return header
+
+    def _stored_header(self, source):
+        """Return the header of dataset id `source` loaded from the first file and updated
+        parameter-by-parameter from the rest,  or None if there is none.
+        """
+        if source not in self._segment_headers:
+            self.fetch_source_segment(source)
+        header = self._segment_headers.get(source)
+        if self.only_ids is not None and source not in self.only_ids:
+            return header
+        for store in self.stores[1:]:
+            update = store.get(source)
+            if update is None:
+                continue
+            if isinstance(update, str):
+                log.warning("Skipping bad dataset", source, ":", update)
+                continue
+            header = {} if header is None else dict(header)
+            header.update({key.upper(): bestrefs_condition(val) for (key, val) in update.items()})
+        return header
+
+    def fetch_source_segment(self, source):
+        """Read the segment of sorted dataset ids which surrounds id `source` from the first file,
+        keeping it and the previous segment.
+        """
+        store = self.stores[0] if self.stores else {}
+        if not isinstance(store, header_store.SortedHeaderMapping):
+            self._segment_headers = store
+            return
+        position = store.position(source)
+        if position is None:
+            return
+        lower = position - position % self.segment_size
+        segment = dict(store.items(lower, lower + self.segment_size))
+        self._segment_headers = dict(self._previous_segment)
+        self._segment_headers.update(segment)
+        self._previous_segment = segment
+
+    def all_headers(self):
+        """Return { dataset_id : header } for all the headers of this generator."""
+        return dict(self.saved_headers())
+
+    def saved_headers(self, only_ids=None):
+        """Yield (dataset_id, header) in dataset_id order for the headers written by save_pickle(),
+        reading them from the loaded files as they're written.
+        """
+        for dataset_id in self._stored_ids():
+            if only_ids is None or dataset_id in only_ids:
+                yield dataset_id, self._header(dataset_id)
+
+    def update_headers(self, headers2, only_ids=None):
+        """Copy any loaded headers updated by `headers2` into self.headers before updating them."""
+        for dataset_id in headers2:
+            if dataset_id not in self.headers and (only_ids is None or dataset_id in only_ids):
+                header = self._stored_header(dataset_id)
+                if isinstance(header, dict):
+                    self.headers[dataset_id] = dict(header)
+        super(PickleHeaderGenerator, self).update_headers(headers2, only_ids=only_ids)
+
+    def handle_updates(self, all_updates):
+        """Copy the loaded headers of datasets with updates into self.headers before updating them."""
+        for dataset in all_updates:
+            if all_updates[dataset] and dataset not in self.headers:
+                self.headers[dataset] = dict(self._stored_header(dataset))
+        super(PickleHeaderGenerator, self).handle_updates(all_updates)
+
+    def close(self):
+        """Release the loaded header files."""
+        for store in self.stores:
+            if isinstance(store, header_store.SortedHeaderMapping):
+                store.close()
+        self.stores = []
 
 # ============================================================================
 
 def load_bestrefs_headers(path):
     """Given `path` to a serialization file,  load  {dataset_id : header, ...}.
-    Supports .pkl and .json.
+    Supports .pkl, .json, and columnar .npz.
 
     For easier editing and syntax error precision,  .json files are stored as
     one header per line.
@@ -357,10 +545,43 @@ def load_bestrefs_headers(path):
     elif path.endswith(".pkl"):
         with open(path, "rb") as pick:
             headers = pickle.load(pick)
+    elif path.endswith(".npz"):
+        headers = dict(header_store.ColumnarHeaderStore(path).items())
     else:
-        raise ValueError("Valid serialization formats are .json and .pkl")
+        raise ValueError("Valid serialization formats are .json, .npz, and .pkl")
     return headers
 
+def open_bestrefs_headers(path, keys=None):
+    """Given `path` to a serialization file,  return a mapping {dataset_id : header, ...}.
+    JSON-lines .json files are opened as a HeaderStore which reads headers on demand,
+    .npz files as a ColumnarHeaderStore with only the keywords `keys` if specified,
+    other files are loaded by load_bestrefs_headers().
+    """
+    if path.endswith(".json"):
+        try:
+            return header_store.HeaderStore(path)
+        except ValueError:
+            pass
+    elif path.endswith(".npz"):
+        return header_store.ColumnarHeaderStore(path, keys=keys)
+    return load_bestrefs_headers(path)
+
+def context_header_keys(contexts):
+    """Return the header keywords bestrefs uses with `contexts`:  the matching parameters of
+    every instrument from get_required_parkeys(),  the keywords recording best references,
+    and the instrument and exposure time keywords.
+    """
+    keys = set(utils.INSTRUMENT_KEYWORDS)
+    for pair in matches.DATE_TIME_PAIRS:
+        keys.update(pair)
+    for context in contexts:
+        pmap = crds.get_pickled_mapping(context)
+        for instrument, parkeys in pmap.get_required_parkeys().items():
+            keys.update(parkeys)
+            for filekind in pmap.get_imap(instrument).selections:
+                keys.update([filekind, pmap.locate.filekind_to_keyword(filekind)])
+    return sorted({key.upper() for key in keys})
+
 def add_instrument(header):
     """Add INSTRUME keyword."""
     instrument = utils.header_to_instrument(header)
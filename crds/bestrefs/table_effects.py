@@ -9,7 +9,9 @@ a dataset to be processed.
 
 If the rows are different,  then the dataset should be reprocessed.
 """
-from crds.core import rmap, log
+import numpy as np
+
+from crds.core import rmap, log, utils, config
 from crds.io import tables
 from crds.client import api
 
@@ -165,6 +167,86 @@ def mode_select(table, constraints):
         if selected:
             yield row
 
+class ModeTable:
+    """Wraps a SimpleTable for repeated mode selections.   Each column used for selection is
+    factored into its distinct values once,  so a comparison function is evaluated once per
+    distinct value and rows are selected with a NumPy boolean mask.
+
+    >>> import os.path, crds.tests
+    >>> table = tables.SimpleTable(os.path.join(os.path.dirname(crds.tests.__file__), "data", "ascii_tab.csv"))
+    >>> mode_table = ModeTable(table)
+    >>> rows = mode_table.mode_rows({"obsid": (3102, cmp_equal, {"wildcards": ["ANY"]})})
+    >>> rows == sorted(repr(row) for row in mode_select(table, {"obsid": (3102, cmp_equal, {"wildcards": ["ANY"]})}))
+    True
+    >>> len(rows)
+    1
+    """
+    def __init__(self, table):
+        self.table = table
+        self.colnames = table.colnames
+        self.row_reprs = np.array([repr(row) for row in table.rows], dtype=object)
+        self._factors = {}
+
+    def factor(self, colname):
+        """Return (codes, distinct_values) for column `colname` converted by str_to_number()
+        where codes are the indices into distinct_values of each row.
+        """
+        if colname not in self._factors:
+            index = self.colnames.index(colname)
+            values = [str_to_number(row[index]) for row in self.table.rows]
+            try:
+                positions = {}
+                codes = [positions.setdefault(value, len(positions)) for value in values]
+                distinct = list(positions)
+            except TypeError:   # unhashable cells,  e.g. arrays,  are compared row by row
+                codes, distinct = range(len(values)), values
+            self._factors[colname] = (np.array(codes, dtype=int), distinct)
+        return self._factors[colname]
+
+    def select(self, constraints):
+        """Return a boolean mask of the rows matching `constraints`,  see mode_select()."""
+        mask = np.ones(len(self.row_reprs), dtype=bool)
+        for field, (value, cmpfn, args) in constraints.items():
+            codes, distinct = self.factor(field.upper())
+            matches = np.array([bool(cmpfn(cell, value, args)) for cell in distinct], dtype=bool)
+            mask &= matches[codes]
+        return mask
+
+    def mode_rows(self, constraints):
+        """Return the sorted repr()'s of the rows matching `constraints`."""
+        return sorted(self.row_reprs[self.select(constraints)])
+
+_MODE_TABLES = None    # utils.LRUCache of { filename : ModeTable }
+_COMPARISONS = None    # utils.LRUCache of { (rule, old_reference, new_reference, constraints) : (is_different, message) }
+
+def get_mode_table(filename):
+    """Return the ModeTable for the first table segment of `filename`,  keeping the most
+    recently used CRDS_TABLE_EFFECTS_CACHE_SIZE tables in memory.
+    """
+    global _MODE_TABLES
+    if _MODE_TABLES is None:
+        _MODE_TABLES = utils.LRUCache(max(config.TABLE_EFFECTS_CACHE_SIZE.get(), 1))
+    mode_table = _MODE_TABLES.get(filename)
+    if mode_table is None:
+        mode_table = ModeTable(tables.tables.uncached(filename)[0])   # XXXX currently limited to FITS extension 1
+        _MODE_TABLES[filename] = mode_table
+    return mode_table
+
+def get_comparisons():
+    """Return the cache of DeepLook comparison results,  keeping the most recently used
+    CRDS_TABLE_EFFECTS_COMPARISONS_CACHE_SIZE results.
+    """
+    global _COMPARISONS
+    if _COMPARISONS is None:
+        _COMPARISONS = utils.LRUCache(max(config.TABLE_EFFECTS_COMPARISONS_CACHE_SIZE.get(), 1))
+    return _COMPARISONS
+
+def clear_cache():
+    """Clear the tables and comparison results cached by DeepLook."""
+    global _MODE_TABLES, _COMPARISONS
+    _MODE_TABLES = None
+    _COMPARISONS = None
+
 def mode_equality(modes_a, modes_b):
     """Check if the modes are equal"""
 
@@ -322,9 +404,26 @@ class DeepLook:
                 if constraint_values[key] in self.metavalues[key]:
                     constraint_values[key] = self.metavalues[key][constraint_values[key]]
 
+        # Each distinct mode of a pair of references is only compared once.
+        comparison = (self.__class__.__name__, old_reference, new_reference,
+                      tuple(sorted((field, repr(value)) for (field, value) in constraint_values.items())))
+        comparisons = get_comparisons()
+        result = comparisons.get(comparison)
+        if result is not None:
+            self.is_different, self.message = result
+            log.verbose(self.preamble, 'Reusing comparison for', comparison, verbosity=75)
+            return
+
+        self.compare_tables(constraint_values, old_reference, new_reference)
+        comparisons[comparison] = (self.is_different, self.message)
+
+    def compare_tables(self, constraint_values, old_reference, new_reference):
+        """Compare the rows of `old_reference` and `new_reference` selected by `constraint_values`
+        setting self.is_different and self.message.
+        """
         # Read the references
-        data_old = tables.tables(old_reference)[0]   # XXXX currently limited to FITS extension 1
-        data_new = tables.tables(new_reference)[0]
+        data_old = get_mode_table(old_reference)
+        data_new = get_mode_table(new_reference)
 
         # Columns must be the same between tables.
         if sorted(data_old.colnames) != sorted(data_new.colnames):
@@ -340,13 +439,9 @@ class DeepLook:
         log.verbose(self.preamble, 'Constraints are:\n', constraints, verbosity=75)
 
         # Reduce the tables to just those rows that match the mode
-        # specifications.
-        mode_rows_old = [repr(row) for row in mode_select(data_old, constraints)]
-        mode_rows_new = [repr(row) for row in mode_select(data_new, constraints)]
-
-        # Sort the rows
-        mode_rows_old.sort()
-        mode_rows_new.sort()
+        # specifications,  sorted.
+        mode_rows_old = data_old.mode_rows(constraints)
+        mode_rows_new = data_new.mode_rows(constraints)
 
         log.verbose(self.preamble, 'Old reference matching rows:\n', mode_rows_old, verbosity=75)
         log.verbose(self.preamble, 'New reference matching rows:\n', mode_rows_new, verbosity=75)
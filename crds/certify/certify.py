@@ -1009,6 +1009,8 @@ For more information on the checks being performed,  use --verbose or --verbosit
                           help="Do a dry-run of adding reference files to the appropriate rmaps to detect errors.")
         self.add_argument("-k", "--check-sha1sums", action="store_true",
                           help="Check certified files to see if any are identical to files already in CRDS.")
+        self.add_argument("--force-rehash", action="store_true",
+                          help="For --check-sha1sums,  recompute sha1sums even for files unchanged since recorded in the checksum ledger.")
 
 
         cmdline.UniqueErrorsMixin.add_args(self)
@@ -1028,6 +1030,9 @@ For more information on the checks being performed,  use --verbose or --verbosit
         if self.args.allow_schema_violations:
             config.ALLOW_SCHEMA_VIOLATIONS.set(True)
 
+        if self.args.force_rehash:
+            config.FORCE_REHASH.set(True)
+
         if not self.args.dont_recurse_mappings:
             all_files = self.mapping_closure(self.files)
         else:
@@ -12,6 +12,7 @@ from urllib import request
 import warnings
 import json
 import ast
+from concurrent import futures
 
 # ==============================================================================
 
@@ -25,7 +26,7 @@ from crds.core.exceptions import ServiceError, CrdsLookupError
 from crds.core.exceptions import CrdsNetworkError, CrdsDownloadError
 from crds.core.exceptions import CrdsRemoteContextError
 
-from . import proxy
+from . import proxy, rpc_cache
 from .proxy import CheckingProxy
 
 # ==============================================================================
@@ -110,6 +111,38 @@ def get_crds_server():
 
 # =============================================================================
 
+def _cached_rpc(method, *params):
+    """Call JSONRPC `method` of the CRDS server with positional `params`,  reusing
+    a response from the on-disk RPC cache when CRDS_RPC_CACHE is enabled.
+    """
+    func = getattr(S, method)
+    if not config.RPC_CACHE.get():
+        return func(*params)
+    server_version = _rpc_cache_server_version()
+    if server_version is None:
+        return func(*params)
+    return rpc_cache.cached_call(func, method, params, URL, server_version)
+
+_RPC_CACHE_VERSION_PENDING = []
+
+def _rpc_cache_server_version():
+    """Return the server version used to key cached RPC responses,  or None if it
+    is not available.   Determining the version can itself require cacheable RPCs,
+    those are not cached.
+    """
+    if _RPC_CACHE_VERSION_PENDING:
+        return None
+    _RPC_CACHE_VERSION_PENDING.append(True)
+    try:
+        return get_server_version()
+    except Exception as exc:
+        log.verbose("Not using RPC cache,  server version unavailable:", str(exc))
+        return None
+    finally:
+        _RPC_CACHE_VERSION_PENDING.pop()
+
+# ==============================================================================
+
 @utils.cached
 def list_mappings(observatory=None, glob_pattern="*"):
     """Return the list of mappings associated with `observatory`
@@ -144,7 +177,7 @@ def get_mapping_names(pipeline_context):
     for the specified pipeline_context.   context can be an observatory,
     pipeline, or instrument context.
     """
-    return [str(x) for x in S.get_mapping_names(pipeline_context)]
+    return [str(x) for x in _cached_rpc("get_mapping_names", pipeline_context)]
 
 def get_reference_url(pipeline_context, reference):
     """Returns a URL for the specified reference file.    DEPRECATED
@@ -219,7 +252,7 @@ def get_file_info_map(observatory, files=None, fields=None):
 @utils.cached
 def _get_file_info_map(observatory, files, fields):
     """Memory cached version of get_file_info_map() service."""
-    infos = S.get_file_info_map(observatory, files, fields)
+    infos = _cached_rpc("get_file_info_map", observatory, files, fields)
     return infos
 
 def get_total_bytes(info_map):
@@ -404,7 +437,7 @@ def get_server_version():
 def get_dataset_headers_by_id(context, dataset_ids, datasets_since=None):
     """Return { dataset_id : { header } } for `dataset_ids`."""
     context = os.path.basename(context)
-    return S.get_dataset_headers_by_id(context, dataset_ids, datasets_since)
+    return _cached_rpc("get_dataset_headers_by_id", context, dataset_ids, datasets_since)
 
 def get_dataset_ids(context, instrument, datasets_since=None):
     """Return [ dataset_id, ...] for `instrument`."""
@@ -434,12 +467,19 @@ def get_dataset_headers_unlimited(context, ids):
     `header` will be returned as a string / error message.
     """
     max_ids_per_rpc = get_server_info().get("max_headers_per_rpc", 500)
-    for i in range(0, len(ids), max_ids_per_rpc):
-        log.verbose("Dumping dataset headers", i , "of", len(ids), verbosity=20)
-        id_slice = ids[i : i + max_ids_per_rpc]
-        header_slice = get_dataset_headers_by_id(context, id_slice)
-        for item in header_slice.items():
-            yield item
+    batch_size = max(config.RPC_BATCH_SIZE.get(), 1)
+    id_slices = [ids[i : i + max_ids_per_rpc] for i in range(0, len(ids), max_ids_per_rpc)]
+    for i in range(0, len(id_slices), batch_size):
+        log.verbose("Dumping dataset headers", i * max_ids_per_rpc, "of", len(ids), verbosity=20)
+        batch = id_slices[i : i + batch_size]
+        if len(batch) == 1:
+            header_slices = [get_dataset_headers_by_id(context, batch[0])]
+        else:
+            header_slices = S._batch_call(
+                [("get_dataset_headers_by_id", (os.path.basename(context), id_slice, None)) for id_slice in batch])
+        for header_slice in header_slices:
+            for item in header_slice.items():
+                yield item
 
 def get_affected_datasets(observatory, old_context=None, new_context=None):
     """Return a structure describing the ids affected by the last context change."""
@@ -450,7 +490,7 @@ def get_context_history(observatory):
 
      Returns:  [ (start_date, context_name, description), ... ]
     """
-    return sorted(tuple(x) for x in S.get_context_history(observatory))
+    return sorted(tuple(x) for x in _cached_rpc("get_context_history", observatory))
 
 def push_remote_context(observatory, kind, key, context):
     """Upload the specified `context` of type `kind` (e.g. "operational") to the
@@ -619,12 +659,17 @@ class FileCacher:
         return int(self.info_map[os.path.basename(name)]["size"])
 
     def download_files(self, downloads, localpaths):
-        """Serial file-by-file download."""
+        """Download `downloads` to `localpaths`,  file-by-file or concurrently
+        based on CRDS_DOWNLOAD_WORKERS.   Return the number of bytes downloaded.
+        """
         download_metadata = get_download_metadata()
         self.info_map = {}
         for filename in downloads:
             self.info_map[filename] = download_metadata.get(filename, "NOT FOUND unknown to server")
         if config.writable_cache_or_verbose("Readonly cache, skipping download of (first 5):", repr(downloads[:5]), verbosity=70):
+            workers = min(config.DOWNLOAD_WORKERS.get(), len(downloads))
+            if workers > 1:
+                return self.download_files_parallel(downloads, localpaths, workers)
             bytes_so_far = 0
             total_files = len(downloads)
             total_bytes = get_total_bytes(self.info_map)
@@ -644,6 +689,44 @@ class FileCacher:
             return bytes_so_far
         return 0
 
+    def download_files_parallel(self, downloads, localpaths, workers):
+        """Download `downloads` to `localpaths` using a pool of `workers` threads,
+        reporting aggregate progress as each file completes.   Return the number of
+        bytes downloaded.
+        """
+        log.verbose("Downloading", len(downloads), "files with", workers, "threads.")
+        total_files = len(downloads)
+        total_bytes = get_total_bytes(self.info_map)
+        bytes_so_far, errors = 0, []
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(self._download_one, name, localpaths[name]) : name
+                       for name in downloads}
+            for nth_file, future in enumerate(futures.as_completed(pending)):
+                name = pending[future]
+                try:
+                    bytes = future.result()
+                except Exception as exc:
+                    if self.raise_exceptions:
+                        errors.append(exc)
+                        for other in pending:
+                            other.cancel()
+                    else:
+                        log.error("Failure downloading file", repr(name), ":", str(exc))
+                    continue
+                bytes_so_far += bytes
+                log.info(file_progress("Fetched", name, localpaths[name], bytes, bytes_so_far,
+                                       total_bytes, nth_file, total_files))
+        if errors:
+            raise errors[0]
+        return bytes_so_far
+
+    def _download_one(self, name, localpath):
+        """Download one file `name` to `localpath`,  returning its size."""
+        if "NOT FOUND" in self.info_map[name]:
+            raise CrdsDownloadError("file is not known to CRDS server.")
+        self.download(name, localpath)
+        return os.stat(localpath).st_size
+
     def download(self, name, localpath):
         """Download a single file."""
         # This code is complicated by the desire to blow away failed downloads.  For the specific
@@ -674,17 +757,53 @@ class FileCacher:
             log.verbose("Exception during file removal of", repr(localpath))
 
     def download_core(self, name, localpath):
-        """Download and verify file `name` under context `pipeline_context` to `localpath`."""
+        """Download and verify file `name` under context `pipeline_context` to `localpath`.
+
+        HTTP downloads are written to `localpath`.part and resumed from any
+        existing partial file,  which is renamed to `localpath` once verified.
+        The sha1sum and size of HTTP downloads are computed as the data streams
+        to disk.   Plugin downloads are written by an external program so they
+        are read back to verify them.
+        """
         if config.get_download_plugin():
             self.plugin_download(name, localpath)
-        else:
-            generator = self.get_data_http(name)
-            self.generator_download(generator, localpath)
-        self.verify_file(name, localpath)
+            self.verify_file(name, localpath)
+            return
+        partpath = localpath + ".part"
+        offset = self.part_file_offset(name, partpath)
+        xsum = utils.StreamingChecksum()
+        if offset:
+            xsum.update_file(partpath, offset)
+        generator = xsum.stream(self.get_data_http(name, offset))
+        self.generator_download(generator, partpath, offset)
+        try:
+            self.verify_file(name, partpath, xsum)
+        except Exception:
+            self.remove_file(partpath)
+            raise
+        os.replace(partpath, localpath)
 
-    def generator_download(self, generator, localpath):
-        """Read all bytes from `generator` until file is downloaded to `localpath.`"""
-        with open(localpath, "wb+") as outfile:
+    def part_file_offset(self, name, partpath):
+        """Return the size of the partial download of `name` at `partpath` which can
+        be resumed,  or 0 to start the download from scratch.
+        """
+        try:
+            offset = os.stat(partpath).st_size
+        except OSError:
+            return 0
+        if 0 < offset < self.catalog_file_size(name):
+            log.verbose("Resuming download of", repr(name), "at byte", offset)
+            return offset
+        self.remove_file(partpath)
+        return 0
+
+    def generator_download(self, generator, localpath, offset=0):
+        """Read all bytes from `generator` until file is downloaded to `localpath.`
+        If `offset` is non-zero,  append to the first `offset` bytes of an existing file.
+        """
+        with open(localpath, "rb+" if offset else "wb+") as outfile:
+            outfile.seek(offset)
+            outfile.truncate()
             for data in generator:
                 outfile.write(data)
 
@@ -706,11 +825,25 @@ class FileCacher:
                     "Plugin download fail status =", repr(status),
                     "with command:", srepr(plugin_cmd))
 
-    def get_data_http(self, filename):
-        """Yield the data returned from `filename` of `pipeline_context` in manageable chunks."""
+    def get_data_http(self, filename, offset=0):
+        """Yield the data returned from `filename` of `pipeline_context` in manageable chunks.
+
+        If `offset` is non-zero,  yield only the data following the first `offset` bytes,
+        requesting them with an HTTP Range header.
+        """
         url = self.get_url(filename)
         try:
-            infile = request.urlopen(url)
+            if offset:
+                infile = request.urlopen(request.Request(url, headers={"Range" : "bytes={}-".format(offset)}))
+                if getattr(infile, "status", None) != 206:   # Range not honored,  skip resumed bytes
+                    log.verbose("Range request not honored for", repr(url), "discarding", offset, "bytes.")
+                    while offset:
+                        skipped = infile.read(min(offset, config.CRDS_DATA_CHUNK_SIZE))
+                        if not skipped:
+                            break
+                        offset -= len(skipped)
+            else:
+                infile = request.urlopen(url)
             file_size = utils.human_format_number(self.catalog_file_size(filename)).strip()
             stats = utils.TimingStats()
             data = infile.read(config.CRDS_DATA_CHUNK_SIZE)
@@ -735,10 +868,14 @@ class FileCacher:
         """Return the URL used to fetch `filename` of `pipeline_context`."""
         return get_flex_uri(filename, self.observatory)
 
-    def verify_file(self, filename, localpath):
-        """Check that the size and checksum of downloaded `filename` match the server."""
+    def verify_file(self, filename, localpath, xsum=None):
+        """Check that the size and checksum of downloaded `filename` match the server.
+
+        If `xsum` is a utils.StreamingChecksum computed during the download,  use its
+        size and sha1sum rather than re-reading `localpath`.
+        """
         remote_info = self.info_map[filename]
-        local_length = os.stat(localpath).st_size
+        local_length = xsum.size if xsum is not None else os.stat(localpath).st_size
         original_length = int(remote_info["size"])
         if original_length != local_length and config.get_length_flag():
             raise CrdsDownloadError(
@@ -748,7 +885,7 @@ class FileCacher:
             log.verbose("Skipping sha1sum with CRDS_DOWNLOAD_CHECKSUMS=False")
         elif remote_info["sha1sum"] not in ["", "none"]:
             original_sha1sum = remote_info["sha1sum"]
-            local_sha1sum = utils.checksum(localpath)
+            local_sha1sum = xsum.hexdigest() if xsum is not None else utils.checksum(localpath)
             if original_sha1sum != local_sha1sum:
                 raise CrdsDownloadError(
                     "downloaded file", srepr(filename),
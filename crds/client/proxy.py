@@ -8,7 +8,9 @@ import json
 import time
 import os
 
-from urllib import request
+from urllib import request, parse, error
+import http.client
+import threading
 import html
 import gzip
 import base64
@@ -63,6 +65,73 @@ try:
 except Exception:
     _PROCESS_ID = "00000000-0000-0000-00000000000000000"
 
+# ============================================================================
+
+_CONNECTIONS = threading.local()
+
+def _connection_pool():
+    """Return this thread's { (scheme, netloc) : connection } pool,  discarding any
+    pool inherited from a parent process.
+    """
+    if getattr(_CONNECTIONS, "pid", None) != os.getpid():
+        _CONNECTIONS.pool, _CONNECTIONS.pid = {}, os.getpid()
+    return _CONNECTIONS.pool
+
+def close_connections():
+    """Close this thread's persistent connections to CRDS servers."""
+    pool = _connection_pool()
+    for connection in pool.values():
+        connection.close()
+    pool.clear()
+
+def _uses_proxy(parts):
+    """Return True IFF the environment defines an HTTP proxy for URL `parts`."""
+    return parts.scheme in request.getproxies() and not request.proxy_bypass(parts.hostname or "")
+
+def post(url, data):
+    """POST bytes `data` to `url` and return the response body as bytes.
+
+    http and https requests reuse a keep-alive connection per server and thread
+    unless CRDS_CLIENT_KEEP_ALIVE is False.   Other URLs,  proxied URLs,  and
+    redirects are handled by urlopen().   HTTP error statuses raise
+    urllib.error.HTTPError like urlopen().
+    """
+    parts = parse.urlsplit(url)
+    if not config.CLIENT_KEEP_ALIVE.get() or parts.scheme not in ["http", "https"] or _uses_proxy(parts):
+        return request.urlopen(url, data).read()
+    pool = _connection_pool()
+    key = (parts.scheme, parts.netloc)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    while True:
+        connection = pool.get(key)
+        reused = connection is not None
+        if not reused:
+            connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            connection = pool[key] = connection_class(parts.netloc)
+        try:
+            connection.request("POST", path, body=data, headers={
+                "Content-Type" : "application/json",
+                "Connection" : "keep-alive",
+            })
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            del pool[key]
+            if reused:   # server closed an idle connection,  retry on a new one.
+                continue
+            raise
+        if response.will_close:
+            connection.close()
+            del pool[key]
+        if 300 <= response.status < 400:
+            return request.urlopen(url, data).read()
+        if response.status >= 400:
+            raise error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return body
+
+# ============================================================================
+
 MSG_NO = 0
 def _request_id():
     """Return an identifier unique to this particular JSONRPC request."""
@@ -91,6 +160,53 @@ class CheckingProxy:
         return self.__class__.__name__ + "(url='%s', version='%s')" % \
             (self.__service_url, self.__version)
 
+    def _batch_call(self, calls, raise_errors=True):
+        """Issue JSONRPC `calls` as a single JSON-RPC 2.0 batch request.
+
+        calls         [ (method_name, params), ... ]  where params is a list of
+                      positional parameters or a dict of keyword parameters.
+        raise_errors  if True,  raise the exception for the first failed call,
+                      otherwise return the exception in place of its result.
+
+        Errors for each call are interpreted by classify_exception() just like
+        individual calls.   If the server does not support batch requests,  the
+        calls are issued individually.
+
+        Returns [ result, ... ] in the same order as `calls`.
+        """
+        bindings = [ServiceCallBinding(self.__service_url, method, "2.0") for (method, _params) in calls]
+        requests = [binding._jsonrpc_params(params) for (binding, (_method, params)) in zip(bindings, calls)]
+        batch = ServiceCallBinding(self.__service_url, "batch", "2.0")
+        url = batch._get_url(dict(method="batch", id=requests[0]["id"] if requests else message_id()))
+        batch._check_serverless(url)
+        log.verbose("CRDS JSON RPC batch", [call[0] for call in calls], "-->")
+        response = apply_with_retries(batch._call_service, json.dumps(requests), url)
+        try:
+            responses = json.loads(response)
+        except Exception:
+            log.warning("Invalid CRDS jsonrpc response:\n", response)
+            raise
+        if isinstance(responses, list):
+            responses = { jsonrpc.get("id") : jsonrpc for jsonrpc in responses if isinstance(jsonrpc, dict) }
+        else:
+            log.verbose("CRDS JSON RPC batch not supported by server,  issuing calls individually.")
+            responses = None
+        results = []
+        for binding, jsonrpc_params in zip(bindings, requests):
+            try:
+                if responses is None:
+                    jsonrpc = binding._call_params(jsonrpc_params)
+                elif jsonrpc_params["id"] in responses:
+                    jsonrpc = responses[jsonrpc_params["id"]]
+                else:
+                    raise binding.classify_exception("No response for call in JSON RPC batch.")
+                results.append(binding._decode_response(jsonrpc))
+            except exceptions.CrdsError as exc:
+                if raise_errors:
+                    raise
+                results.append(exc)
+        return results
+
 class ServiceCallBinding:
     """When called,  ServiceCallBinding issues a JSONRPC call to the associated
     service URL.
@@ -107,18 +223,30 @@ class ServiceCallBinding:
     def _call(self, *args, **kwargs):
         """Core of RPC dispatch without error interpretation, logging, or return value decoding."""
         params = kwargs if len(kwargs) else args
-        jsonrpc_params = {"jsonrpc": self.__version,
-                          "method": self.__service_name,
-                          'params': params,
-                          'id': message_id()
-                         }
+        return self._call_params(self._jsonrpc_params(params))
+
+    def _jsonrpc_params(self, params):
+        """Return the JSONRPC request object for calling this method with `params`."""
+        return {"jsonrpc": self.__version,
+                "method": self.__service_name,
+                'params': params,
+                'id': message_id()
+               }
+
+    def _check_serverless(self, url):
+        """Raise a ServiceError if `url` indicates CRDS is configured for server-less mode."""
+        if "serverless" in url or "server-less" in url:
+            raise exceptions.ServiceError("Configured for server-less mode.  Skipping JSON RPC " + repr(self.__service_name))
+
+    def _call_params(self, jsonrpc_params):
+        """Issue the JSONRPC request object `jsonrpc_params` and return the decoded JSON response."""
+        params = jsonrpc_params["params"]
 
         parameters = json.dumps(jsonrpc_params)
 
         url = self._get_url(jsonrpc_params)
 
-        if "serverless" in url or "server-less" in url:
-            raise exceptions.ServiceError("Configured for server-less mode.  Skipping JSON RPC " + repr(self.__service_name))
+        self._check_serverless(url)
 
         if log.get_verbose() <= 50:
             log.verbose("CRDS JSON RPC", self.__service_name, params if len(str(params)) <= 60 else "(...)", "-->")
@@ -147,14 +275,16 @@ class ServiceCallBinding:
         if not isinstance(parameters, bytes):
             parameters = parameters.encode("utf-8")
         try:
-            channel = request.urlopen(url, parameters)
-            return channel.read().decode("utf-8")
+            return post(url, parameters).decode("utf-8")
         except Exception as exc:
             raise exceptions.ServiceError("CRDS jsonrpc failure " + repr(self.__service_name) + " " + str(exc)) from exc
 
     def __call__(self, *args, **kwargs):
-        jsonrpc = self._call(*args, **kwargs)
-        if jsonrpc["error"]:
+        return self._decode_response(self._call(*args, **kwargs))
+
+    def _decode_response(self, jsonrpc):
+        """Return the decoded result of JSONRPC response `jsonrpc` or raise its classified error."""
+        if jsonrpc.get("error"):
             decoded = html.unescape(jsonrpc["error"]["message"])
             raise self.classify_exception(decoded)
         else:
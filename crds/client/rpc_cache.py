@@ -0,0 +1,167 @@
+"""This module implements an opt-in on-disk cache for the responses of CRDS
+server JSON RPCs which return effectively immutable data,  e.g. the mapping
+names of a context,  so that repeated script runs do not re-fetch them.
+
+The cache is enabled by CRDS_RPC_CACHE=1 and is stored under the CRDS cache
+config area,  see config.get_rpc_cache_path().   Entries are content addressed
+by the sha1sum of the method name,  parameters,  server URL,  and server
+version,  so a server upgrade implicitly invalidates all entries.   Each
+method has a lifetime in seconds which can be overridden with
+CRDS_RPC_CACHE_TTLS,  e.g. CRDS_RPC_CACHE_TTLS=get_file_info_map:0 to
+disable caching of file info.
+
+Entries are written atomically under the CRDS cache lock so concurrent
+processes can share the cache.   Readonly caches are read but never updated.
+
+>>> import tempfile
+>>> old = os.environ.get("CRDS_CFGPATH_SINGLE")
+>>> os.environ["CRDS_CFGPATH_SINGLE"] = tempfile.mkdtemp()
+
+>>> calls = []
+>>> def get_mapping_names(context):
+...     calls.append(context)
+...     return [context, "hst_acs.imap"]
+
+>>> cached_call(get_mapping_names, "get_mapping_names", ("hst.pmap",), "https://hst-crds.stsci.edu", "11.0")
+['hst.pmap', 'hst_acs.imap']
+>>> cached_call(get_mapping_names, "get_mapping_names", ("hst.pmap",), "https://hst-crds.stsci.edu", "11.0")
+['hst.pmap', 'hst_acs.imap']
+>>> calls
+['hst.pmap']
+
+A different server version is a different entry:
+
+>>> _ = cached_call(get_mapping_names, "get_mapping_names", ("hst.pmap",), "https://hst-crds.stsci.edu", "11.1")
+>>> calls
+['hst.pmap', 'hst.pmap']
+
+>>> get_ttl("get_context_history")
+600
+>>> os.environ["CRDS_RPC_CACHE_TTLS"] = "get_context_history:5, get_file_info_map:0"
+>>> get_ttl("get_context_history"), get_ttl("get_file_info_map")
+(5, 0)
+
+Malformed overrides are ignored with a warning:
+
+>>> log.set_test_mode()
+>>> os.environ["CRDS_RPC_CACHE_TTLS"] = "get_file_info_map=0, get_context_history:soon, get_mapping_names:60"
+>>> get_ttl("get_file_info_map"), get_ttl("get_context_history"), get_ttl("get_mapping_names")
+CRDS - WARNING -  Ignoring CRDS_RPC_CACHE_TTLS entry 'get_file_info_map=0' which is not <method>:<seconds>.
+CRDS - WARNING -  Ignoring CRDS_RPC_CACHE_TTLS entry ' get_context_history:soon' which is not <method>:<seconds>.
+(3600, 600, 60)
+>>> del os.environ["CRDS_RPC_CACHE_TTLS"]
+
+>>> clear()
+>>> if old is None:
+...     del os.environ["CRDS_CFGPATH_SINGLE"]
+... else:
+...     os.environ["CRDS_CFGPATH_SINGLE"] = old
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+# ============================================================================
+
+from crds.core import log, config, utils, crds_cache_locking
+
+# ============================================================================
+
+DAY = 24 * 60 * 60
+
+# Default lifetimes (seconds) of cached responses for each cacheable method.
+RPC_CACHE_TTLS = {
+    "get_mapping_names" : 30 * DAY,       # fixed for a given context
+    "get_dataset_headers_by_id" : DAY,    # fixed unless datasets are reprocessed
+    "get_file_info_map" : 60 * 60,        # rejection/blacklisting can change
+    "get_context_history" : 10 * 60,     # grows with each new context
+}
+
+# ============================================================================
+
+def get_ttl(method):
+    """Return the lifetime in seconds of cached responses for `method`,  0 for
+    methods which should not be cached.
+    """
+    return _rpc_cache_ttls().get(method, 0)
+
+_RPC_CACHE_TTLS = (None, {})   # (CRDS_RPC_CACHE_TTLS,  { method : seconds })
+
+def _rpc_cache_ttls():
+    """Return { method : seconds } combining RPC_CACHE_TTLS with the overrides parsed
+    from CRDS_RPC_CACHE_TTLS,  ignoring with a warning any entries which are not
+    <method>:<seconds>.   A bad setting must not break the RPCs which are cached.
+    """
+    global _RPC_CACHE_TTLS
+    setting = config.RPC_CACHE_TTLS.get()
+    if setting != _RPC_CACHE_TTLS[0]:
+        ttls = dict(RPC_CACHE_TTLS)
+        for override in setting.split(","):
+            if not override.strip():
+                continue
+            try:
+                name, seconds = override.split(":")
+                seconds = int(seconds)
+                if not name.strip():
+                    raise ValueError("bad method name")
+            except ValueError:
+                log.warning("Ignoring CRDS_RPC_CACHE_TTLS entry", repr(override),
+                            "which is not <method>:<seconds>.")
+                continue
+            ttls[name.strip()] = seconds
+        _RPC_CACHE_TTLS = (setting, ttls)
+    return _RPC_CACHE_TTLS[1]
+
+def cache_key(method, params, server_url, server_version):
+    """Return the content address of the response to `method` called with `params`."""
+    identity = json.dumps([method, params, server_url, server_version], sort_keys=True)
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+def cache_path(key):
+    """Return the path of cache entry `key`."""
+    return os.path.join(config.get_rpc_cache_path(), key[:2], key + ".json")
+
+def cached_call(func, method, params, server_url, server_version):
+    """Return the result of func(*params),  the JSON RPC `method` of the server at
+    `server_url` running `server_version`,  from the on-disk cache if it is fresh,
+    otherwise call it and cache the result.
+    """
+    ttl = get_ttl(method)
+    if ttl <= 0:
+        return func(*params)
+    path = cache_path(cache_key(method, params, server_url, server_version))
+    try:
+        if time.time() - os.stat(path).st_mtime < ttl:
+            with open(path) as handle:
+                result = json.load(handle)
+            log.verbose("RPC cache hit for", repr(method), verbosity=60)
+            return result
+    except Exception:
+        pass
+    result = func(*params)
+    _save(path, result)
+    return result
+
+def _save(path, result):
+    """Atomically write JSON `result` to cache entry `path` under the CRDS cache lock."""
+    if config.get_cache_readonly() or not utils.is_writable(path, no_exist=True):
+        return
+    try:
+        utils.ensure_dir_exists(path)
+        temp_path = os.path.join(os.path.dirname(path), str(uuid.uuid4()))
+        with crds_cache_locking.get_cache_lock():
+            with open(temp_path, "w+") as handle:
+                json.dump(result, handle)
+            os.replace(temp_path, path)
+    except Exception as exc:
+        log.verbose_warning("RPC cache failed writing", repr(path), ":", str(exc))
+
+def clear():
+    """Remove all cached RPC responses."""
+    path = config.get_rpc_cache_path()
+    if os.path.exists(path):
+        with crds_cache_locking.get_cache_lock():
+            shutil.rmtree(path)
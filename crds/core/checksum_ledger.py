@@ -0,0 +1,177 @@
+"""This module maintains a persistent ledger of file sha1sums so that
+utils.checksum() only reads files which have changed since they were last
+checksummed.
+
+Ledger entries are keyed by absolute path and are valid only while the file's
+size, modification time (ns), and inode are unchanged.   The ledger is a SQLite
+database stored in the CRDS config area,  see config.get_checksum_ledger_path().
+
+Since a file rewritten in place with its old size and modification time, or
+corrupted on disk, keeps its recorded sha1sum,  the ledger is opt-in:  it is
+used only with CRDS_CHECKSUM_LEDGER=1,  and can be bypassed (with entries
+refreshed) with CRDS_FORCE_REHASH=1 or the --force-rehash switch of sync and
+certify.
+
+New entries are buffered and written in batches of BATCH_SIZE,  by flush(),
+by close(),  or at exit,  so checksumming many files doesn't commit each one.
+
+The ledger is not updated for readonly caches.   Any failure to open or update
+the ledger, e.g. an unwritable config directory,  silently falls back to
+computing checksums normally.
+
+>>> import tempfile
+>>> old = os.environ.get("CRDS_CFGPATH_SINGLE")
+>>> os.environ["CRDS_CFGPATH_SINGLE"] = tempfile.mkdtemp()
+>>> old_ledger = config.CHECKSUM_LEDGER.set(True)
+>>> path = os.path.join(os.environ["CRDS_CFGPATH_SINGLE"], "data.txt")
+>>> with open(path, "w") as handle:
+...     _ = handle.write("this is a test.")
+
+>>> lookup(path) is None
+True
+>>> record(path, os.stat(path), "7728f8eb7bf75ec3cc49364861eec852fc814870")
+>>> lookup(path)
+'7728f8eb7bf75ec3cc49364861eec852fc814870'
+>>> flush()
+>>> lookup(path)
+'7728f8eb7bf75ec3cc49364861eec852fc814870'
+
+Changing the file invalidates its entry:
+
+>>> with open(path, "w") as handle:
+...     _ = handle.write("this is another test.")
+>>> lookup(path) is None
+True
+
+>>> close()
+>>> _ = config.CHECKSUM_LEDGER.set(old_ledger)
+>>> if old is None:
+...     del os.environ["CRDS_CFGPATH_SINGLE"]
+... else:
+...     os.environ["CRDS_CFGPATH_SINGLE"] = old
+"""
+import os
+import atexit
+import sqlite3
+import threading
+
+# ============================================================================
+
+from . import log, config
+
+# ============================================================================
+
+_LEDGER = threading.local()
+
+BATCH_SIZE = 1000
+
+_PENDING = {}   # { abspath : ledger row } recorded but not yet written,  for _PENDING_PID
+_PENDING_PID = None
+_PENDING_LOCK = threading.Lock()
+
+def _connection():
+    """Return this thread's connection to the checksum ledger,  or None if the
+    ledger is disabled or unavailable.
+    """
+    if not config.CHECKSUM_LEDGER.get():
+        return None
+    path = config.get_checksum_ledger_path()
+    if config.get_cache_readonly() and not os.path.exists(path):
+        return None
+    key = (os.getpid(), path)
+    if getattr(_LEDGER, "key", None) != key:   # new thread,  forked process,  or relocated config
+        _LEDGER.key, _LEDGER.connection = key, None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(path, timeout=30)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checksums "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, sha1sum TEXT)")
+            connection.commit()
+            _LEDGER.connection = connection
+        except Exception as exc:
+            log.verbose("Checksum ledger", repr(path), "is unavailable:", str(exc), verbosity=60)
+    return _LEDGER.connection
+
+def close():
+    """Write any pending entries and close this thread's connection to the ledger,  if any."""
+    flush()
+    connection = getattr(_LEDGER, "connection", None)
+    if connection is not None:
+        connection.close()
+    _LEDGER.key, _LEDGER.connection = None, None
+
+def lookup(pathname):
+    """Return the recorded sha1sum of the file at `pathname` if it is unchanged since
+    it was recorded,  otherwise None.
+    """
+    connection = _connection()
+    if connection is None:
+        return None
+    try:
+        stat = os.stat(pathname)
+        path = os.path.abspath(pathname)
+        with _PENDING_LOCK:
+            row = _pending().get(path)
+        if row is not None:
+            row = row[1:]
+        else:
+            row = connection.execute(
+                "SELECT size, mtime_ns, inode, sha1sum FROM checksums WHERE path = ?", (path,)).fetchone()
+    except Exception as exc:
+        log.verbose("Checksum ledger lookup failed for", repr(pathname), ":", str(exc), verbosity=60)
+        return None
+    if row is not None and tuple(row[:3]) == _stat_key(stat):
+        return row[3]
+    return None
+
+def record(pathname, stat, sha1sum):
+    """Record `sha1sum` for the file at `pathname` which had os.stat() result `stat`
+    when the checksum was started.   Nothing is recorded if the file changed while
+    it was being checksummed.   The entry is written by the next flush().
+    """
+    if not config.CHECKSUM_LEDGER.get() or config.get_cache_readonly():
+        return
+    try:
+        if _stat_key(os.stat(pathname)) != _stat_key(stat):
+            return
+    except Exception as exc:
+        log.verbose("Checksum ledger update failed for", repr(pathname), ":", str(exc), verbosity=60)
+        return
+    path = os.path.abspath(pathname)
+    with _PENDING_LOCK:
+        pending = _pending()
+        pending[path] = (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, sha1sum)
+        full = len(pending) >= BATCH_SIZE
+    if full:
+        flush()
+
+def flush():
+    """Write the pending ledger entries of this process in a single transaction."""
+    with _PENDING_LOCK:
+        rows = list(_pending().values())
+        _PENDING.clear()
+    if not rows:
+        return
+    connection = _connection()
+    if connection is None or config.get_cache_readonly():
+        return
+    try:
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)", rows)
+    except Exception as exc:
+        log.verbose("Checksum ledger update failed for", len(rows), "files:", str(exc), verbosity=60)
+
+atexit.register(flush)
+
+def _pending():
+    """Return the pending entries of this process,  dropping any inherited by a fork."""
+    global _PENDING_PID
+    if _PENDING_PID != os.getpid():
+        _PENDING.clear()
+        _PENDING_PID = os.getpid()
+    return _PENDING
+
+def _stat_key(stat):
+    """Return the ledger validity key for os.stat() result `stat`."""
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
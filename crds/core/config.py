@@ -373,6 +373,21 @@ CRDS_CHECKSUM_BLOCK_SIZE = 2**23
 # IntConfigItem("CRDS_CHECKSUM_BLOCK_SIZE", 2**23,
 #    "Size of data read into memory at once for utils.checksum.")
 
+CHECKSUM_LEDGER = BooleanConfigItem("CRDS_CHECKSUM_LEDGER", False,
+    "When True, utils.checksum() records sha1sums in a ledger keyed by file path, size, mtime, and inode,  "
+    "and reuses them for files which have not changed.   Off by default since in-place rewrites which keep "
+    "the size and mtime, or on-disk corruption, then go unnoticed by sha1sum checks.")
+
+FORCE_REHASH = BooleanConfigItem("CRDS_FORCE_REHASH", False,
+    "When True, utils.checksum() ignores sha1sums recorded in the checksum ledger and recomputes them.")
+
+RMAP_PARSER = BooleanConfigItem("CRDS_RMAP_PARSER", True,
+    "When True, mappings are loaded by a dedicated parser for their declarative subset of Python,  "
+    "falling back to verifying and exec'ing mappings which use other constructs.")
+
+USES_INDEX = BooleanConfigItem("CRDS_USES_INDEX", True,
+    "When True, crds.uses answers queries from a persistent index of the files each cached mapping refers to.")
+
 # ===========================================================================
 
 # To support testing, the default cache is configurable.  Ordinarily
@@ -506,6 +521,14 @@ def get_crds_root_cfgpath():
     else:
         return dirname
 
+def get_checksum_ledger_path():
+    """Return the path of the SQLite ledger of previously computed file sha1sums."""
+    return os.path.join(get_crds_root_cfgpath(), "checksums.sqlite")
+
+def get_uses_index_path(observatory):
+    """Return the path of the SQLite reverse index of the files referred to by cached `observatory` mappings."""
+    return os.path.join(get_crds_cfgpath(observatory), "uses_index.sqlite")
+
 def get_crds_refpath(observatory):
     """get_crds_refpath returns the base path of the directory tree where CRDS
     reference files are stored.   This is extended by <observatory> once it is
@@ -547,6 +570,20 @@ def locate_pickle(mapping, observatory=None):
         observatory = mapping_to_observatory(mapping)
     return os.path.join(get_crds_picklepath(observatory), mapping + ".pkl")
 
+def locate_context_file(mapping, observatory=None):
+    """Return the absolute path where the indexed context file for `mapping` should be located."""
+    if os.path.dirname(mapping):
+        return mapping
+    if observatory is None:
+        observatory = mapping_to_observatory(mapping)
+    return os.path.join(get_crds_picklepath(observatory), mapping + ".ctx")
+
+PICKLE_FORMAT = StrConfigItem("CRDS_PICKLE_FORMAT", "pickle",
+    "Selects the format of saved contexts:  'pickle' for a single pickle of the whole context,  "
+    "'split' for a .pmap stub pickle plus one pickle per .imap loaded on demand,  "
+    "'indexed' for a memory mapped context file which loads imaps and rmaps on demand.",
+    ["pickle", "split", "indexed"], lower=True)
+
 USE_PICKLED_CONTEXTS = BooleanConfigItem("CRDS_USE_PICKLED_CONTEXTS", False,
     "When True,  CRDS contexts should be loaded from a pickled version if possible.")
 
@@ -558,8 +595,31 @@ AUTO_PICKLE_CONTEXTS = BooleanConfigItem("CRDS_AUTO_PICKLE_CONTEXTS", False,
 FORCE_COMPLETE_LOAD = BooleanConfigItem("CRDS_FORCE_COMPLETE_LOAD", False,
     "When True, force CRDS contexts to load in their entirety rather than based on what is actually used.")
 
+LOAD_WORKERS = IntConfigItem("CRDS_LOAD_WORKERS", 1,
+    "Number of processes which load the sub-mappings of a context concurrently when it is loaded in its "
+    "entirety, e.g. for saving pickles.  1 for serial loading.")
+
 EXPLICIT_GARBAGE_COLLECTION = BooleanConfigItem("CRDS_EXPLICIT_GARBAGE_COLLECTION", True,
     "When False, the @gc_collected function decorator skips garbage collection.")
+
+LOOKUP_CACHE_SIZE = IntConfigItem("CRDS_LOOKUP_CACHE_SIZE", 0,
+    "Maximum number of best reference lookup results cached by each rmap.  0 disables lookup caching.")
+
+TABLE_EFFECTS_CACHE_SIZE = IntConfigItem("CRDS_TABLE_EFFECTS_CACHE_SIZE", 16,
+    "Maximum number of reference tables held in memory for bestrefs table effects row comparisons.")
+
+TABLE_EFFECTS_COMPARISONS_CACHE_SIZE = IntConfigItem("CRDS_TABLE_EFFECTS_COMPARISONS_CACHE_SIZE", 10000,
+    "Maximum number of bestrefs table effects mode comparison results remembered for reuse.")
+
+FUNCTION_CACHE_SIZE = IntConfigItem("CRDS_FUNCTION_CACHE_SIZE", 0,
+    "Maximum number of results held by each @utils.cached function,  evicting the least recently used.  "
+    "0 for unlimited.")
+
+FUNCTION_CACHE_SIZES = StrConfigItem("CRDS_FUNCTION_CACHE_SIZES", "",
+    "Comma separated function:size overrides of CRDS_FUNCTION_CACHE_SIZE,  e.g. '_load_mapping:50'.")
+
+FUNCTION_CACHE_TTL = IntConfigItem("CRDS_FUNCTION_CACHE_TTL", 0,
+    "Seconds after which results of @utils.cached functions expire and are recomputed.  0 for never.")
 # -------------------------------------------------------------------------------------
 
 def get_sqlite3_db_path(observatory):
@@ -765,6 +825,9 @@ def get_length_flag():
     """
     return DOWNLOAD_LENGTHS.get()
 
+DOWNLOAD_WORKERS = IntConfigItem(
+    "CRDS_DOWNLOAD_WORKERS", 1, "Number of files downloaded concurrently by the CRDS client.  1 for serial downloads.")
+
 # -------------------------------------------------------------------------------------
 
 CLIENT_RETRY_COUNT = IntConfigItem(
@@ -791,6 +854,26 @@ def disable_retries():
     CLIENT_RETRY_COUNT.set(1)
     CLIENT_RETRY_DELAY_SECONDS.set(0)
 
+CLIENT_KEEP_ALIVE = BooleanConfigItem(
+    "CRDS_CLIENT_KEEP_ALIVE", True, "Reuse persistent HTTP connections for CRDS server JSON RPC calls.")
+
+RPC_CACHE = BooleanConfigItem(
+    "CRDS_RPC_CACHE", False,
+    "When True, cache responses of idempotent CRDS server JSON RPCs on disk,  see crds.client.rpc_cache.")
+
+RPC_CACHE_TTLS = StrConfigItem(
+    "CRDS_RPC_CACHE_TTLS", "",
+    "Comma separated method:seconds overrides of the on-disk RPC cache lifetimes,  e.g. 'get_file_info_map:600'.")
+
+def get_rpc_cache_path():
+    """Return the directory of the on-disk JSON RPC response cache."""
+    return os.path.join(get_crds_root_cfgpath(), "rpc_cache")
+
+RPC_BATCH_SIZE = IntConfigItem(
+    "CRDS_RPC_BATCH_SIZE", 1,
+    "Maximum number of calls sent together as one JSON RPC 2.0 batch request,  e.g. when dumping "
+    "dataset headers.  1 issues calls individually.")
+
 # -------------------------------------------------------------------------------------
 
 CRDS_DEFAULT_SERVERS = {
@@ -0,0 +1,153 @@
+"""This module defines an indexed binary format for saving loaded CRDS contexts,
+an alternative to pickling the entire context as a single object.
+
+A context file consists of:
+
+1. A fixed header:  magic bytes, format version, index offset, index length.
+
+2. One pickle per mapping in the context hierarchy.  Each .pmap or .imap is
+pickled with its loaded selections detached,  so it refers to the sub-mappings
+it selects by name only and each pickle is small and independent.
+
+3. A JSON index of { mapping_name : [offset, length] } for the pickles.
+
+Context files are memory mapped and only the index is read up front.   The root
+mapping is unpickled first and its selections are resolved from the file on
+demand as imaps and rmaps are accessed,  so a process which computes bestrefs for
+one instrument and type only deserializes that imap and rmap.
+
+>>> from crds.core import rmap
+>>> import tempfile, os
+>>> pmap = rmap.get_cached_mapping("data/hst.pmap", ignore_checksum=True)
+>>> pmap.force_load()
+>>> path = os.path.join(tempfile.mkdtemp(), "hst.pmap.ctx")
+>>> with open(path, "wb") as handle:
+...     _ = handle.write(dumps_context(pmap))
+
+>>> loaded = load_context(path)
+>>> loaded.name
+'hst.pmap'
+>>> sorted(loaded.selections._contents)
+[]
+>>> loaded.get_imap("acs").get_rmap("biasfile").name
+'hst_acs_biasfile.rmap'
+>>> sorted(loaded.selections._contents)
+['acs']
+"""
+import json
+import mmap
+import pickle
+import struct
+
+# ============================================================================
+
+from . import log, exceptions
+from .custom_dict import LazyFileDict
+
+# ============================================================================
+
+CONTEXT_FILE_MAGIC = b"CRDSCTX\0"
+
+CONTEXT_FILE_VERSION = 1
+
+# magic, version, index offset, index length
+HEADER_FORMAT = "<8sHQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# ============================================================================
+
+def dumps_context(loaded):
+    """Return the bytes of the context file for loaded Mapping `loaded`,  implicitly
+    loading all of its sub-mappings.
+    """
+    blobs = {}
+    _pickle_mappings(loaded.basename, loaded, blobs)
+    offset = HEADER_SIZE
+    index = {}
+    for name, blob in blobs.items():
+        index[name] = [offset, len(blob)]
+        offset += len(blob)
+    index_bytes = json.dumps(dict(root=loaded.basename, mappings=index)).encode("utf-8")
+    header = struct.pack(HEADER_FORMAT, CONTEXT_FILE_MAGIC, CONTEXT_FILE_VERSION, offset, len(index_bytes))
+    return b"".join([header] + list(blobs.values()) + [index_bytes])
+
+def _pickle_mappings(name, mapping, blobs):
+    """Add the pickle of `mapping` and recursively its sub-mappings to dict `blobs`
+    under the names used to select them.
+    """
+    if name in blobs:
+        return
+    blobs[name] = dumps_mapping(mapping)
+    selections = getattr(mapping, "selections", None)
+    if isinstance(selections, LazyFileDict):
+        for key in selections.normal_keys():
+            _pickle_mappings(selections._xx_selector[key], selections[key], blobs)
+
+def dumps_mapping(mapping, loader=None):
+    """Return the pickle of `mapping` with any loaded selections detached,  so that
+    sub-mappings are referred to by name only and demand loaded after unpickling.
+
+    If `loader` is specified,  the unpickled mapping will use it to load its
+    selections instead of the loader `mapping` was created with.
+    """
+    selections = getattr(mapping, "selections", None)
+    if not isinstance(selections, LazyFileDict):
+        return pickle.dumps(mapping, protocol=pickle.HIGHEST_PROTOCOL)
+    loaded, load_keys = dict(selections._contents), selections._xx_load_keys
+    selections.clear()
+    if loader is not None:
+        selections._xx_load_keys = dict(load_keys, loader=loader)
+    try:
+        return pickle.dumps(mapping, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        selections._contents.update(loaded)
+        selections._xx_load_keys = load_keys
+
+def load_context(path):
+    """Load the root mapping of the context file at `path`."""
+    return ContextFile(path).load_root()
+
+# ============================================================================
+
+class ContextFile:
+    """Memory mapped context file which loads mappings on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset, index_length = struct.unpack_from(HEADER_FORMAT, self._mmap)
+        if magic != CONTEXT_FILE_MAGIC:
+            raise exceptions.CrdsError("File", repr(path), "is not a CRDS context file.")
+        if version != CONTEXT_FILE_VERSION:
+            raise exceptions.CrdsError(
+                "Context file", repr(path), "has format version", version,
+                "but version", CONTEXT_FILE_VERSION, "is required.")
+        index = json.loads(self._mmap[index_offset:index_offset+index_length].decode("utf-8"))
+        self.root = index["root"]
+        self.index = index["mappings"]
+
+    def __reduce__(self):
+        """Pickle context files by path,  e.g. as the loader of pickled mappings."""
+        return (ContextFile, (self.path,))
+
+    def load_root(self):
+        """Load the top level mapping of this context file."""
+        return self.load(self.root)
+
+    def load(self, name, **keys):
+        """Load mapping `name` from this file,  or the file system if it's not in the
+        index.   Suitable as a LazyFileDict loader.
+        """
+        if name not in self.index:
+            from . import rmap
+            keys.pop("loader", None)
+            return rmap.load_mapping(name, **keys)
+        offset, length = self.index[name]
+        log.verbose("Loading", repr(name), "from context file", repr(self.path), verbosity=60)
+        with memoryview(self._mmap) as view:
+            mapping = pickle.loads(view[offset:offset+length])
+        selections = getattr(mapping, "selections", None)
+        if isinstance(selections, LazyFileDict):
+            selections._xx_load_keys = dict(selections._xx_load_keys, loader=self.load)
+        return mapping
@@ -58,9 +58,11 @@ import pickle
 # ============================================================================
 
 from . import rmap, log, utils, config
+from .context_file import load_context, dumps_context, dumps_mapping
 from .constants import ALL_OBSERVATORIES
 from .log import srepr
 from .exceptions import CrdsError, CrdsBadRulesError, CrdsBadReferenceError, CrdsConfigError, CrdsDownloadError
+from .exceptions import IrrelevantReferenceTypeError, OmitReferenceTypeError
 from crds.client import api
 
 # import crds  # forward
@@ -68,7 +70,7 @@ from crds.client import api
 # ============================================================================
 
 __all__ = [
-    "getreferences", "getrecommendations",
+    "getreferences", "getrecommendations", "get_best_references_batch",
     "get_config_info", "update_config_info", "load_server_info",
     "get_processing_mode", "get_context_name",
     "version_info",
@@ -375,6 +377,61 @@ def hv_best_references(context_file, header, include=None, condition=True):
     log.verbose("Bestrefs header:\n", log.PP(minheader))
     return ctx.get_best_references(minheader, include=include)
 
+def get_best_references_batch(context_file, headers, reftypes=None, condition=True):
+    """Compute the best references for many datasets at once with respect to
+    pipeline or instrument `context_file`.   This is a local computation
+    equivalent to calling hv_best_references() for each header.
+
+    headers     { dataset_id : { parkey : value, ... }, ... }
+
+    reftypes    None,  [ reftype, ... ] applying to every dataset,  or
+                { dataset_id : [ reftype, ...], ... }
+
+    Each header is conditioned and minimized once.  Datasets are then grouped
+    by instrument and reference type,  and within each rmap datasets which
+    agree on that rmap's required parkeys are resolved by a single lookup.
+
+    Returns { dataset_id : { filekind : bestref, ... }, ... }
+    """
+    ctx = get_symbolic_mapping(context_file, cached=True)
+    results = {}
+    groups = {}    # { rmap_name : (rmap, { parkey_values : [(dataset_id, filekind, minheader), ...] }) }
+    for dataset_id, header in headers.items():
+        with log.augment_exception("Failed grouping dataset", repr(dataset_id), "for batch bestrefs"):
+            results[dataset_id] = {}
+            conditioned = utils.condition_header(header) if condition else header
+            include = reftypes.get(dataset_id) if isinstance(reftypes, dict) else reftypes
+            if include is None:
+                include = set(ctx.locate.header_to_reftypes(conditioned, context_file))
+                include = list(set(ctx.get_filekinds(conditioned)) & include)
+            minheader = ctx.minimize_header(conditioned)
+            imap = ctx.get_imap(ctx.get_instrument(minheader))
+            for filekind in include or imap.selections.keys():
+                filekind = filekind.lower()
+                try:
+                    refmap = imap.get_rmap(filekind)
+                except IrrelevantReferenceTypeError:
+                    results[dataset_id][filekind] = "NOT FOUND n/a"
+                    continue
+                except OmitReferenceTypeError:
+                    continue
+                except Exception as exc:
+                    results[dataset_id][filekind] = "NOT FOUND " + str(exc)
+                    continue
+                parkey_values = tuple(minheader.get(key, "UNDEFINED") for key in refmap.get_required_parkeys())
+                _refmap, cases = groups.setdefault(refmap.basename, (refmap, {}))
+                cases.setdefault(parkey_values, []).append((dataset_id, filekind, minheader))
+    lookups = 0
+    for refmap, cases in groups.values():
+        for datasets in cases.values():
+            lookups += 1
+            bestref = refmap.get_best_ref(datasets[0][2])
+            if bestref is not None:
+                for dataset_id, filekind, _minheader in datasets:
+                    results[dataset_id][filekind] = bestref
+    log.verbose("Batch bestrefs for", len(results), "datasets required", lookups, "rmap lookups.", verbosity=55)
+    return results
+
 # ============================================================================
 
 # !!!!! interface to jwst.stpipe.crds_client
@@ -699,39 +756,97 @@ def load_pickled_mapping(mapping):
     """Load the pickle for `mapping` where `mapping` is canonically named and
     located in the CRDS cache.
 
-    Although pickles for sub-mappings may exist, only the highest level pickle
-    in the hierarchy is read.  In general pickles for sub-mappings should not
-    exist because of storage waste.
+    Only the highest level pickle in the hierarchy is read.  If it is a split
+    pickle stub,  the pickles of its sub-mappings are loaded on demand as its
+    selections are accessed.
     """
+    if config.PICKLE_FORMAT.get() == "indexed":
+        loaded = load_context(config.locate_context_file(mapping))
+        log.info("Loaded context file", repr(mapping))
+        return loaded
+    loaded = _load_pickle(mapping)
+    log.info("Loaded pickled context", repr(mapping))
+    return loaded
+
+def _load_pickle(mapping):
+    """Unpickle `mapping` from its URI or the CRDS cache."""
     pickle_uri = config.get_uri(mapping + ".pkl")
     if pickle_uri == "none":
         pickle_uri = config.locate_pickle(mapping)
     pickled = utils.get_uri_content(pickle_uri, mode="binary")
-    loaded = pickle.loads(pickled)
-    log.info("Loaded pickled context", repr(mapping))
+    return pickle.loads(pickled)
+
+def load_split_pickle(mapping, **keys):
+    """Selections loader for split pickle stubs.  Load sub-mapping `mapping` from its
+    own pickle,  or from the mapping file if the pickle cannot be loaded.
+    """
+    try:
+        loaded = _load_pickle(mapping)
+    except Exception as exc:
+        log.verbose("Failed loading split pickle for", repr(mapping), ":", str(exc))
+        keys.pop("loader", None)
+        return rmap.load_mapping(mapping, **keys)
+    log.verbose("Loaded split pickle", repr(mapping))
     return loaded
 
 def save_pickled_mapping(mapping, loaded):
-    """Save live mapping `loaded` as a pickle under named based on `mapping` name."""
-    pickle_file = config.locate_pickle(mapping)
+    """Save live mapping `loaded` as a pickle under named based on `mapping` name.
+
+    When CRDS_PICKLE_FORMAT=indexed,  save an indexed context file instead.
+
+    When CRDS_PICKLE_FORMAT=split and `loaded` is a .pmap,  save a pickle of each
+    .imap and a .pmap stub which loads them on demand.
+    """
+    pickle_format = config.PICKLE_FORMAT.get()
+    if pickle_format == "indexed":
+        pickle_file = config.locate_context_file(mapping)
+    else:
+        pickle_file = config.locate_pickle(mapping)
     if not utils.is_writable(pickle_file):  # Don't even bother pickling
         log.verbose("Pickle file", repr(pickle_file), "is not writable,  skipping pickle save.")
         return
     with log.verbose_warning_on_exception("Failed saving pickle for", repr(mapping), "to", repr(pickle_file)):
         loaded.force_load()
-        pickled = pickle.dumps(loaded)
+        if pickle_format == "indexed":
+            pickled = dumps_context(loaded)
+        elif pickle_format == "split" and isinstance(loaded, rmap.PipelineContext):
+            for imap in loaded.selections.normal_values():
+                save_pickled_mapping(imap.basename, imap)
+            pickled = dumps_mapping(loaded, loader=load_split_pickle)
+        else:
+            pickled = pickle.dumps(loaded)
         cache_atomic_write(pickle_file, pickled, "CONTEXT PICKLE")
         log.info("Saved pickled context", repr(pickle_file))
 
 def remove_pickled_mapping(mapping):
-    """Delete the pickle for `mapping` from the CRDS cache."""
-    pickle_file = config.locate_pickle(mapping)
-    if not utils.is_writable(pickle_file):  # Don't even bother pickling
-        log.verbose("Pickle file", repr(pickle_file), "is not writable,  skipping pickle remove.")
-        return
-    if not os.path.exists(pickle_file):
-        log.verbose("Pickl file", repr(pickle_file), "does not exist,  skipping pickle remove.")
-        return
-    with log.warn_on_exception("Failed removing pickle for", repr(mapping)):
-        os.remove(pickle_file)
-        log.info("Removed pickle for context", repr(pickle_file))
+    """Delete the pickle and/or indexed context file for `mapping` from the CRDS cache.
+
+    When CRDS_PICKLE_FORMAT=split,  also delete the .imap pickles saved for .pmap `mapping`.
+    Other split .pmap stubs sharing those .imaps fall back to loading the .imap files.
+    """
+    pickle_files = [config.locate_pickle(mapping), config.locate_context_file(mapping)]
+    pickle_files = [path for path in pickle_files if os.path.exists(path)] or pickle_files[:1]
+    if config.PICKLE_FORMAT.get() == "split":
+        pickle_files += [path for path in _split_pickle_files(mapping) if os.path.exists(path)]
+    for pickle_file in pickle_files:
+        if not utils.is_writable(pickle_file):  # Don't even bother pickling
+            log.verbose("Pickle file", repr(pickle_file), "is not writable,  skipping pickle remove.")
+            continue
+        if not os.path.exists(pickle_file):
+            log.verbose("Pickle file", repr(pickle_file), "does not exist,  skipping pickle remove.")
+            continue
+        with log.warn_on_exception("Failed removing pickle for", repr(mapping)):
+            os.remove(pickle_file)
+            log.info("Removed pickle for context", repr(pickle_file))
+
+def _split_pickle_files(mapping):
+    """Return the paths of the .imap pickles which save_pickled_mapping() would save
+    for .pmap `mapping` with CRDS_PICKLE_FORMAT=split.
+    """
+    if rmap.mapping_type(mapping) != "pmap":
+        return []
+    with log.verbose_warning_on_exception("Failed listing split pickles for", repr(mapping)):
+        loaded = rmap.fetch_mapping(mapping, ignore_checksum=True)
+        return [config.locate_pickle(os.path.basename(imap))
+                for imap in loaded.selector.values() if not rmap.is_special_value(imap)]
+    return []
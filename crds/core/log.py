@@ -256,6 +256,22 @@ class CrdsLogger:
         self.handlers.remove(handler)
         self.logger.removeHandler(handler)
 
+    def add_capture_handler(self, level=logging.DEBUG):
+        """Add and return a handler which saves (level, message) pairs in its
+        `messages` list for a later replay() instead of writing them.
+        """
+        handler = CaptureHandler(level)
+        self.handlers.append(handler)
+        self.logger.addHandler(handler)
+        return handler
+
+    def replay(self, messages):
+        """Output (level, message) pairs saved by a capture handler through the
+        current handlers,  e.g. the console,  without counting them again.
+        """
+        for level, message in messages:
+            self.logger.log(level, message)
+
     def fatal_error(self, *args, **keys):
         error("(FATAL)", *args, **keys)
         sys.exit(-1)  # FATAL == totally unambiguous
@@ -275,6 +291,17 @@ class CrdsLogger:
         if filter in self.filters:
             self.filters.remove(filter)
 
+class CaptureHandler(logging.Handler):
+    """Logging handler which saves messages for CrdsLogger.replay(),  typically
+    in another process.
+    """
+    def __init__(self, level=logging.DEBUG):
+        super(CaptureHandler, self).__init__(level)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
 THE_LOGGER = CrdsLogger("CRDS")
 
 info = THE_LOGGER.info
@@ -294,6 +321,8 @@ add_console_handler = THE_LOGGER.add_console_handler
 remove_console_handler = THE_LOGGER.remove_console_handler
 add_stream_handler = THE_LOGGER.add_stream_handler
 remove_stream_handler = THE_LOGGER.remove_stream_handler
+add_capture_handler = THE_LOGGER.add_capture_handler
+replay = THE_LOGGER.replay
 append_crds_filter = THE_LOGGER.append_crds_filter
 remove_crds_filter = THE_LOGGER.remove_crds_filter
 prepend_crds_filter = THE_LOGGER.prepend_crds_filter
@@ -303,6 +332,14 @@ def increment_errors(N=1):
     """Increment the error count by N without issuing a log message."""
     THE_LOGGER.errors += N
 
+def increment_warnings(N=1):
+    """Increment the warning count by N without issuing a log message."""
+    THE_LOGGER.warnings += N
+
+def increment_infos(N=1):
+    """Increment the info count by N without issuing a log message."""
+    THE_LOGGER.infos += N
+
 def errors():
     """Return the global count of errors."""
     return THE_LOGGER.errors
@@ -54,14 +54,16 @@ True
 import os.path
 import glob
 import json
+import multiprocessing
+import threading
 
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 
 # ===================================================================
 
 from pkg_resources import Requirement
 
-from . import log, utils, config, selectors, substitutions
+from . import log, utils, config, selectors, substitutions, rmap_parser
 
 # XXX For backward compatability until refactored away.
 from .config import locate_file, locate_mapping, locate_reference
@@ -287,22 +289,31 @@ class Mapping:
     @classmethod
     def _parse_header_selector(cls, text, where=""):
         """Given a mapping at `filepath`,  validate it and return a fully
-        instantiated (header, selector) tuple.
+        instantiated (header, selector) tuple.   Declarative mappings are parsed
+        directly,  see crds.core.rmap_parser,  and others are verified and exec'ed.
         """
         with log.augment_exception("Can't load file " + where,
                                    exception_class=crexc.MappingError):
-            code = MAPPING_VERIFIER.compile_and_check(text)
-            header, selector, comment = cls._interpret(code)
+            namespace = rmap_parser.parse(text) if config.RMAP_PARSER.get() else None
+            if namespace is None:
+                code = MAPPING_VERIFIER.compile_and_check(text)
+                namespace = cls._execute(code)
+            header, selector, comment = cls._interpret(namespace)
         return LowerCaseDict(header), selector, comment
 
     @classmethod
-    def _interpret(cls, code):
-        """Interpret a valid rmap code object and return it's header and
-        selector.
-        """
+    def _execute(cls, code):
+        """Execute a valid rmap code object and return the namespace it defines."""
         namespace = {}
         namespace.update(selectors.SELECTORS)
         exec(code, namespace)
+        return namespace
+
+    @classmethod
+    def _interpret(cls, namespace):
+        """Interpret the `namespace` defined by a valid rmap and return it's
+        header, selector,  and comment.
+        """
         header = LowerCaseDict(namespace["header"])
         selector = namespace["selector"]
         comment = namespace.get("comment", None)
@@ -606,7 +617,19 @@ class Mapping:
 
     def file_matches(self, filename):
         """Return the "extended match tuples" which can be followed to arrive at `filename`."""
-        return sorted([match for value in self.selections.normal_values() for match in value.file_matches(filename)])
+        return sorted(self.file_matches_index().get(filename, []))
+
+    def file_matches_index(self):
+        """Return { filename : [ extended match tuples leading to filename, ...], ... } for every
+        file under this mapping,  merged from the indexes of its sub-mappings on first use.
+        """
+        if getattr(self, "_file_matches_index", None) is None:
+            index = defaultdict(list)
+            for value in self.selections.normal_values():
+                for filename, matches in value.file_matches_index().items():
+                    index[filename].extend(matches)
+            self._file_matches_index = dict(index)
+        return self._file_matches_index
 
     def get_derived_from(self):
         """Return the Mapping object `self` was derived from, or None."""
@@ -677,11 +700,25 @@ class ContextMapping(Mapping):
         super(ContextMapping, self).__init__(filename, header, selector, **keys)
         self.observatory = self.header["observatory"]
         self.selections = MappingSelectionsDict(selector, self.keys)
+        self._file_matches_index = None
         if config.FORCE_COMPLETE_LOAD:
             self.force_load()
 
+    def __getstate__(self):
+        """Return pickling state minus the merged file matches index,  which is rebuilt
+        on demand from the indexes of its rmaps.
+        """
+        state = dict(self.__dict__)
+        state.pop("_file_matches_index", None)
+        return state
+
     def force_load(self):
-        """Ensure that all submappings are loaded, i.e. make artificial demand."""
+        """Ensure that all submappings are loaded, i.e. make artificial demand.
+        When CRDS_LOAD_WORKERS > 1 the closure is first loaded concurrently,
+        see preload_closure().
+        """
+        if config.LOAD_WORKERS.get() > 1:
+            preload_closure(self)
         for selection in self.selections.normal_values():
             selection.force_load()
 
@@ -695,6 +732,7 @@ class ContextMapping(Mapping):
         key = self.locate.match_context_key(key)
         replaced = self.selector.get(key, None)
         self.selector[key] = value
+        self._file_matches_index = None
         return key, replaced
 
     def validate(self):
@@ -1074,6 +1112,9 @@ class ReferenceMapping(Mapping):
         # to someone looking at the rmap.
         self._rmap_update_headers = None
 
+        # { filename : [ match tuples, ... ] } built on first use,  not pickled
+        self._file_matches_index = None
+
         # Actually compile lambdas for the hooks above.
         self._init_compiled()
 
@@ -1086,11 +1127,15 @@ class ReferenceMapping(Mapping):
         del state["_precondition_header"]
         del state["_fallback_header"]
         del state["_rmap_update_headers"]
+        del state["_lookup_cache"]
+        del state["_lookup_lock"]
+        state.pop("_file_matches_index", None)
         return state
 
     def __setstate__(self, state):
         """Recreate rmap object from `state`,  recompiling missing __getstate__ objects on the fly."""
         self.__dict__ = dict(state)
+        self._file_matches_index = None
         self._init_compiled()
 
     def force_load(self):
@@ -1115,6 +1160,11 @@ class ReferenceMapping(Mapping):
         self._fallback_header = self.get_hook("fallback_header", (lambda self, header: None))
         self._rmap_update_headers = self.get_hook("rmap_update_headers", None)
 
+        # optional LRU cache of get_best_ref() outcomes keyed on the minimized lookup header
+        cache_size = config.LOOKUP_CACHE_SIZE.get()
+        self._lookup_cache = utils.LRUCache(cache_size) if cache_size > 0 else None
+        self._lookup_lock = threading.Lock()
+
     def validate(self):
         """Validate the contents of this rmap against the TPN for this
         filekind / reftype.   Each field of each Match tuple must have a value
@@ -1192,7 +1242,7 @@ class ReferenceMapping(Mapping):
         from nested methods onto simple "NOT FOUND..." strings which are exempted from reference downloads.
         """
         try:
-            return self._get_best_ref(header)
+            return self._cached_get_best_ref(header)
         except crexc.IrrelevantReferenceTypeError:
             return "NOT FOUND n/a"
         except crexc.OmitReferenceTypeError:
@@ -1203,6 +1253,39 @@ class ReferenceMapping(Mapping):
             else:
                 raise
 
+    def _cached_get_best_ref(self, header):
+        """Return _get_best_ref(`header`) using the optional lookup cache.   Since the outcome
+        depends only on the values of this rmap's required parkeys,  the cache is keyed on
+        minimize_header(`header`) and both bestrefs and the exceptions raised in their place
+        are cached and replayed.
+        """
+        if self._lookup_cache is None:
+            return self._get_best_ref(header)
+        try:
+            key = tuple(self.minimize_header(header).values())
+            with self._lookup_lock:
+                outcome = self._lookup_cache.get(key)
+        except Exception:   # e.g. unhashable header values,  look up uncached
+            return self._get_best_ref(header)
+        if outcome is None:
+            try:
+                outcome = (True, self._get_best_ref(header))
+            except Exception as exc:
+                outcome = (False, exc)
+            with self._lookup_lock:
+                self._lookup_cache[key] = outcome
+        succeeded, result = outcome
+        if succeeded:
+            return result
+        raise result.with_traceback(None)
+
+    def get_lookup_cache_stats(self):
+        """Return (hits, misses, entries) for this rmap's lookup cache,  or None if it is disabled."""
+        if self._lookup_cache is None:
+            return None
+        with self._lookup_lock:
+            return self._lookup_cache.hits, self._lookup_cache.misses, len(self._lookup_cache)
+
     def _get_best_ref(self, header_in):
         """Return the single reference file basename appropriate for
         `header_in` selected by this ReferenceMapping.
@@ -1331,10 +1414,18 @@ class ReferenceMapping(Mapping):
 
     def file_matches(self, filename):
         """Return a list of the match tuples which refer to `filename`."""
-        sofar = ((("observatory", self.observatory),
-                  ("instrument",self.instrument),
-                  ("filekind", self.filekind),),)
-        return sorted(self.selector.file_matches(filename, sofar))
+        return sorted(self.file_matches_index().get(filename, []))
+
+    def file_matches_index(self):
+        """Return { filename : [ match tuples referring to filename, ...], ... } for every
+        file in this rmap,  computed in one traversal of the selector tree.
+        """
+        if getattr(self, "_file_matches_index", None) is None:
+            sofar = ((("observatory", self.observatory),
+                      ("instrument",self.instrument),
+                      ("filekind", self.filekind),),)
+            self._file_matches_index = dict(self.selector.file_matches_map(sofar))
+        return self._file_matches_index
 
     def difference(self, other, path=(), pars=(), include_header_diffs=False, recurse_added_deleted=False):
         """Return the list of difference tuples between `self` and `other`, prefixing each tuple with context `path`.
@@ -1628,6 +1719,74 @@ def _load_mapping(mapping, **keys):
     else:
         return cls.from_file(mapping, **keys)
 
+def preload_closure(context, workers=None):
+    """Load the sub-mappings in the closure of `context` in `workers` processes,
+    one level (.imaps, then .rmaps) at a time,  and add them to the cache of
+    get_cached_mapping().   Subsequent demand loads,  e.g. by force_load(),  then
+    find them in the cache rather than reading and parsing each file in turn.
+
+    Only sub-mappings of contexts loaded by get_cached_mapping() are preloaded.
+    Sub-mappings which fail to load are skipped here and report their errors
+    when they are loaded on demand.
+    """
+    workers = config.LOAD_WORKERS.get() if workers is None else workers
+    if workers <= 1:
+        return
+    contexts, pool = [context], None
+    try:
+        while contexts:
+            contexts, work = _closure_level(contexts)
+            if not work:
+                continue
+            if pool is None:
+                log.verbose("Loading", repr(context.basename), "with", workers, "worker processes.", verbosity=55)
+                pool = multiprocessing.get_context("fork").Pool(workers, initializer=_init_load_worker)
+            for key, loaded in pool.imap_unordered(_load_selection, work):
+                if loaded is not None:
+                    _load_mapping.cache[key] = loaded
+                    if isinstance(loaded, ContextMapping):
+                        contexts.append(loaded)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def _closure_level(contexts):
+    """Return the cached sub-contexts of `contexts` and the (cache_key, mapping, keys)
+    work for the sub-mappings of `contexts` which are not yet cached.
+    """
+    subcontexts, work, queued = [], [], set()
+    for context in contexts:
+        keys = context.keys
+        if keys.get("loader") is not get_cached_mapping:
+            continue
+        for name in context.selector.values():
+            if MappingSelectionsDict.is_special_value(name):
+                continue
+            key = _load_mapping.cache_key(name, **keys)
+            if key in _load_mapping.cache:
+                if isinstance(_load_mapping.cache[key], ContextMapping):
+                    subcontexts.append(_load_mapping.cache[key])
+            elif key not in queued:
+                queued.add(key)
+                work.append((key, name, keys))
+    return subcontexts, work
+
+def _init_load_worker():
+    """Keep preload_closure() worker processes from loading more than requested."""
+    config.LOAD_WORKERS.set(1)
+    config.FORCE_COMPLETE_LOAD.set(False)
+
+def _load_selection(work):
+    """Load one sub-mapping for preload_closure(),  returning (cache_key, mapping)
+    or (cache_key, None) if it cannot be loaded.
+    """
+    key, name, keys = work
+    try:
+        return key, _load_mapping.uncached(name, **keys)
+    except Exception as exc:
+        log.verbose("Preloading", repr(name), "failed:", str(exc), verbosity=55)
+        return key, None
+
 def asmapping(filename_or_mapping, cached=False, **keys):
     """Return the Mapping object corresponding to `filename_or_mapping`.
     filename_or_mapping must either be a string (filename to be loaded) or
@@ -1733,8 +1892,8 @@ def list_mappings(glob_pattern, observatory, full_path=False):
 
 def list_pickles(glob_pattern, observatory, full_path=False):
     """Return the list of cached mappings for `observatory` which match `glob_pattern`."""
-    pattern = config.locate_pickle(glob_pattern, observatory)
-    pickles = _glob_list(pattern, full_path)
+    pickles = _glob_list(config.locate_pickle(glob_pattern, observatory), full_path)
+    pickles += _glob_list(config.locate_context_file(glob_pattern, observatory), full_path)
     if full_path:
         pickles = [pkl for pkl in pickles if not os.path.isdir(pkl)]
     return sorted(set(pickles))
@@ -0,0 +1,210 @@
+"""This module defines a dedicated parser for the declarative subset of Python
+used by CRDS mappings.   It builds the same namespace of header, selector, and
+comment values as verifying, compiling, and exec'ing mapping text, but directly
+from the text without compiling any Python,  so it is both faster and safe
+by construction:  only literals and calls to the Selectors in
+selectors.SELECTORS can be evaluated.
+
+The grammar accepted is:
+
+    mapping    :=  ( NAME '=' section NEWLINE )*      NAME in header, selector, comment
+    section    :=  dict | call | string
+    value      :=  string | number | '-' number | True | False | None |
+                   tuple | list | dict | call
+    call       :=  SELECTOR '(' value, ... ')'
+
+with Python's string and number literal syntax,  comments,  implicit string
+concatenation,  and trailing commas.   Text using any other construct which
+MappingVerifier permits,  e.g. the IfExp,  Compare,  or BinOp expressions,  is
+not handled here:  parse() returns None and the mapping is loaded by verifying
+and exec'ing it as before,  which also reports any errors.
+
+>>> namespace = parse('''
+... header = {
+...     'name' : 'test.rmap',   # comment
+...     'parkey' : (('DETECTOR',), ('DATE-OBS', 'TIME-OBS')),
+...     'extra' : [1, -2.5, True, None, "implicit" " concatenation"],
+... }
+...
+... selector = Match({
+...     ('HRC',) : UseAfter({
+...         '1992-01-01 00:00:00' : 'hrc.fits',
+...     }),
+... })
+... ''')
+>>> namespace["header"]["parkey"]
+(('DETECTOR',), ('DATE-OBS', 'TIME-OBS'))
+>>> namespace["header"]["extra"]
+[1, -2.5, True, None, 'implicit concatenation']
+>>> namespace["selector"]
+Match
+>>> sorted(namespace["selector"].keys())
+[('HRC',)]
+
+Constructs outside the declarative subset are left to the verifier:
+
+>>> parse("header = {'x' : 1 if True else 2}") is None
+True
+>>> parse("header = {'x' : __import__('os')}") is None
+True
+>>> parse("header = {}; selector = {}") is None
+True
+"""
+import re
+import ast
+
+# ============================================================================
+
+from . import log, selectors
+
+# ============================================================================
+
+# Each token is a tuple of (space, string, number, name, op, other) where space is
+# the whitespace and comments preceding the token and exactly one of the rest is
+# non-empty,  except for the empty token(s) marking the end of the text.
+_TOKEN_RE = re.compile(r"""
+    ((?:[ \t\f\r\n]|\#[^\r\n]*|\\\r?\n)*)
+    (?:((?:[rRbBuU]|[bB][rR]|[rR][bB])?
+          (?:'''(?:[^'\\]|\\.|'(?!''))*'''
+            |\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+            |'(?:[^'\\\r\n]|\\.)*'(?!')
+            |"(?:[^"\\\r\n]|\\.)*"(?!")))
+      |((?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][-+]?\d+)?)
+      |([A-Za-z_]\w*)
+      |([-{}()\[\],:=])
+      |\Z
+      |(.))
+""", re.VERBOSE | re.DOTALL)
+
+_CONSTANTS = {
+    "True" : True,
+    "False" : False,
+    "None" : None,
+}
+
+_SECTIONS = ("header", "selector", "comment")
+
+class _Unsupported(Exception):
+    """The mapping text uses a construct this parser does not handle."""
+
+# ============================================================================
+
+def parse(text):
+    """Return the dictionary of section names and values defined by mapping
+    `text`,  or None if `text` is not in the declarative subset handled here.
+    """
+    try:
+        return _Parser(text).parse()
+    except Exception as exc:
+        log.verbose("Declarative mapping parse failed,  verifying instead:", str(exc), verbosity=70)
+        return None
+
+class _Parser:
+    """Recursive descent parser over the tokens of one mapping."""
+
+    def __init__(self, text):
+        self.tokens = _TOKEN_RE.findall(text)
+        self.index = 0
+
+    def parse(self):
+        """Return the namespace defined by the complete mapping text."""
+        namespace = {}
+        while any(self.tokens[self.index][1:]):
+            space, _, _, section, _, _ = self.next()
+            if "\\" in space or (space or self.index > 1) and not space.endswith("\n"):
+                raise _Unsupported("each section must be defined at the start of a new line")
+            if section not in _SECTIONS:
+                raise _Unsupported("only header, selector, or comment sections can be defined")
+            self.expect("=")
+            _, string, _, name, op, _ = self.tokens[self.index]
+            if not (string or op == "{" or name in selectors.SELECTORS):
+                raise _Unsupported("section value must be a selector call or dictionary or string")
+            namespace[section] = self.value()
+        return namespace
+
+    def next(self):
+        """Consume and return the next token."""
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, op):
+        """Consume the next token,  which must be `op`."""
+        token = self.next()
+        if token[4] != op:
+            raise _Unsupported("expected " + repr(op) + " but found " + repr("".join(token[1:]) or "end"))
+
+    def value(self):
+        """Consume and return the next value."""
+        _, string, number, name, op, other = self.next()
+        if string:
+            value = _string(string)
+            while self.tokens[self.index][1]:   # implicit concatenation
+                value += _string(self.next()[1])
+            return value
+        elif op == "{":
+            return self.dict_()
+        elif op == "(":
+            return self.tuple_()
+        elif op == "[":
+            return self.sequence("]")
+        elif name in selectors.SELECTORS:
+            self.expect("(")
+            return selectors.SELECTORS[name](*self.sequence(")"))
+        elif number:
+            return ast.literal_eval(number)
+        elif name in _CONSTANTS:
+            return _CONSTANTS[name]
+        elif op == "-" and self.tokens[self.index][2]:
+            return -ast.literal_eval(self.next()[2])
+        else:
+            raise _Unsupported("unexpected " + repr(name or op or other or "end"))
+
+    def sequence(self, close):
+        """Consume comma separated values up to `close` and return them as a list."""
+        values = []
+        while self.tokens[self.index][4] != close:
+            values.append(self.value())
+            if self.tokens[self.index][4] != close:
+                self.expect(",")
+        self.index += 1
+        return values
+
+    def tuple_(self):
+        """Consume a parenthesized tuple or expression following '('."""
+        values = []
+        while self.tokens[self.index][4] != ")":
+            values.append(self.value())
+            if self.tokens[self.index][4] == ")":
+                if len(values) == 1:   # (value) is not a tuple
+                    self.index += 1
+                    return values[0]
+            else:
+                self.expect(",")
+        self.index += 1
+        return tuple(values)
+
+    def dict_(self):
+        """Consume the items of a dictionary following '{'."""
+        dict_ = {}
+        tokens = self.tokens
+        while tokens[self.index][4] != "}":
+            key = self.value()
+            self.expect(":")
+            dict_[key] = self.value()
+            if tokens[self.index][4] != "}":
+                self.expect(",")
+        self.index += 1
+        return dict_
+
+def _string(token):
+    """Return the value of string literal `token`."""
+    if "\\" in token or token[0] not in "'\"":
+        value = ast.literal_eval(token)
+        if not isinstance(value, str):
+            raise _Unsupported("bytes literals are not supported")
+        return value
+    elif token[:3] in ("'''", '"""'):
+        return token[3:-3]
+    else:
+        return token[1:-1]
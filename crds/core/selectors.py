@@ -86,10 +86,11 @@ with ClosestTime utilizing "time" and SelectVersion utilizing "sw_version".
 # ==============================================================================
 
 import re
+import bisect
 import fnmatch
 import sys
 import numbers
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 import ast
 import copy
 from pprint import pprint as pp
@@ -804,6 +805,20 @@ class Selector:
                     matches.append(here)
         return sorted(matches)
 
+    def file_matches_map(self, sofar=()):
+        """Return { filename : [ nested match keys leading to filename, ... ], ... } for
+        every terminal of this Selector tree in a single traversal.
+        """
+        matches = defaultdict(list)
+        for key, value in self._raw_selections:
+            here = tuple(sofar + (self.match_item(key),))
+            if isinstance(value, Selector):
+                for filename, paths in value.file_matches_map(here).items():
+                    matches[filename].extend(paths)
+            else:
+                matches[value].append(here)
+        return matches
+
     def match_item(self, key):
         """Return ((parkey, key_field), ...) for match key `key`.   Fix string `key`s to unary tuples."""
         if not isinstance(key, tuple):
@@ -1635,6 +1650,97 @@ def matcher(key):
     else:
         return Matcher(key)
 
+def iter_bits(bitset):
+    """Yield the indices of the bits set in integer `bitset` in ascending order.
+
+    >>> list(iter_bits(0b101001))
+    [0, 3, 5]
+
+    >>> list(iter_bits(0))
+    []
+    """
+    while bitset:
+        low_bit = bitset & -bitset
+        yield low_bit.bit_length() - 1
+        bitset ^= low_bit
+
+class MatchIndex:
+    """MatchIndex is a precompiled per-parameter index over the match tuples
+    of a MatchSelector.   For each parameter,  rows with literal keys are
+    bucketed by value,  rows with N/A keys are collected as "don't care",  and
+    rows requiring any other kind of Matcher (globs, regexes, inequalities, ...)
+    are kept in a short fallback list which is evaluated the usual way.  Sets
+    of rows are Python int bitsets so winnowing reduces to ands and ors.
+
+    >>> selections = MatchSelector(("foo", "bar"), {
+    ...    ("1.0", "N/A") : "100",
+    ...    ("1.0", "2.0") : "200",
+    ...    ("4.0", "*") : "300",
+    ...    ("5.0", "2.0|3.0") : "400",
+    ... })._match_selections
+    >>> index = MatchIndex(selections, 2)
+    >>> index.match_tuples
+    (('1.0', '2.0'), ('1.0', 'N/A'), ('4.0', '*'), ('5.0', '2.0|3.0'))
+
+    lookup() returns (rows matched or don't care,  rows matched exactly):
+
+    >>> [list(iter_bits(rows)) for rows in index.lookup(0, "1.0")]
+    [[0, 1], [0, 1]]
+
+    >>> [list(iter_bits(rows)) for rows in index.lookup(1, "3.0")]
+    [[1, 2, 3], [2, 3]]
+
+    As with Matcher,  a dataset value of "*" matches everything and "N/A" is
+    don't care for everything:
+
+    >>> [list(iter_bits(rows)) for rows in index.lookup(1, "*")]
+    [[0, 1, 2, 3], [0, 2, 3]]
+
+    >>> [list(iter_bits(rows)) for rows in index.lookup(1, "N/A")]
+    [[0, 1, 2, 3], []]
+    """
+    def __init__(self, match_selections, nparameters):
+        self.match_tuples = tuple(match_selections.keys())
+        self.all_rows = (1 << len(self.match_tuples)) - 1
+        self._literals = [dict() for _i in range(nparameters)]
+        self._literal_rows = [0] * nparameters
+        self._na_rows = [0] * nparameters
+        self._fallbacks = [list() for _i in range(nparameters)]
+        for row, match_tuple in enumerate(self.match_tuples):
+            matchers = match_selections[match_tuple][0]
+            bit = 1 << row
+            for i, matcher_i in enumerate(matchers):
+                if type(matcher_i) is Matcher:   # exact,  not a subclass
+                    literals = self._literals[i]
+                    literals[matcher_i._key] = literals.get(matcher_i._key, 0) | bit
+                    self._literal_rows[i] |= bit
+                elif type(matcher_i) is NaMatcher:
+                    self._na_rows[i] |= bit
+                else:
+                    self._fallbacks[i].append((bit, matcher_i))
+
+    def lookup(self, i, value):
+        """Return bitsets (matched, exact) of the rows whose matcher for parameter
+        `i` accepts `value` with status 1 or 0,  and with status 1 only.
+        """
+        if value == "*":
+            exact = self._literal_rows[i]
+            matched = exact | self._na_rows[i]
+        elif value == "N/A":
+            exact = 0
+            matched = self._literal_rows[i] | self._na_rows[i]
+        else:
+            exact = self._literals[i].get(value, 0)
+            matched = exact | self._na_rows[i]
+        for bit, matcher_i in self._fallbacks[i]:
+            status = matcher_i.match(value)
+            if status == 1:
+                exact |= bit
+                matched |= bit
+            elif status == 0:
+                matched |= bit
+        return matched, exact
+
 class MatchSelection(Selection):
     """
     MatchSelection's are an atypical Selection consisting of multiple keys
@@ -1823,6 +1929,7 @@ Restore original debug behavior:
     def __init__(self, parameters, selections, rmap_header={}):
         super(MatchSelector, self).__init__(parameters, selections, rmap_header)
         self._match_selections = self.get_matcher_selections(dict_wo_dups(self._selections))
+        self._match_index = MatchIndex(self._match_selections, len(self._parameters))
         self._value_map = self.get_value_map()
 
     def _equal_keys(self, key1, key2):
@@ -1898,7 +2005,7 @@ Restore original debug behavior:
         Successively yield any survivors,  in the order of most specific
         matching value (fewest *'s) to least specific matching value.
         """
-        weights, remaining = self._winnow(header, dict(self._match_selections))
+        weights, remaining = self._winnow(header)
 
         sorted_candidates = self._rank_candidates(weights, remaining)
 
@@ -1919,32 +2026,49 @@ Restore original debug behavior:
             yield MatchSelection((match_tuples, selector))
         raise MatchingError("No match found.")
 
-    def _winnow(self, header, remaining):
+    def _winnow(self, header):
         """Based on the parkey values in `header`, winnow out selections
-        from `remaining` which cannot possibly match.  For each surviving
-        selection,  weight each parkey which matches exactly as -1 and
-        "don't care" matches as 0.
+        which cannot possibly match.  For each surviving selection,  weight
+        each parkey which matches exactly as -1 and "don't care" matches as 0.
 
-        returns   ( {match_tuple:weight ...},   remaining_selections
-        """
-        # weights counts the # of parkey value matches, establishing a
-        # goodness-of-match weighting.  negative weights are better matches
-        weights = { match_tuple:0 for match_tuple in remaining.keys() }
+        Winnowing is driven by self._match_index so that each parameter
+        only touches the rows which can match its value rather than every
+        remaining selection.
 
+        returns   ( {match_tuple:weight ...},   remaining_selections )
+        """
+        index = self._get_match_index()
+        candidates = index.all_rows
+        exacts = []
         for i, parkey in enumerate(self._parameters):
             value = header.get(parkey, "UNDEFINED")
             log.verbose("Binding", repr(parkey), "=", repr(value), verbosity=60)
-            for match_tuple, (matchers, _subselector) in list(remaining.items()):
-                # Match the key to the current header vaue
-                match_status = matchers[i].match(value)
-                # returns 1 (match), 0 (don't care), or -1 (no match)
-                if match_status == -1:
-                    log.verbose("Eliminating", match_tuple, "based on", parkey + "=" + repr(value), verbosity=60)
-                    del remaining[match_tuple]   # winnow!
-                else: # matched or don't care,  set weights accordingly
-                    weights[match_tuple] -= match_status
+            matched, exact = index.lookup(i, value)
+            candidates &= matched
+            exacts.append(exact)
+            if not candidates:
+                log.verbose("Eliminated all matches based on", parkey + "=" + repr(value), verbosity=60)
+                break
+        # weights counts the # of parkey value matches, establishing a
+        # goodness-of-match weighting.  negative weights are better matches
+        weights = {}
+        remaining = {}
+        for row in iter_bits(candidates):
+            match_tuple = index.match_tuples[row]
+            bit = 1 << row
+            weights[match_tuple] = -sum(1 for exact in exacts if exact & bit)
+            remaining[match_tuple] = self._match_selections[match_tuple]
         return weights, remaining
 
+    def _get_match_index(self):
+        """Return the MatchIndex for this selector,  compiling it on demand for
+        selectors unpickled from contexts saved before the index existed.
+        """
+        index = self.__dict__.get("_match_index")
+        if index is None:
+            index = self._match_index = MatchIndex(self._match_selections, len(self._parameters))
+        return index
+
     def _rank_candidates(self, weights, remaining):
         """Rank the possible matches in `remaining` according to
         their corresponding `weights`,  with lowest values indicating
@@ -2169,29 +2293,73 @@ Restore debug configuration.
     """
     error_class = UseAfterError
 
+    def __init__(self, *args, **keys):
+        super(UseAfterSelector, self).__init__(*args, **keys)
+        self._sorted_keys = tuple(selection.key for selection in self._selections)
+
     def get_selection(self, date):
         log.verbose("Matching", date, " ", verbosity=60)
-        yield self.bsearch(date, self._selections)
+        yield self.bsearch(date)
+
+    def get_selections(self, dates):
+        """Batch form of get_selection() returning the Selection for each of the conditioned
+        lookup `dates`,  e.g. as returned by _validate_header().
+
+        >>> u = UseAfterSelector(("DATE-OBS", "TIME-OBS"), {
+        ...        '2003-09-26 01:28:00':'nal1503ij_bia.fits',
+        ...        '2004-02-14 00:00:00':'o3913216j_bia.fits',
+        ... })
+        >>> [s.choice for s in u.get_selections(["2004-02-14 00:00:00", "2003-12-01 00:00:00"])]
+        ['o3913216j_bia.fits', 'nal1503ij_bia.fits']
+        """
+        return [self.bsearch(date) for date in dates]
 
-    def bsearch(self, date, selections):
-        """Do a binary search over a sorted selections list."""
-        if len(selections) == 0:
+    def bsearch(self, date):
+        """Do a binary search over the sorted selection keys for the greatest key <= `date`.
+
+        Keys are conditioned when the selector is created,  CRDS timestamps for UseAfter and
+        tuples of ints for VersionAfter,  and compare in time/version order so no per-call
+        parsing or list slicing is needed.
+        """
+        index = bisect.bisect_right(self._get_sorted_keys(), date) - 1
+        if index < 0:
             raise self.error_class("No selection <= " + repr(date))
-        elif len(selections) > 1:
-            left = selections[:len(selections)//2]
-            right = selections[len(selections)//2:]
-            compared = right[0].key
-            log.verbose("...against", compared, end="", verbosity=60)
-            if date >= compared:
-                return self.bsearch(date, right)
-            else:
-                return self.bsearch(date, left)
-        else:
-            if date >= selections[0].key:
-                log.verbose("matched", repr(selections[0]), verbosity=60)
-                return selections[0]
-            else:
-                raise self.error_class("No selection <= " + repr(date))
+        selection = self._selections[index]
+        log.verbose("matched", repr(selection), verbosity=60)
+        return selection
+
+    def delete(self, terminal):
+        """Remove all instances of `terminal` from `self`,  invalidating the sorted keys
+        since Selector.delete() edits the selections in place.
+
+        >>> u = UseAfterSelector(("DATE-OBS", "TIME-OBS"), {
+        ...        '2003-09-26 01:28:00':'a.fits',
+        ...        '2004-02-14 00:00:00':'b.fits',
+        ...        '2005-01-01 00:00:00':'c.fits',
+        ... })
+        >>> _ = u.delete("a.fits")
+        >>> u.bsearch("2003-12-01 00:00:00")   # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        UseAfterError: No selection <= '2003-12-01 00:00:00'
+        >>> u.bsearch("2004-06-01 00:00:00").choice
+        'b.fits'
+        >>> _ = u.delete("c.fits")
+        >>> u.bsearch("2006-01-01 00:00:00").choice
+        'b.fits'
+        """
+        deleted = super(UseAfterSelector, self).delete(terminal)
+        self._sorted_keys = None
+        return deleted
+
+    def _get_sorted_keys(self):
+        """Return the tuple of conditioned selection keys in ascending order,  computing
+        it for selectors unpickled from older versions or after delete().
+        """
+        keys = self.__dict__.get("_sorted_keys")
+        if keys is None:   # or invalidated by delete()
+            keys = self._sorted_keys = tuple(selection.key for selection in self._selections)
+        return keys
 
     def _validate_raw_key(self, key, valid_values_map):
         """Validate a selector date/time field for this UseAfter."""
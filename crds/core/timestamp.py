@@ -3,6 +3,7 @@ HTML tables and HST FITS data sets.   It contains a formatting function which wi
 a date and time in a sortable string representation (isoformat).
 """
 import datetime
+import functools
 import re
 
 from . import config, exceptions, log
@@ -57,9 +58,42 @@ def parse_date(date):
     ...
     InvalidDatetimeError: One or more required date/time values is UNDEFINED
 
+    Results are memoized since the same dates recur constantly in bulk lookups:
+
+    >>> parse_date('1999-12-21 05:42:35.5') is parse_date('1999-12-21 05:42:35.5')
+    True
     """
     if isinstance(date, datetime.datetime):
         date = str(date)
+    return _cached_parse_date(date)
+
+ISO_DATE_RE = re.compile(r"^(\d\d\d\d)-(\d\d)-(\d\d)(?:([ T])(\d\d):(\d\d)(?::(\d\d(?:\.\d+)?))?)?$")
+
+def _parse_date(date):
+    """Uncached parse_date(),  with a fast path for the CRDS standard date formats.
+
+    >>> _parse_date('1999-12-21 05:42:35.5')
+    datetime.datetime(1999, 12, 21, 5, 42, 35, 500000)
+
+    >>> _parse_date('1999-12-21T05:42')
+    datetime.datetime(1999, 12, 21, 5, 42)
+
+    >>> _parse_date('1999-12-21')
+    datetime.datetime(1999, 12, 21, 0, 0)
+
+    >>> _parse_date('2003-09-35 01:28:00')
+    Traceback (most recent call last):
+    ...
+    ValueError: day is out of range for month
+    """
+    match = ISO_DATE_RE.match(date)
+    if match and not (match.group(4) == "T" and "." in date):  # T with fraction is not a valid CRDS date
+        year, month, day, _sep, hour, minute, second = match.groups()
+        ihour, iminute = (int(hour), int(minute)) if hour else (0, 0)
+        second = float(second) if second else 0.0
+        isecond = int(second)
+        imicrosecond = int((second-isecond) * 10**6)   # as in parse_time()
+        return datetime.datetime(int(year), int(month), int(day), ihour, iminute, isecond, imicrosecond)
 
     if "UNDEFINED" in date:
         raise exceptions.InvalidDatetimeError(
@@ -76,6 +110,23 @@ def parse_date(date):
     else:
         return parse_numerical_date(date)
 
+# Bounded,  thread-safe memo of parse_date() results,  datetimes are immutable so they can be shared.
+_cached_parse_date = functools.lru_cache(maxsize=10000)(_parse_date)
+
+def parse_dates(dates):
+    """Parse a sequence or array of date-time strings in any format accepted by parse_date(),
+    returning a numpy datetime64[us] array of the same shape.   Each distinct date is parsed once.
+
+    >>> parse_dates(["2001-03-21 00:00:00", "Mar 21 2001 12:00:00", "2001-03-21 00:00:00"])
+    array(['2001-03-21T00:00:00.000000', '2001-03-21T12:00:00.000000',
+           '2001-03-21T00:00:00.000000'], dtype='datetime64[us]')
+    """
+    import numpy as np
+    dates = np.asarray(dates, dtype=str)
+    unique, inverse = np.unique(dates, return_inverse=True)
+    parsed = np.array([parse_date(date) for date in unique], dtype="datetime64[us]")
+    return parsed[inverse].reshape(dates.shape)
+
 def now(sep=" "):
     """Returns the timestamp for the current time."""
     return format_date(datetime.datetime.now(), sep)
@@ -11,7 +11,10 @@ import re
 import hashlib
 import io
 import functools
-from collections import Counter, defaultdict
+import threading
+import time
+import types
+from collections import Counter, defaultdict, OrderedDict
 import datetime
 import ast
 import gc
@@ -26,7 +29,7 @@ import warnings
 
 # from crds import data_file,  import deferred until required
 
-from . import log, config, pysh, exceptions
+from . import log, config, pysh, exceptions, checksum_ledger
 from .constants import ALL_OBSERVATORIES, INSTRUMENT_KEYWORDS
 
 # ===================================================================
@@ -162,10 +165,11 @@ def cached(func):
     fetches results for prior calls from the cache.   The wrapped function has
     extra attributes:
 
-    .cache                      -- { key(parameters): old_result } dictionary
+    .cache                      -- { key(parameters): old_result } FunctionCache
     .uncached(*args, **keys)    -- original unwrapped function
     .readonly(*args, **keys)    -- function variant which uses but doesn't update cache
     .cache_key(*args, **keys)   -- returns tuple used to locate a function call result
+    .stats(memory=False)        -- returns dict of cache size, hits, misses, evictions, and optionally bytes
 
     >>> @cached
     ... def sum(x,y):
@@ -183,7 +187,7 @@ def cached(func):
     >>> sum(1,2)
     3
 
-    Dump or operate on the cache like this, it's just a dict:
+    Dump or operate on the cache like this, it works like a dict:
 
     >>> sum.cache
     {(1, 2): 3}
@@ -216,6 +220,12 @@ def cached(func):
 
     >>> sum(1,2)
     3
+
+    >>> stats = sum.stats()
+    >>> stats["entries"], stats["hits"], stats["misses"], stats["evictions"], "bytes" in stats
+    (1, 1, 2, 0, False)
+    >>> sum.stats(memory=True)["bytes"] > 0
+    True
     """
     return CachedFunction(func)
 
@@ -223,7 +233,8 @@ class xcached:
     """Caching decorator which supports auxilliary caching parameters.
 
     omit_from_key lists keywords or positional indices to be excluded from cache
-    key creation:
+    key creation.   max_size and ttl limit the number of results cached and the
+    seconds they are kept,  see CachedFunction:
 
     >>> @xcached(omit_from_key=[0, "x"])
     ... def sum(x, y, z):
@@ -240,6 +251,15 @@ class xcached:
 
     >>> sum.readonly(2,2,3)
     6
+
+    >>> @xcached(max_size=2)
+    ... def square(x):
+    ...     return x * x
+
+    >>> [square(x) for x in range(4)]
+    [0, 1, 4, 9]
+    >>> square.cache
+    {(2,): 4, (3,): 9}
     """
     def __init__(self, *args, **keys):
         """Stash the decorator parameters"""
@@ -258,19 +278,77 @@ class xcached:
 class CachedFunction:
     """Class to support the @cached function decorator.   Called at runtime
     for typical caching version of function.
+
+    Results are held in a FunctionCache of at most `max_size` entries which
+    expire `ttl` seconds after they are computed.   CRDS_FUNCTION_CACHE_SIZES
+    overrides `max_size` for individual functions.   Limits which are not
+    specified default to CRDS_FUNCTION_CACHE_SIZE and CRDS_FUNCTION_CACHE_TTL,
+    unlimited.   Limits are re-read from the environment when caches are
+    cleared by clear_function_caches().
+
+    The cache is guarded by a lock so cached functions can be called from
+    multiple threads.   The lock is not held while computing results,  so
+    concurrent calls may compute the same result,  but all of them return
+    the result which is cached first.
+
+    >>> @cached
+    ... def new_object(x):
+    ...     return object()
+
+    >>> from concurrent import futures
+    >>> with futures.ThreadPoolExecutor(8) as pool:
+    ...     results = list(pool.map(new_object, [1] * 100))
+    >>> len(set(id(result) for result in results))
+    1
+
+    >>> os.environ["CRDS_FUNCTION_CACHE_SIZES"] = "crds.core.utils.new_object:10"
+    >>> new_object.clear()
+    >>> new_object.cache.max_size, len(new_object.cache)
+    (10, 0)
+
+    Malformed overrides are ignored with a warning:
+
+    >>> os.environ["CRDS_FUNCTION_CACHE_SIZES"] = "_load_mapping=50, new_object:ten, crds.core.utils.new_object:20"
+    >>> old_verbose, old_warnings = log.set_verbose(-2), log.warnings()
+    >>> new_object.clear()
+    >>> new_object.cache.max_size, log.warnings() - old_warnings
+    (20, 2)
+    >>> _ = log.set_verbose(old_verbose)
+
+    >>> del os.environ["CRDS_FUNCTION_CACHE_SIZES"]
+    >>> new_object.clear()
+    >>> new_object.cache.max_size
+    0
     """
 
     cache_set = set()
 
-    def __init__(self, func, omit_from_key=None):
-        self.cache = dict()
+    def __init__(self, func, omit_from_key=None, max_size=None, ttl=None):
         self.uncached = func
         self.omit_from_key = [] if omit_from_key is None else omit_from_key
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = FunctionCache(*self._limits())
+        self._lock = threading.RLock()
         self.cache_set.add(self)
         self.__doc__ = self.uncached.__doc__
         self.__module__ = self.uncached.__module__
         self.__name__ = self.uncached.__name__ + " [cached]"
 
+    @property
+    def qualified_name(self):
+        """Module qualified name of the cached function,  e.g. crds.core.rmap._load_mapping"""
+        return self.uncached.__module__ + "." + self.uncached.__name__
+
+    def _limits(self):
+        """Return the (max_size, ttl) limits of this function's cache."""
+        sizes = _function_cache_sizes()
+        max_size = sizes.get(self.qualified_name, sizes.get(self.uncached.__name__, self.max_size))
+        if max_size is None:
+            max_size = config.FUNCTION_CACHE_SIZE.get()
+        ttl = config.FUNCTION_CACHE_TTL.get() if self.ttl is None else self.ttl
+        return max_size, ttl
+
     def cache_key(self, *args, **keys):
         """Compute the cache key for the given parameters."""
         args = tuple([ a for (i, a) in enumerate(args) if i not in self.omit_from_key])
@@ -278,44 +356,279 @@ class CachedFunction:
         return args + keys
 
     def _readonly(self, *args, **keys):
-        """Compute (cache_key, func(*args, **keys)).   Do not add to cache."""
+        """Compute (cache_key, func(*args, **keys), cached).   Do not add to cache."""
         key = self.cache_key(*args, **keys)
-        if key in self.cache:
+        with self._lock:
+            result = self.cache.get(key, _UNCACHED)
+        if result is not _UNCACHED:
             log.verbose("Cached call", self.uncached.__name__, repr(key), verbosity=80)
-            return key, self.cache[key]
+            return key, result, True
         else:
             log.verbose("Uncached call", self.uncached.__name__, repr(key), verbosity=80)
-            return key, self.uncached(*args, **keys)
+            return key, self.uncached(*args, **keys), False
 
     def readonly(self, *args, **keys):
         """Compute or fetch func(*args, **keys) but do not add to cache.
         Return func(*args, **keys)
         """
-        _key, result = self._readonly(*args, **keys)
+        _key, result, _cached = self._readonly(*args, **keys)
         return result
 
     def __call__(self, *args, **keys):
         """Compute or fetch func(*args, **keys).  Add the result to the cache.
         return func(*args, **keys)
         """
-        key, result = self._readonly(*args, **keys)
-        self.cache[key] = result
+        key, result, cached = self._readonly(*args, **keys)
+        if not cached:
+            with self._lock:
+                if key in self.cache:   # another thread computed it first
+                    result = self.cache[key]
+                else:
+                    self.cache[key] = result
         return result
 
     def __get__(self, obj, objtype):
         '''Support instance methods.'''
         return functools.partial(self.__call__, obj)
 
+    def clear(self):
+        """Remove all cached results,  zero the statistics,  and re-read the cache limits."""
+        with self._lock:
+            self.cache.clear()
+            self.cache.max_size, self.cache.ttl = self._limits()
+
+    def stats(self, memory=False):
+        """Return a dictionary of statistics describing this function's cache.   If `memory`
+        is True,  include the approximate number of bytes of memory used by the cached results,
+        which can be slow to compute for large results like loaded contexts.
+        """
+        with self._lock:
+            stats = dict(
+                function = self.qualified_name,
+                entries = len(self.cache),
+                max_size = self.cache.max_size,
+                ttl = self.cache.ttl,
+                hits = self.cache.hits,
+                misses = self.cache.misses,
+                evictions = self.cache.evictions,
+            )
+            results = list(self.cache.values()) if memory else None
+        if memory:
+            stats["bytes"] = deep_sizeof(results) - sys.getsizeof(results)
+        return stats
+
+_UNCACHED = object()   # marks results missing from a FunctionCache
+
+_FUNCTION_CACHE_SIZES = (None, {})   # (CRDS_FUNCTION_CACHE_SIZES,  { function name : max_size })
+
+def _function_cache_sizes():
+    """Return { function name : max_size } parsed from CRDS_FUNCTION_CACHE_SIZES,  ignoring
+    with a warning any entries which are not <function>:<size>.   Since limits are read when
+    cached functions are defined,  a bad setting must not prevent importing CRDS.
+    """
+    global _FUNCTION_CACHE_SIZES
+    setting = config.FUNCTION_CACHE_SIZES.get()
+    if setting != _FUNCTION_CACHE_SIZES[0]:
+        sizes = {}
+        for override in setting.split(","):
+            if not override.strip():
+                continue
+            try:
+                name, size = override.split(":")
+                size = int(size)
+                if not name.strip() or size < 0:
+                    raise ValueError("bad function name or size")
+            except ValueError:
+                log.warning("Ignoring CRDS_FUNCTION_CACHE_SIZES entry", repr(override),
+                            "which is not <function>:<size>.")
+                continue
+            sizes[name.strip()] = size
+        _FUNCTION_CACHE_SIZES = (setting, sizes)
+    return _FUNCTION_CACHE_SIZES[1]
+
 def clear_function_caches():
     "Clear all the caches created using @utils.cached or @utils.xcached."""
     for cache_func in CachedFunction.cache_set:
         log.verbose("Clearing cache for", repr(cache_func.uncached), verbosity=80)
-        cache_func.cache = dict()
+        cache_func.clear()
 
-def list_cached_functions():
-    """List all the functions supporting caching under @utils.cached or @utils.xcached."""
-    for cache_func in sorted(CachedFunction.cache_set):
-        print(repr(cache_func.uncached))
+def get_function_cache_stats(memory=False):
+    """Return a list of statistics dictionaries for each function cached with
+    @utils.cached or @utils.xcached,  see CachedFunction.stats().
+    """
+    cache_funcs = sorted(CachedFunction.cache_set, key=lambda cache_func: cache_func.qualified_name)
+    return [cache_func.stats(memory) for cache_func in cache_funcs]
+
+def list_cached_functions(memory=False):
+    """List all the functions supporting caching under @utils.cached or @utils.xcached
+    with the size,  limits,  and hit,  miss,  and eviction counts of their caches,  and
+    their approximate memory use if `memory` is True.
+    """
+    print("{:<60} {:>7} {:>8} {:>6} {:>8} {:>8} {:>9} {:>7}".format(
+        "function", "entries", "max_size", "ttl", "hits", "misses", "evictions", "bytes"))
+    for stats in get_function_cache_stats(memory):
+        print("{function:<60} {entries:>7} {max_size:>8} {ttl:>6} {hits:>8} {misses:>8} {evictions:>9} ".format(
+            **stats) + (human_format_number(stats["bytes"]) if "bytes" in stats else ""))
+
+class LRUCache:
+    """Dictionary-like cache holding at most `max_size` entries,  evicting the least
+    recently used entry when full.   Lookups are counted as hits or misses.
+
+    >>> cache = LRUCache(2)
+    >>> cache["a"] = 1
+    >>> cache["b"] = 2
+    >>> cache.get("a")
+    1
+    >>> cache["c"] = 3
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.get("b", "missing")
+    'missing'
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> cache.clear()
+    >>> len(cache), cache.hits, cache.misses
+    (0, 0, 0)
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value for `key` marking it most recently used,  or `default`."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        """Return the cached keys,  least recently used first."""
+        return self._entries.keys()
+
+    def clear(self):
+        """Remove all entries and zero the hit and miss counts."""
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+class FunctionCache(LRUCache):
+    """LRUCache of CachedFunction results which is unbounded when `max_size` is 0,
+    expires entries `ttl` seconds after they are added unless `ttl` is 0,  and
+    counts evictions.   It is otherwise used like a dict,  and looking up results
+    with [] or `in` is not counted as a hit or miss.
+
+    >>> cache = FunctionCache(2, ttl=60)
+    >>> cache["a"], cache["b"], cache["c"] = 1, 2, 3
+    >>> cache
+    {'b': 2, 'c': 3}
+    >>> cache.evictions
+    1
+    >>> cache._added["b"] -= 61
+    >>> cache.get("b", "expired"), cache.get("c")
+    ('expired', 3)
+    >>> cache.hits, cache.misses, cache.evictions
+    (1, 1, 2)
+    >>> cache.max_size = 0
+    >>> for i in range(100):
+    ...     cache[i] = i
+    >>> len(cache), cache.evictions
+    (101, 2)
+    """
+    def __init__(self, max_size=0, ttl=0):
+        super(FunctionCache, self).__init__(max_size)
+        self.ttl = ttl
+        self.evictions = 0
+        self._added = {}   # { key : time.time() when added },  only when ttl
+
+    def get(self, key, default=None):
+        """Return the value for `key` marking it most recently used,  or `default`
+        if `key` is not cached or has expired.
+        """
+        if self.ttl and key in self._added and time.time() - self._added[key] > self.ttl:
+            self._evict(key)
+        return super(FunctionCache, self).get(key, default)
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if self.ttl:
+            self._added[key] = time.time()
+        while self.max_size and len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)))
+
+    def __delitem__(self, key):
+        del self._entries[key]
+        self._added.pop(key, None)
+
+    def _evict(self, key):
+        """Remove `key` and count it as evicted."""
+        del self[key]
+        self.evictions += 1
+
+    def __repr__(self):
+        return repr(dict(self._entries))
+
+    def values(self):
+        """Return the cached values,  least recently used first."""
+        return self._entries.values()
+
+    def items(self):
+        """Return the cached (key, value) pairs,  least recently used first."""
+        return self._entries.items()
+
+    def clear(self):
+        """Remove all entries and zero the hit,  miss,  and eviction counts."""
+        super(FunctionCache, self).clear()
+        self._added.clear()
+        self.evictions = 0
+
+def deep_sizeof(obj):
+    """Return the approximate number of bytes of memory used by `obj` and the objects
+    it refers to through containers and instance attributes,  counting shared objects
+    once.   Modules,  classes,  and functions are not counted.
+
+    >>> deep_sizeof([]) < deep_sizeof(["a" * 1000]) < deep_sizeof(["a" * 1000, "b" * 1000])
+    True
+    """
+    seen, total, pending = set(), 0, [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _UNSIZED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        try:
+            pending.append(object.__getattribute__(obj, "__dict__"))
+        except AttributeError:
+            pass
+    return total
+
+_UNSIZED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
 
 # ===================================================================
 
@@ -592,7 +905,10 @@ def create_path(path, mode=DEFAULT_DIR_PERMS):
         subdir = os.path.abspath(os.path.join(*current))
         if not os.path.exists(subdir):
             log.verbose("Creating", repr(subdir), "with permissions %o" % mode)
-            os.mkdir(subdir, mode)
+            try:
+                os.mkdir(subdir, mode)
+            except FileExistsError:   # created concurrently,  e.g. by another download thread
+                continue
             with log.verbose_warning_on_exception(
                     "Failed chmod'ing new directory", repr(subdir), "to %o." % mode):
                 os.chmod(subdir, mode)
@@ -716,19 +1032,74 @@ def get_uri_content(uri, mode="text"):
 
 # ===================================================================
 
-def checksum(pathname):
+class StreamingChecksum:
+    """Incrementally computes the CRDS sha1sum and size of data as it is
+    streamed,  e.g. during a download or copy,  so that verifying the data
+    does not require reading it back from disk.   Results must match
+    checksum() and str_checksum().
+
+    >>> xsum = StreamingChecksum()
+    >>> list(xsum.stream([b"this is ", b"a test."]))
+    [b'this is ', b'a test.']
+    >>> xsum.hexdigest() == str_checksum("this is a test.")
+    True
+    >>> xsum.size
+    15
+    """
+    def __init__(self):
+        self.xsum = hashlib.sha1()
+        self.size = 0
+
+    def update(self, block):
+        """Add bytes `block` to the checksum."""
+        self.xsum.update(block)
+        self.size += len(block)
+
+    def stream(self, blocks):
+        """Checksum each of `blocks` as it is yielded."""
+        for block in blocks:
+            self.update(block)
+            yield block
+
+    def update_file(self, pathname, length=None):
+        """Add the first `length` bytes,  or all,  of the file at `pathname` to the checksum.
+        Return self.
+        """
+        if length is None:
+            length = os.stat(pathname).st_size
+        with open(pathname, "rb") as infile:
+            if hasattr(os, "posix_fadvise"):   # hint sequential readahead
+                os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while length > 0:
+                block = infile.read(min(length, config.CRDS_CHECKSUM_BLOCK_SIZE))
+                if not block:
+                    break
+                length -= len(block)
+                self.update(block)
+        return self
+
+    def hexdigest(self):
+        """Return the CRDS sha1sum of the data so far."""
+        return self.xsum.hexdigest()
+
+def checksum(pathname, rehash=None):
     """Return the CRDS hexdigest for file at `pathname`.   See also
     copy_and_checksum() below which must match sha1sum results.
+
+    Reuses the sha1sum recorded in the checksum ledger if the file is unchanged
+    since it was recorded,  unless `rehash` is True.   `rehash` defaults to
+    CRDS_FORCE_REHASH.
     """
-    xsum = hashlib.sha1()
-    with open(pathname, "rb") as infile:
-        size = 0
-        insize = os.stat(pathname).st_size
-        while size < insize:
-            block = infile.read(config.CRDS_CHECKSUM_BLOCK_SIZE)
-            size += len(block)
-            xsum.update(block)
-    return xsum.hexdigest()
+    if rehash is None:
+        rehash = config.FORCE_REHASH.get()
+    if not rehash:
+        sha1sum = checksum_ledger.lookup(pathname)
+        if sha1sum is not None:
+            return sha1sum
+    stat = os.stat(pathname)
+    sha1sum = StreamingChecksum().update_file(pathname).hexdigest()
+    checksum_ledger.record(pathname, stat, sha1sum)
+    return sha1sum
 
 def copy_and_checksum(source, destination):
     """Copy file from `source` path to `destination` path computing
@@ -739,15 +1110,15 @@ def copy_and_checksum(source, destination):
     but it is possible to make a personally owned copy which replaces the
     original.  See also checksum() which must have matching results.
     """
-    xsum = hashlib.sha1()
+    xsum = StreamingChecksum()
     with open(source, "rb") as source_file:
         with open(destination, "wb+") as destination_file:
-            size = 0
             insize = os.stat(source).st_size
-            while size < insize:
+            while xsum.size < insize:
                 block = source_file.read(config.CRDS_CHECKSUM_BLOCK_SIZE)
+                if not block:
+                    break
                 destination_file.write(block)
-                size += len(block)
                 xsum.update(block)
     return xsum.hexdigest()
 
@@ -17,7 +17,7 @@ import re
 # ============================================================================
 
 import crds
-from crds.core import config, log, pysh, utils, rmap
+from crds.core import config, log, pysh, utils, rmap, selectors
 from crds.core import cmdline, naming
 from crds import rowdiff, sync
 
@@ -287,6 +287,41 @@ class MappingDifferencer(Differencer):
                         instrs[instrument].add(filekind)
         return { key:list(val) for (key, val) in instrs.items() }
 
+    def get_affected_predicates(self):
+        """Examine the diffs between `old_pmap` and `new_pmap` and return predicates on dataset
+        headers which are True for every dataset whose bestref for an affected type could differ.
+
+        Returns { affected_instrument : { affected_type : [ AffectedPredicate, ... ] or None } }
+
+        A type maps to None when all of its datasets are potentially affected,  e.g. for rmap header
+        changes or rmaps with header preconditioning hooks.   Affected types which are missing,  e.g.
+        added or deleted rmaps,  are also not constrained.   Returns None if a pmap or imap header changed.
+        """
+        predicates = defaultdict(dict)
+        for diff in remove_boring(self.mapping_diffs()):
+            names = diff.parameter_names
+            if "ReferenceMapping" not in names:
+                if "header" in diff_action(diff):
+                    log.verbose("Context header difference", diff, "affects all datasets.", verbosity=20)
+                    return None
+                continue   # added, deleted, N/A, or OMIT rmaps have no predicates so all datasets are affected
+            level = names.index("ReferenceMapping")
+            if not isinstance(diff[level], tuple):
+                continue   # recursive diffs of added or deleted rmaps
+            old_rmap = rmap.fetch_mapping(diff[level][0], ignore_checksum=True, path=self.mappings_cache1)
+            new_rmap = rmap.fetch_mapping(diff[level][1], ignore_checksum=True, path=self.mappings_cache2)
+            instrument, filekind = new_rmap.instrument, new_rmap.filekind
+            if predicates[instrument].get(filekind, []) is None:
+                continue
+            if "header" in diff_action(diff) or _has_header_hooks(old_rmap) or _has_header_hooks(new_rmap):
+                predicates[instrument][filekind] = None
+            else:
+                predicate = AffectedPredicate.from_diff(old_rmap, new_rmap, diff[level+1:-1])
+                predicates[instrument].setdefault(filekind, []).append(predicate)
+            log.verbose("Affected", (instrument, filekind), "based on diff", diff,
+                        "for", predicates[instrument][filekind] and predicates[instrument][filekind][-1], verbosity=20)
+        return { instrument : dict(kinds) for (instrument, kinds) in predicates.items() }
+
     def header_modified(self):
         """Return true IFF there were changes in an rmap header."""
         return self._find_diff_str("header")
@@ -308,6 +343,93 @@ class MappingDifferencer(Differencer):
         return False
 
 
+def _has_header_hooks(rmapping):
+    """Return True IFF `rmapping` alters dataset headers before or after selection fails,
+    so changed rules can't be related to the original header values.
+    """
+    return any(rmapping.get_hook(name, None) is not None for name in ["precondition_header", "fallback_header"])
+
+
+class AffectedPredicate:
+    """A necessary condition for a dataset header to select a changed rule of an rmap:  the header
+    can match the Match patterns,  and falls on or after the UseAfter dates,  along the path to the
+    change.   Parameters which are undefined,  not applicable,  or subject to parkey_relevance
+    don't constrain the header,  nor do other kinds of selectors.
+
+    `tests` is [ (selector, key), ... ] naming the rule key of each nested selector on the path.
+    `unconstrained` is the set of parameter names which can be mapped to N/A at match time.
+    """
+    def __init__(self, tests, unconstrained=()):
+        self.tests = tests
+        self.unconstrained = set(unconstrained)
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr([(sel.short_name, key) for (sel, key) in self.tests]) + ")"
+
+    @classmethod
+    def from_diff(cls, old_rmap, new_rmap, path):
+        """Return the predicate for the rmap diff tuple steps `path` between ReferenceMappings `old_rmap`
+        and `new_rmap`.   Rules nested below an added or deleted rule don't constrain the header.
+        """
+        unconstrained = set()
+        for rmapping in [old_rmap, new_rmap]:
+            for name in list(rmapping.header.get("parkey_relevance", {})) + list(rmapping.header.get("comment_parkeys", ())):
+                unconstrained.add(name.upper())
+        old_selector, new_selector = old_rmap.selector, new_rmap.selector
+        tests = []
+        for value in path:
+            old_key, old_choice = _find_rule(old_selector, value)
+            new_key, new_choice = _find_rule(new_selector, value)
+            if old_key is None and new_key is None:
+                break
+            tests.append((old_selector, old_key) if old_key is not None else (new_selector, new_key))
+            if old_key is None or new_key is None:
+                break
+            old_selector, new_selector = old_choice, new_choice
+        return cls(tests, unconstrained)
+
+    def __call__(self, header):
+        """Return False only if `header` cannot select the changed rule."""
+        for selector, key in self.tests:
+            if type(selector) is selectors.MatchSelector:
+                if not _may_match(selector, key, header, self.unconstrained):
+                    return False
+            elif type(selector) in (selectors.UseAfterSelector, selectors.VersionAfterSelector):
+                if not _may_use(selector, key, header):
+                    return False
+        return True
+
+def _find_rule(selector, value):
+    """Return the (key, choice) of the rule of `selector` reported as `value` in diffs,  or (None, None)."""
+    if isinstance(selector, selectors.Selector):
+        for key, choice in selector._raw_selections:
+            if selector._diff_key(key) == value:
+                return key, choice
+    return None, None
+
+def _may_match(selector, key, header, unconstrained):
+    """Return False only if `header` cannot match Match `selector` rule `key`."""
+    if hasattr(selector, "_substitutions"):   # match the rule as substituted and conditioned for lookups
+        key = list(selector.do_substitutions({key : None}))[0]
+    for parkey, elem in zip(selector._parameters, selector.condition_key(key)):
+        value = header.get(parkey, "UNDEFINED")
+        if parkey.upper() in unconstrained or str(value) in ["UNDEFINED", "N/A", "*"]:
+            continue
+        try:
+            matcher = selectors.matcher(elem)
+            if all(matcher.match(val) == -1 for val in {str(value), utils.condition_value(value)}):
+                return False
+        except Exception:
+            continue
+    return True
+
+def _may_use(selector, key, header):
+    """Return False only if `header` comes before UseAfter `selector` rule `key`."""
+    try:
+        return selector._validate_header(header) >= selector.condition_key(key)
+    except Exception:
+        return True
+
 # ==============================================================================================================
 
 class FitsDifferencer(Differencer):
@@ -127,14 +127,14 @@ def get_minimum_exptime(context, references):
     >>> get_minimum_exptime("hst.pmap", ["q9e1206kj_bia.fits"])
     '2006-07-04 11:32:35'
     """
-    return min([_get_minimum_exptime(context, ref) for ref in references])
+    index = crds.get_pickled_mapping(context, cached=True).file_matches_index()  # reviewed
+    return min([_get_minimum_exptime(index.get(ref, [])) for ref in references])
 
-def _get_minimum_exptime(context, reffile):
-    """Given a `context` and a `reffile` in it,  return the minimum EXPTIME for all of
-    it's match paths constructed from DATE-OBS and TIME-OBS.
+def _get_minimum_exptime(match_paths):
+    """Given the `match_paths` of a reference,  return the minimum EXPTIME for all of
+    them constructed from DATE-OBS and TIME-OBS.
     """
-    path_dicts = find_match_paths_as_dict(context, reffile)
-    exptimes = [ get_exptime(path_dict) for path_dict in path_dicts ]
+    exptimes = [ get_exptime(_flatten_items_to_dict(path)) for path in match_paths ]
     return min(exptimes)
 
 
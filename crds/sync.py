@@ -28,12 +28,13 @@ import os.path
 import re
 import shutil
 import glob
+import multiprocessing
 
 # ============================================================================
 
 import crds
-from crds.core import log, config, utils, rmap, heavy_client, cmdline, crds_cache_locking
-from crds import data_file
+from crds.core import log, config, utils, rmap, heavy_client, cmdline, crds_cache_locking, checksum_ledger
+from crds import data_file, uses
 from crds.core.log import srepr
 from crds.client import api
 
@@ -232,6 +233,11 @@ class SyncScript(cmdline.ContextsScript):
                           help='Check cached files against the CRDS database and report anomalies.')
         self.add_argument('-s', '--check-sha1sum', action='store_true', dest='check_sha1sum',
                           help='For --check-files,  also verify file sha1sums.')
+        self.add_argument('-j', '--jobs', type=int, default=1,
+                          help='For --check-files,  number of processes used to compute sha1sums concurrently.  '
+                               'For --save-pickles,  number of processes used to load contexts concurrently.')
+        self.add_argument('--force-rehash', action='store_true', dest='force_rehash',
+                          help='For --check-sha1sum,  recompute sha1sums even for files unchanged since recorded in the checksum ledger.')
         self.add_argument('-r', '--repair-files', action='store_true', dest='repair_files',
                           help='Repair or re-download files noted as bad by --check-files')
         self.add_argument('--purge-rejected', action='store_true', dest='purge_rejected',
@@ -295,6 +301,9 @@ class SyncScript(cmdline.ContextsScript):
             self.args.purge_blacklisted or self.args.purge_rejected):
             self.verify_files(verify_file_list)
 
+        # keep any crds.uses index current with mappings added or purged above.
+        self.update_uses_index()
+
         # context pickles should only be (re)generated after mappings are fully sync'ed and verified
         if self.args.save_pickles:
             self.pickle_contexts(self.contexts)
@@ -324,6 +333,9 @@ class SyncScript(cmdline.ContextsScript):
         if self.args.repair_files:
             self.args.check_files = True
 
+        if self.args.force_rehash:
+            config.FORCE_REHASH.set(True)
+
         if self.args.output_dir:
             os.environ["CRDS_MAPPATH_SINGLE"] = self.args.output_dir
             os.environ["CRDS_REFPATH_SINGLE"] = self.args.output_dir
@@ -413,10 +425,16 @@ class SyncScript(cmdline.ContextsScript):
         else:
             log.warning("Errors occurred during sync,  skipping CRDS cache config and context update.")
 
+    def update_uses_index(self):
+        """Incrementally update the crds.uses reverse index if it has already been built."""
+        if uses.index_exists(self.observatory) and not config.get_cache_readonly():
+            with log.warn_on_exception("Failed updating crds.uses index"):
+                uses.update_index(self.observatory)
+
     def clear_pickles(self):
         """Remove all pickles."""
         log.info("Removing all context pickles.  Use --save-pickles to recreate for specified contexts.")
-        for path in rmap.list_pickles("*.pmap", self.observatory, full_path=True):
+        for path in rmap.list_pickles("*.[pi]map", self.observatory, full_path=True):
             if os.path.exists(path):
                 utils.remove(path, self.observatory)
 
@@ -425,6 +443,8 @@ class SyncScript(cmdline.ContextsScript):
 
         By default this will by-pass existing pickles if they successfully load.
         """
+        if self.args.jobs > 1:
+            config.LOAD_WORKERS.set(self.args.jobs)
         for context in contexts:
             with log.error_on_exception("Failed pickling", repr(context)):
                 crds.get_pickled_mapping.uncached(context, use_pickles=True, save_pickles=True)  # reviewed
@@ -574,6 +594,7 @@ class SyncScript(cmdline.ContextsScript):
         except Exception as exc:
             log.error("Failed getting file info.  CACHE VERIFICATION FAILED.  Exception: ", repr(str(exc)))
             return
+        sha1sums = self.compute_sha1sums(files, infos) if self.args.jobs > 1 else {}
         bytes_so_far = 0
         total_bytes = api.get_total_bytes(infos)
         for nth_file, file in enumerate(files):
@@ -581,11 +602,48 @@ class SyncScript(cmdline.ContextsScript):
             if infos[bfile] == "NOT FOUND":
                 log.error("CRDS has no record of file", repr(bfile))
             else:
-                self.verify_file(file, infos[bfile], bytes_so_far, total_bytes, nth_file, len(files))
+                self.verify_file(file, infos[bfile], bytes_so_far, total_bytes, nth_file, len(files),
+                                 sha1sums.get(file))
                 bytes_so_far += int(infos[bfile]["size"])
 
-    def verify_file(self, file, info, bytes_so_far, total_bytes, nth_file, total_files):
-        """Check one `file` against the provided CRDS database `info` dictionary."""
+    def compute_sha1sums(self, files, infos):
+        """Compute the sha1sums verify_file() will check for `files` using a pool of
+        --jobs processes,  hashing the largest files first to balance the load.
+
+        Returns { file : sha1sum }.   Files which failed to checksum are omitted and
+        re-checked serially by verify_file().
+        """
+        sizes = {}
+        for file in files:
+            bfile = os.path.basename(file)
+            if infos[bfile] == "NOT FOUND" or not (self.args.check_sha1sum or config.is_mapping(bfile)):
+                continue
+            path = config.locate_file(file, observatory=self.observatory)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            if size == int(infos[bfile]["size"]):
+                sizes[file] = size
+        if not sizes:
+            return {}
+        work = [(file, config.locate_file(file, observatory=self.observatory))
+                for file in sorted(sizes, key=lambda file: sizes[file], reverse=True)]
+        log.verbose("Computing sha1sums for", len(work), "files with", self.args.jobs, "processes.", verbosity=10)
+        sha1sums = {}
+        checksum_ledger.flush()   # make pending ledger entries visible to the workers
+        with multiprocessing.get_context("fork").Pool(self.args.jobs) as pool:
+            for file, stat, sha1sum in pool.imap_unordered(_checksum_file, work):
+                if sha1sum is not None:
+                    sha1sums[file] = sha1sum
+                    checksum_ledger.record(config.locate_file(file, observatory=self.observatory), stat, sha1sum)
+        return sha1sums
+
+    def verify_file(self, file, info, bytes_so_far, total_bytes, nth_file, total_files, sha1sum=None):
+        """Check one `file` against the provided CRDS database `info` dictionary.
+
+        `sha1sum` is the precomputed checksum of `file`,  or None to compute it here.
+        """
         path = config.locate_file(file, observatory=self.observatory)
         base = os.path.basename(file)
         n_bytes = int(info["size"])
@@ -607,8 +665,9 @@ class SyncScript(cmdline.ContextsScript):
             self.error_and_repair(path, "File", repr(base), "length mismatch LOCAL size=" + srepr(size),
                                   "CRDS size=" + srepr(info["size"]))
         elif self.args.check_sha1sum or config.is_mapping(base):
-            log.verbose("Computing checksum for", repr(base), "of size", repr(size), verbosity=60)
-            sha1sum = utils.checksum(path)
+            if sha1sum is None:
+                log.verbose("Computing checksum for", repr(base), "of size", repr(size), verbosity=60)
+                sha1sum = utils.checksum(path)
             if info["sha1sum"] == "none":
                 log.warning("CRDS doesn't know the checksum for", repr(base))
             elif info["sha1sum"] != sha1sum:
@@ -693,5 +752,19 @@ class SyncScript(cmdline.ContextsScript):
 
 # ==============================================================================================================
 
+def _checksum_file(work):
+    """Pool worker for SyncScript.compute_sha1sums(),  return (file, stat, sha1sum or None)
+    where stat is os.stat() of the file before it was checksummed.   The parent records
+    the sha1sums in the checksum ledger since pending entries are not written at worker exit.
+    """
+    file, path = work
+    try:
+        stat = os.stat(path)
+        return file, stat, utils.checksum(path)
+    except Exception:
+        return file, None, None
+
+# ==============================================================================================================
+
 if __name__ == "__main__":
     sys.exit(SyncScript()())
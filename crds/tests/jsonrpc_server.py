@@ -0,0 +1,145 @@
+"""This module defines a local stand-in for the CRDS server's JSON RPC service
+which is used to test crds.client.proxy without network access.
+
+LocalJsonRpcServer serves caller-supplied Python functions as JSON RPC methods
+from a background thread on a localhost port.   It handles JSON-RPC 1.0 and 2.0
+requests including 2.0 batch arrays,  supports HTTP keep-alive,  and counts
+connections and requests so tests can check how calls reached it.   It can also
+serve file downloads,  optionally honoring HTTP Range requests.
+
+>>> with LocalJsonRpcServer(dict(add=lambda x, y: x + y)) as server:
+...     proxy = server.proxy()
+...     proxy.add(1, 2)
+3
+"""
+import json
+import threading
+import http.server
+
+from crds.client import proxy as crds_proxy
+
+# ==============================================================================
+
+class LocalJsonRpcServer:
+    """A threaded JSON RPC server on localhost serving `methods`,  a dict mapping
+    method names to Python functions.   Exceptions raised by methods are returned
+    as JSON RPC errors.   If `batch` is False,  batch requests are rejected with
+    an error object like a server which doesn't support them.
+
+    `files` is a dict mapping file names to the bytes served by GET requests under
+    `files_url`.   If `ranges` is False,  Range headers are ignored like a server
+    which doesn't support them.   The offsets of Range requests are recorded in
+    `range_offsets`.
+    """
+    def __init__(self, methods, batch=True, files=None, ranges=True):
+        self.methods = dict(methods)
+        self.batch = batch
+        self.files = dict(files or {})
+        self.ranges = ranges
+        self.range_offsets = []
+        self.connections = 0
+        self.requests = 0
+        self.calls = []
+        self.lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base URL of the JSON RPC service,  like CRDS_SERVER_URL + '/json/'."""
+        return "http://127.0.0.1:{}/json/".format(self.httpd.server_address[1])
+
+    @property
+    def files_url(self):
+        """Base URL of served files,  like CRDS_REFERENCE_URI."""
+        return "http://127.0.0.1:{}/files/".format(self.httpd.server_address[1])
+
+    def proxy(self):
+        """Return a CheckingProxy for this server."""
+        return crds_proxy.CheckingProxy(self.url, version="1.0")
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        crds_proxy.close_connections()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def dispatch(self, jsonrpc_request):
+        """Return the JSON RPC response object for one JSON RPC request object."""
+        method, params = jsonrpc_request["method"], jsonrpc_request.get("params", [])
+        with self.lock:
+            self.calls.append(method)
+        try:
+            func = self.methods[method]
+            result, error = func(**params) if isinstance(params, dict) else func(*params), None
+        except Exception as exc:
+            result, error = None, {"name" : exc.__class__.__name__, "message" : str(exc)}
+        if jsonrpc_request.get("jsonrpc") != "2.0":   # 1.0 responses define both result and error
+            return {"id" : jsonrpc_request.get("id"), "result" : result, "error" : error}
+        elif error:
+            return {"jsonrpc" : "2.0", "id" : jsonrpc_request.get("id"), "error" : error}
+        else:
+            return {"jsonrpc" : "2.0", "id" : jsonrpc_request.get("id"), "result" : result}
+
+    def _handler_class(self):
+        """Return a request handler class bound to this server."""
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def log_message(self, *args):   # silence stderr request logging
+                pass
+
+            def do_POST(self):
+                with server.lock:
+                    server.requests += 1
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                jsonrpc_request = json.loads(body.decode("utf-8"))
+                if isinstance(jsonrpc_request, list):
+                    if server.batch:
+                        response = [server.dispatch(call) for call in jsonrpc_request]
+                    else:
+                        response = {"id" : None, "result" : None,
+                                    "error" : {"name" : "InvalidRequest", "message" : "Batch requests not supported."}}
+                else:
+                    response = server.dispatch(jsonrpc_request)
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                name = self.path.split("/files/")[-1]
+                if name not in server.files:
+                    self.send_error(404)
+                    return
+                data, status = server.files[name], 200
+                requested = self.headers.get("Range", "")
+                if requested.startswith("bytes=") and server.ranges:
+                    offset = int(requested[len("bytes="):].split("-")[0])
+                    with server.lock:
+                        server.range_offsets.append(offset)
+                    data, status = data[offset:], 206
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,38 @@
+"""This module is used to benchmark rmap_parser.parse() against verifying and exec'ing
+the spec rmaps of each observatory.
+"""
+import os
+import glob
+import timeit
+
+from crds.core import rmap_parser, selectors
+from crds.core.mapping_verifier import MAPPING_VERIFIER
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def spec_texts(observatory):
+    """Return the texts of the spec rmaps of `observatory`."""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(HERE, observatory, "specs", "*.rmap"))):
+        with open(path) as handle:
+            texts.append(handle.read())
+    return texts
+
+def execute(code):
+    """Exec rmap `code` the way Mapping._execute() does."""
+    namespace = dict(selectors.SELECTORS)
+    exec(code, namespace)
+    return namespace
+
+def bench(name, statement, texts, number=5):
+    """Print the best time per rmap of `statement` over `number` runs."""
+    names = dict(globals(), texts=texts)
+    seconds = min(timeit.repeat(statement, globals=names, number=1, repeat=number))
+    print("{:<50} {:8.1f} us/rmap".format(name, seconds / len(texts) * 1e6))
+
+if __name__ == "__main__":
+    for observatory in ["tmt", "hst", "jwst"]:
+        texts = spec_texts(observatory)
+        print(observatory, len(texts), "spec rmaps,", sum(len(text) for text in texts), "characters")
+        bench("verify, compile, and exec", "[execute(MAPPING_VERIFIER.compile_and_check(t)) for t in texts]", texts)
+        bench("rmap_parser.parse()", "[rmap_parser.parse(t) for t in texts]", texts)
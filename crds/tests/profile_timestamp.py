@@ -0,0 +1,22 @@
+"""This module is used to benchmark timestamp.parse_date() and parse_dates() against Anydate.get_datetime()."""
+import timeit
+
+from crds.core import timestamp
+
+# Typical bulk lookup dates:  a modest number of distinct values repeated many times.
+ISO_DATES = ["20{:02d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(year, month, day, day, month, year)
+             for year in range(5, 15) for month in range(1, 13) for day in (1, 15)] * 40
+SYB_DATES = [timestamp.parse_date(date).strftime("%b %d %Y %I:%M:%S %p") for date in ISO_DATES]
+
+def bench(name, statement, number=3):
+    """Print the best time per date of `statement` over `number` runs."""
+    seconds = min(timeit.repeat(statement, globals=globals(), number=1, repeat=number))
+    print("{:<50} {:8.3f} us/date".format(name, seconds / len(ISO_DATES) * 1e6))
+
+if __name__ == "__main__":
+    print(len(ISO_DATES), "dates,", len(set(ISO_DATES)), "distinct")
+    bench("Anydate.get_datetime() Sybase dates", "[timestamp.Anydate.get_datetime(d) for d in SYB_DATES]")
+    bench("uncached parse_date() Sybase dates", "[timestamp._parse_date(d) for d in SYB_DATES]")
+    bench("uncached parse_date() ISO dates", "[timestamp._parse_date(d) for d in ISO_DATES]")
+    bench("memoized parse_date() ISO dates", "[timestamp.parse_date(d) for d in ISO_DATES]")
+    bench("parse_dates() ISO dates", "timestamp.parse_dates(ISO_DATES)")
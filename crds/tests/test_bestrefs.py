@@ -2,8 +2,12 @@ import os
 import json
 import shutil
 import datetime
+import threading
+
+from unittest import mock
 
 from crds import bestrefs
+from crds.bestrefs import headers
 from crds.bestrefs import BestrefsScript
 from crds import assign_bestrefs
 from crds.tests import test_config
@@ -420,6 +424,108 @@ def dt_test_jwst_header_to_reftypes():
     ['area', 'camera', 'collimator', 'dark', 'disperser', 'distortion', 'filteroffset', 'fore', 'fpa', 'gain', 'ifufore', 'ifupost', 'ifuslicer', 'ipc', 'linearity', 'mask', 'msa', 'ote', 'photom', 'readnoise', 'refpix', 'regions', 'rscd', 'saturation', 'specwcs', 'superbias', 'v2v3', 'wavelengthrange']
     """
 
+class FakeHeaderServer:
+    """Stand-in for the dataset id and header RPCs used by InstrumentHeaderGenerator
+    which records the id segments requested,  optionally failing on segment `fail`.
+    """
+    def __init__(self, ids, fail=None):
+        self.ids = ids
+        self.fail = fail
+        self.requested = []
+
+    def get_dataset_ids(self, context, instrument, since=None):
+        return list(self.ids)
+
+    def get_dataset_headers_by_id(self, context, ids):
+        self.requested.append(ids)
+        if self.fail is not None and self.ids.index(ids[0]) // len(ids) == self.fail:
+            raise RuntimeError("segment failed")
+        return { dataset : dict(INSTRUME="COS", DATE_OBS="2010-01-01", TIME_OBS="00:00:00", ID=dataset)
+                 for dataset in ids }
+
+    def generator(self, prefetch_depth):
+        """Return an InstrumentHeaderGenerator which gets its headers from this server."""
+        server_info = type("ServerInfo", (), dict(max_headers_per_rpc=3))
+        with mock.patch.object(headers.api, "get_crds_server", return_value="fake"), \
+             mock.patch.object(headers.api, "get_dataset_ids", self.get_dataset_ids):
+            return headers.InstrumentHeaderGenerator(
+                "hst.pmap", ["cos"], None, False, server_info, prefetch_depth=prefetch_depth)
+
+    def read(self, prefetch_depth):
+        """Return the (dataset, header ID) pairs iterated with `prefetch_depth`,
+        and the segments requested from the server.
+        """
+        self.requested = []
+        generator = self.generator(prefetch_depth)
+        with mock.patch.object(headers.api, "get_dataset_headers_by_id", self.get_dataset_headers_by_id):
+            try:
+                result = [(dataset, generator.header(dataset)["ID"]) for dataset in generator.sources]
+            finally:
+                generator.close()
+        return result, sorted(self.requested)
+
+def header_threads():
+    """Return the number of live background header fetching threads."""
+    return len([thread for thread in threading.enumerate() if thread.name.startswith("crds-headers")])
+
+def dt_bestrefs_instrument_headers_prefetch():
+    """
+    Database headers are fetched in segments of max_headers_per_rpc ids.   Prefetching
+    the following segments in the background returns the same headers in the same
+    order and requests the same segments:
+
+    >>> server = FakeHeaderServer(["LA9K03C{}Q".format(i) for i in range(10)])
+    >>> serial, segments = server.read(prefetch_depth=0)
+    >>> serial[:4]
+    [('LA9K03C0Q', 'LA9K03C0Q'), ('LA9K03C1Q', 'LA9K03C1Q'), ('LA9K03C2Q', 'LA9K03C2Q'), ('LA9K03C3Q', 'LA9K03C3Q')]
+    >>> [len(segment) for segment in segments]
+    [3, 3, 3, 1]
+    >>> server.read(prefetch_depth=1) == (serial, segments)
+    True
+    >>> server.read(prefetch_depth=3) == (serial, segments)
+    True
+    >>> header_threads()
+    0
+
+    A failed segment fetch is reported when the segment is needed,  and close() still
+    stops the background threads:
+
+    >>> server = FakeHeaderServer(server.ids, fail=2)
+    >>> server.read(prefetch_depth=2)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: segment failed
+    >>> header_threads()
+    0
+    """
+
+def dt_bestrefs_chunk_headers():
+    """
+    --jobs workers receive the headers of each chunk of datasets from the parent.   Datasets
+    whose headers failed to fetch are carried as errors which the worker raises with the
+    same message,  without fetching their headers again:
+
+    >>> from crds.bestrefs.bestrefs import _chunk_headers
+    >>> server = FakeHeaderServer(["LA9K03C{}Q".format(i) for i in range(6)], fail=1)
+    >>> generator = server.generator(prefetch_depth=0)
+    >>> with mock.patch.object(headers.api, "get_dataset_headers_by_id", server.get_dataset_headers_by_id):
+    ...     chunk = _chunk_headers(generator, server.ids)
+    >>> generator.close()
+    >>> sorted(chunk) == server.ids
+    True
+
+    >>> server.requested = []
+    >>> generator.headers = chunk
+    >>> with mock.patch.object(headers.api, "get_dataset_headers_by_id", server.get_dataset_headers_by_id):
+    ...     generator.header("LA9K03C0Q")["ID"]
+    ...     generator.header("LA9K03C4Q")
+    Traceback (most recent call last):
+    ...
+    CrdsError: segment failed
+    >>> server.requested
+    []
+    """
+
 class TestBestrefs(test_config.CRDSTestCase):
 
     script_class = BestrefsScript
@@ -440,6 +546,26 @@ class TestBestrefs(test_config.CRDSTestCase):
         self.run_script("crds.bestrefs --new-context hst_0315.pmap --load-pickle data/test_cos.pkl --stats --print-affected-details",
                         expected_errs=0)
 
+    def test_bestrefs_from_pickle_jobs(self):
+        cmd = "crds.bestrefs --new-context hst_0315.pmap --load-pickle data/test_cos.pkl --stats --print-affected-details"
+        serial = self.run_captured(cmd)
+        self.assertEqual(serial[0], 0)
+        self.assertEqual(self.run_captured(cmd + " --jobs 2"), serial)
+
+    def test_bestrefs_from_json_jobs(self):
+        cmd = "crds.bestrefs --new-context hst_0315.pmap --load-pickle data/test_cos.json --stats"
+        serial = self.run_captured(cmd)
+        self.assertEqual(serial[0], 1)
+        self.assertEqual(self.run_captured(cmd + " --jobs 2"), serial)
+
+    def test_bestrefs_closes_headers_on_error(self):
+        script = self.script_class("crds.bestrefs --new-context hst_0315.pmap --load-pickle data/test_cos.json")
+        with mock.patch.object(script, "process", side_effect=RuntimeError("process failed")), \
+             mock.patch.object(script, "close_headers", wraps=script.close_headers) as close_headers:
+            with self.assertRaises(RuntimeError):
+                script.main()
+        close_headers.assert_called_once_with()
+
     def test_bestrefs_to_pickle(self):
         self.run_script("crds.bestrefs --datasets LA9K03C3Q:LA9K03C3Q LA9K03C5Q:LA9K03C5Q LA9K03C7Q:LA9K03C7Q "
                         "--new-context hst_0315.pmap --save-pickle test_cos.pkl --stats",
@@ -1,8 +1,10 @@
 import os
 import shutil
+import sqlite3
+import tempfile
 import doctest
 
-from crds.core import log, utils
+from crds.core import log, utils, config, checksum_ledger
 from crds import tests, data_file
 from crds.tests import test_config
 
@@ -215,6 +217,79 @@ def dt_checksum_script_unsupported_text():
     >>> test_config.cleanup(old_state)
     """
 
+def rewrite_in_place(path, text):
+    """Replace the contents of `path` with `text` keeping its modification time."""
+    stat = os.stat(path)
+    with open(path, "r+") as handle:
+        _ = handle.write(text)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+def ledger_entries():
+    """Return the number of sha1sums written to the checksum ledger database."""
+    with sqlite3.connect(config.get_checksum_ledger_path()) as connection:
+        return connection.execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+
+def dt_checksum_ledger():
+    """
+    The ledger is off by default,  so in-place rewrites which keep the size and mtime
+    are always caught:
+
+    >>> old_state = test_config.setup(cache=tempfile.mkdtemp(prefix="crds-ledger-"))
+    >>> config.CHECKSUM_LEDGER.get()
+    False
+    >>> path = os.path.join(config.get_crds_path(), "ledger.txt")
+    >>> with open(path, "w") as handle:
+    ...     _ = handle.write("this is a test.")
+    >>> utils.checksum(path)
+    '7728f8eb7bf75ec3cc49364861eec852fc814870'
+    >>> rewrite_in_place(path, "THIS")
+    >>> utils.checksum(path)
+    '5ee6f375c52cf8f642e8dcb4dd4ba8a2e7beda9c'
+
+    When enabled,  unchanged files reuse their recorded sha1sum without reading them,
+    which is also why a rewrite keeping the size and mtime goes unnoticed:
+
+    >>> _ = config.CHECKSUM_LEDGER.set(True)
+    >>> utils.checksum(path)
+    '5ee6f375c52cf8f642e8dcb4dd4ba8a2e7beda9c'
+    >>> rewrite_in_place(path, "this")
+    >>> utils.checksum(path)
+    '5ee6f375c52cf8f642e8dcb4dd4ba8a2e7beda9c'
+
+    CRDS_FORCE_REHASH,  set by the --force-rehash switches of sync and certify,  bypasses
+    the ledger and refreshes its entries:
+
+    >>> _ = config.FORCE_REHASH.set(True)
+    >>> utils.checksum(path)
+    '7728f8eb7bf75ec3cc49364861eec852fc814870'
+    >>> _ = config.FORCE_REHASH.set(False)
+    >>> utils.checksum(path)
+    '7728f8eb7bf75ec3cc49364861eec852fc814870'
+    >>> utils.checksum(path, rehash=True)
+    '7728f8eb7bf75ec3cc49364861eec852fc814870'
+
+    Changing the size or modification time invalidates the entry:
+
+    >>> with open(path, "w") as handle:
+    ...     _ = handle.write("this is another test.")
+    >>> utils.checksum(path)
+    '1d266444ca8340d463b94adb24a061b04f4f2874'
+
+    Entries are written in batches rather than committed one at a time:
+
+    >>> ledger_entries()
+    0
+    >>> checksum_ledger.flush()
+    >>> ledger_entries()
+    1
+    >>> checksum_ledger.close()
+    >>> checksum_ledger.lookup(path)
+    '1d266444ca8340d463b94adb24a061b04f4f2874'
+
+    >>> checksum_ledger.close()
+    >>> test_config.cleanup(old_state)
+    """
+
 def test():
     """Run module tests,  for now just doctests only.
 
@@ -1,4 +1,6 @@
 import os, os.path
+import io
+import re
 import shutil
 import tempfile
 import unittest
@@ -52,6 +54,21 @@ class CRDSTestCase(unittest.TestCase):
         if expected_errs is not None:
             self.assertEqual(errs, expected_errs)
 
+    def run_captured(self, cmd):
+        """Run script `cmd` returning its error count,  log (errors, warnings),  and log
+        output lines other than timing,  e.g. to compare serial and --jobs runs.
+        """
+        output = io.StringIO()
+        handler = log.add_stream_handler(output)
+        try:
+            errs = self.script_class(cmd)()
+            status = log.status()[:2]
+        finally:
+            log.remove_stream_handler(handler)
+        lines = [line for line in output.getvalue().splitlines()
+                 if not re.search("STARTED|STOPPED|ELAPSED|per-second", line)]
+        return errs, status, lines
+
     def assert_crds_exists(self, filename, observatory="hst"):
         self.assertTrue(os.path.exists(config.locate_file(filename, observatory)))
 
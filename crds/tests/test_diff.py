@@ -59,6 +59,7 @@ from crds.core import log
 from crds import tests
 from crds.tests import test_config
 
+from crds import diff
 from crds.diff import DiffScript
 
 def dt_diff_pmap_diffs():
@@ -610,6 +611,37 @@ def dt_diff_recurse_added_deleted_na():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_diff_affected_predicates():
+    """
+    Adding a UseAfter date below a Match rule only affects datasets which can match the rule on or after the date:
+
+    >>> old_state = test_config.setup()
+    >>> differ = diff.MappingDifferencer("hst", "data/hst_acs_flshfile_0251.rmap", "data/hst_acs_flshfile_0252.rmap")
+    >>> predicates = differ.get_affected_predicates()
+    >>> predicates
+    {'acs': {'flshfile': [AffectedPredicate([('Match', ('WFC', 'ABCD', 2.0, 'LOW', 'B')), ('UseAfter', '2014-07-01 00:00:00')])]}}
+
+    >>> predicate = predicates["acs"]["flshfile"][0]
+    >>> header = {"DETECTOR":"WFC", "CCDAMP":"ABCD", "CCDGAIN":"2", "FLASHCUR":"LOW", "SHUTRPOS":"B",
+    ...           "DATE-OBS":"2015-01-01", "TIME-OBS":"00:00:00"}
+    >>> predicate(header)
+    True
+    >>> predicate(dict(header, **{"DATE-OBS":"2013-01-01"}))
+    False
+    >>> predicate(dict(header, FLASHCUR="HIGH"))
+    False
+    >>> predicate(dict(header, FLASHCUR="N/A"))
+    True
+
+    Header changes at the pmap or imap level affect every dataset:
+
+    >>> differ = diff.MappingDifferencer("hst", "data/hst.pmap", "data/hst_0002.pmap", include_header_diffs=True)
+    >>> differ.get_affected_predicates() is None
+    True
+
+    >>> test_config.cleanup(old_state)
+    """
+
 def main():
     """Run module tests,  for now just doctests only.
 
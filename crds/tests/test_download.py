@@ -0,0 +1,163 @@
+"""This module tests crds.client.api.FileCacher downloads against files served by
+a local stand-in for the CRDS server,  see crds.tests.jsonrpc_server.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import doctest
+
+from crds.core import log, config, utils, exceptions
+from crds.client import api
+from crds.tests import test_config
+from crds.tests.jsonrpc_server import LocalJsonRpcServer
+
+# ==================================================================================
+
+FILES = { "hst_acs_darkfile_{:04d}.fits".format(i) : bytes(range(256)) * (i + 1) * 64 for i in range(8) }
+
+def new_cacher(files=FILES):
+    """Return a FileCacher for hst references with catalog information for `files`
+    like that normally fetched from the server by download_files().
+    """
+    cacher = api.FileCacher("hst.pmap")
+    cacher.info_map = { name : dict(size=str(len(data)), sha1sum=hashlib.sha1(data).hexdigest())
+                        for (name, data) in files.items() }
+    return cacher
+
+def create_path_concurrently(path, threads=8):
+    """Create directory `path` from several threads at once,  returning any exceptions."""
+    barrier, errors = threading.Barrier(threads), []
+    def create():
+        barrier.wait()
+        try:
+            utils.create_path(path)
+        except Exception as exc:
+            errors.append(exc)
+    workers = [threading.Thread(target=create) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return errors
+
+def downloaded(path, name):
+    """Return True IFF `path` contains the served data of `name` and no partial download remains."""
+    with open(path, "rb") as handle:
+        return handle.read() == FILES[name] and not os.path.exists(path + ".part")
+
+# ==================================================================================
+
+def dt_create_path_concurrently():
+    """
+    Download threads race to create the directories of a new cache:
+
+    >>> paths = [os.path.join(tempfile.mkdtemp(prefix="crds-download-"), "a", "b", "c") for _ in range(50)]
+    >>> [errors for errors in map(create_path_concurrently, paths) if errors]
+    []
+    >>> all(os.path.isdir(path) for path in paths)
+    True
+    """
+
+def dt_download_files_parallel():
+    """
+    Concurrent downloads into a new cache must all create the same reference directory.
+
+    >>> old_state = test_config.setup(cache=os.path.join(tempfile.mkdtemp(prefix="crds-download-"), "new-cache"), url=None)
+    >>> old_verbose = log.set_verbose(-1)
+    >>> with LocalJsonRpcServer({}, files=FILES) as server:
+    ...     _ = config.CRDS_REFERENCE_URI.set(server.files_url)
+    ...     cacher = new_cacher()
+    ...     localpaths = { name : cacher.locate(name) for name in FILES }
+    ...     cacher.download_files_parallel(sorted(FILES), localpaths, 4) == sum(len(data) for data in FILES.values())
+    True
+    >>> all(downloaded(localpaths[name], name) for name in FILES)
+    True
+
+    A failed download is reported after the others complete or are cancelled:
+
+    >>> with LocalJsonRpcServer({}, files=dict(list(FILES.items())[1:])) as server:
+    ...     _ = config.CRDS_REFERENCE_URI.set(server.files_url)
+    ...     for path in localpaths.values():
+    ...         utils.remove(path, observatory="hst")
+    ...     new_cacher().download_files_parallel(sorted(FILES), localpaths, 4)   # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    crds.core.exceptions.CrdsDownloadError: Error fetching data for 'hst_acs_darkfile_0000.fits' ... HTTP Error 404: Not Found
+    >>> os.path.exists(localpaths["hst_acs_darkfile_0000.fits"])
+    False
+
+    >>> _ = log.set_verbose(old_verbose)
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_download_resume():
+    """
+    An interrupted download left in a .part file is resumed with an HTTP Range request:
+
+    >>> old_state = test_config.setup(cache=tempfile.mkdtemp(prefix="crds-download-"), url=None)
+    >>> name = "hst_acs_darkfile_0007.fits"
+    >>> cacher = new_cacher()
+    >>> path = cacher.locate(name)
+    >>> utils.ensure_dir_exists(path)
+    >>> def interrupt(length):
+    ...     with open(path + ".part", "wb") as handle:
+    ...         _ = handle.write(FILES[name][:length])
+
+    >>> with LocalJsonRpcServer({}, files=FILES) as server:
+    ...     _ = config.CRDS_REFERENCE_URI.set(server.files_url)
+    ...     interrupt(5000)
+    ...     cacher.download(name, path)
+    ...     server.range_offsets
+    [5000]
+    >>> downloaded(path, name)
+    True
+
+    A server which ignores the Range header resends the whole file,  the resumed bytes
+    are skipped:
+
+    >>> os.remove(path)
+    >>> with LocalJsonRpcServer({}, files=FILES, ranges=False) as server:
+    ...     _ = config.CRDS_REFERENCE_URI.set(server.files_url)
+    ...     interrupt(5000)
+    ...     cacher.download(name, path)
+    ...     server.range_offsets
+    []
+    >>> downloaded(path, name)
+    True
+
+    A .part file as large as the file is not trusted,  it's downloaded again from
+    scratch,  and a corrupt resumed download fails verification and is discarded
+    so the next attempt starts over:
+
+    >>> os.remove(path)
+    >>> with LocalJsonRpcServer({}, files=FILES) as server:
+    ...     _ = config.CRDS_REFERENCE_URI.set(server.files_url)
+    ...     interrupt(len(FILES[name]))
+    ...     cacher.download(name, path)
+    ...     os.remove(path)
+    ...     with open(path + ".part", "wb") as handle:
+    ...         _ = handle.write(b"corrupt")
+    ...     try:
+    ...         cacher.download(name, path)
+    ...     except exceptions.CrdsDownloadError as exc:
+    ...         print("sha1sum" in str(exc), os.path.exists(path + ".part"))
+    ...     cacher.download(name, path)
+    ...     server.range_offsets
+    True False
+    [7]
+    >>> downloaded(path, name)
+    True
+
+    >>> test_config.cleanup(old_state)
+    """
+
+# ==================================================================================
+
+def main():
+    """Run module tests,  for now just doctests only."""
+    from crds.tests import test_download, tstmod
+    return tstmod(test_download)
+
+if __name__ == "__main__":
+    print(main())
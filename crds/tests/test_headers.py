@@ -0,0 +1,226 @@
+"""This module tests the bestrefs header stores and the merging of header files and
+updates by crds.bestrefs.headers.PickleHeaderGenerator.
+"""
+import os
+import json
+import pickle
+import tempfile
+import doctest
+from collections import namedtuple
+
+from crds.core import log, exceptions
+from crds.bestrefs import headers, header_store
+from crds.tests import test_config
+
+# ==================================================================================
+
+Update = namedtuple("Update", "filekind new_reference")
+
+def make_headers(count):
+    """Return { dataset_id : header } for `count` datasets,  every 7th of them a bad
+    dataset string rather than a header.
+    """
+    return { "J8CB{:05d}Q:J8CB{:05d}Q".format(i, i) :
+             "NOT FOUND dataset missing" if i % 7 == 3 else
+             dict(INSTRUME="ACS", DETECTOR=["HRC", "WFC"][i % 2], CCDGAIN=str(float(i % 4)), EXPSTART=str(i))
+             for i in reversed(range(count)) }
+
+def write_store(path, headers):
+    """Write `headers` to JSON-lines header file `path` in their dictionary order."""
+    with header_store.HeaderStoreWriter(path) as writer:
+        for dataset_id, header in headers.items():
+            writer.write(dataset_id, header)
+
+def merged(base, *updates):
+    """Return `base` headers updated keyword-by-keyword by each of `updates` the way
+    PickleHeaderGenerator merges its files,  skipping bad datasets in the updates.
+    """
+    result = { dataset_id : header for (dataset_id, header) in base.items() }
+    for update in updates:
+        for dataset_id, header in update.items():
+            if isinstance(header, str):
+                continue
+            old = result.get(dataset_id)
+            new = {} if old is None or isinstance(old, str) else dict(old)
+            new.update({ key.upper() : headers.bestrefs_condition(val) for (key, val) in header.items() })
+            result[dataset_id] = new
+    return result
+
+def good_headers(headers):
+    """Return the { dataset_id : header } of `headers` which aren't bad dataset strings."""
+    return { dataset_id : header for (dataset_id, header) in headers.items() if isinstance(header, dict) }
+
+def generator_headers(generator):
+    """Return { dataset_id : header } for all sources of `generator` in order,  with the
+    exception message in place of the header for bad datasets.
+    """
+    result = {}
+    for dataset_id in generator.sorted_sources():
+        try:
+            result[dataset_id] = generator.header(dataset_id)
+        except exceptions.CrdsError as exc:
+            result[dataset_id] = str(exc)
+    return result
+
+# ==================================================================================
+
+def dt_header_store_round_trip():
+    """
+    Headers written by HeaderStoreWriter read back the same through the sidecar index,
+    from a re-scan of the data file,  and with load_bestrefs_headers():
+
+    >>> path = os.path.join(tempfile.mkdtemp(prefix="crds-headers-"), "headers.json")
+    >>> original = make_headers(100)
+    >>> write_store(path, original)
+    >>> os.path.exists(header_store.index_path(path))
+    True
+
+    >>> store = header_store.HeaderStore(path)
+    >>> len(store), list(store) == sorted(original), dict(store.items()) == original
+    (100, True, True)
+    >>> all(store[dataset_id] == original[dataset_id] for dataset_id in reversed(list(original)))
+    True
+    >>> [store.position(dataset_id) for dataset_id in sorted(original)] == list(range(100))
+    True
+    >>> list(store.items(40, 43)) == [(dataset_id, original[dataset_id]) for dataset_id in sorted(original)[40:43]]
+    True
+    >>> store.close()
+
+    >>> os.remove(header_store.index_path(path))
+    >>> store = header_store.HeaderStore(path)
+    >>> dict(store.items()) == original == headers.load_bestrefs_headers(path)
+    True
+    >>> store.close()
+
+    Repeated ids are resolved in favor of the last header written,  and an index left
+    stale by appending to the data file is rebuilt:
+
+    >>> with header_store.HeaderStoreWriter(path) as writer:
+    ...     writer.write("J8CB00001Q:J8CB00001Q", {"INSTRUME": "ACS"})
+    ...     writer.write("J8CB00001Q:J8CB00001Q", {"INSTRUME": "WFC3"})
+    >>> with open(path, "a") as handle:
+    ...     _ = handle.write(json.dumps({"J8CB00000Q:J8CB00000Q": {"INSTRUME": "COS"}}) + "\\n")
+    >>> store = header_store.HeaderStore(path)
+    >>> dict(store.items())
+    {'J8CB00000Q:J8CB00000Q': {'INSTRUME': 'COS'}, 'J8CB00001Q:J8CB00001Q': {'INSTRUME': 'WFC3'}}
+    >>> store.close()
+
+    A legacy .json file holding every header in one object on one line opens as a store too:
+
+    >>> with open(path, "w") as handle:
+    ...     json.dump(original, handle)
+    >>> store = headers.open_bestrefs_headers(path)
+    >>> isinstance(store, header_store.HeaderStore), dict(store.items()) == original
+    (True, True)
+    >>> store.close()
+    """
+
+def dt_pickle_header_generator_merge():
+    """
+    Trailing files update the headers of the first keyword-by-keyword,  bad datasets
+    in the updates are skipped with a warning,  and ids found only in updates are added:
+
+    >>> old_state = test_config.setup(url=None)
+    >>> old_verbose = log.set_verbose(-2)
+    >>> tmpdir = tempfile.mkdtemp(prefix="crds-headers-")
+    >>> base = make_headers(30)
+    >>> write_store(os.path.join(tmpdir, "base.json"), base)
+    >>> update1 = { "J8CB00004Q:J8CB00004Q" : dict(detector="sbc", darkfile="n/a"),
+    ...             "J8CB00011Q:J8CB00011Q" : dict(CCDGAIN="4.0"),
+    ...             "J8CB00012Q:J8CB00012Q" : "NOT FOUND dataset missing",
+    ...             "J8CB00099Q:J8CB00099Q" : dict(INSTRUME="ACS", DETECTOR="WFC") }
+    >>> with open(os.path.join(tmpdir, "update1.json"), "w") as handle:
+    ...     json.dump(update1, handle, indent=4)
+    >>> update2 = { "J8CB00011Q:J8CB00011Q" : dict(CCDGAIN="2.0"),
+    ...             "J8CB00002Q:J8CB00002Q" : dict(DETECTOR="WFC") }
+    >>> with open(os.path.join(tmpdir, "update2.pkl"), "wb") as handle:
+    ...     pickle.dump(update2, handle)
+    >>> files = [os.path.join(tmpdir, name) for name in ["base.json", "update1.json", "update2.pkl"]]
+    >>> expected = merged(base, update1, update2)
+    >>> expected["J8CB00004Q:J8CB00004Q"]["DETECTOR"], expected["J8CB00011Q:J8CB00011Q"]["CCDGAIN"]
+    ('SBC', '2.0')
+
+    Segments smaller than the number of datasets give the same results as reading
+    everything at once:
+
+    >>> generators = []
+    >>> for segment_size in [4, 5000]:
+    ...     generator = headers.PickleHeaderGenerator("hst.pmap", files, None)
+    ...     generator.segment_size = segment_size
+    ...     generators.append(generator)
+    >>> results = [generator_headers(generator) for generator in generators]
+    >>> results[0] == results[1]
+    True
+    >>> good_headers(results[0]) == good_headers(expected)
+    True
+    >>> results[0]["J8CB00003Q:J8CB00003Q"]
+    "Failed to fetch header for 'J8CB00003Q:J8CB00003Q': 'NOT FOUND dataset missing'"
+
+    >>> _ = log.set_verbose(-1)
+    >>> results[0]["J8CB00012Q:J8CB00012Q"] == generators[0].header("J8CB00012Q:J8CB00012Q") == base["J8CB00012Q:J8CB00012Q"]
+    CRDS - WARNING -  Skipping bad dataset J8CB00012Q:J8CB00012Q : NOT FOUND dataset missing
+    True
+    >>> _ = log.set_verbose(-2)
+    >>> generators[0].all_headers() == expected
+    True
+
+    Headers updated in memory are copies which are saved in place of the file headers:
+
+    >>> generator = generators[0]
+    >>> generator.update_headers({"J8CB00005Q:J8CB00005Q" : dict(DARKFILE="foo.fits")})
+    >>> generator.handle_updates({"J8CB00006Q:J8CB00006Q" : [Update("darkfile", "BAR.FITS")],
+    ...                           "J8CB00008Q:J8CB00008Q" : []})
+    >>> generator.header("J8CB00005Q:J8CB00005Q")["DARKFILE"], generator.header("J8CB00006Q:J8CB00006Q")["DARKFILE"]
+    ('FOO.FITS', 'bar.fits')
+    >>> expected["J8CB00005Q:J8CB00005Q"] = dict(expected["J8CB00005Q:J8CB00005Q"], DARKFILE="FOO.FITS")
+    >>> expected["J8CB00006Q:J8CB00006Q"] = dict(expected["J8CB00006Q:J8CB00006Q"], DARKFILE="bar.fits")
+    >>> generator.stores[0]["J8CB00006Q:J8CB00006Q"] == base["J8CB00006Q:J8CB00006Q"]
+    True
+
+    Saving and reloading the merged headers round trips in every format:
+
+    >>> for ext in [".json", ".pkl", ".npz"]:
+    ...     saved = os.path.join(tmpdir, "saved" + ext)
+    ...     generator.save_pickle(saved)
+    ...     print(ext, headers.load_bestrefs_headers(saved) == expected)
+    .json True
+    .pkl True
+    .npz True
+
+    --only-ids restricts the datasets generated and updated:
+
+    >>> only_ids = ["J8CB00004Q:J8CB00004Q", "J8CB00099Q:J8CB00099Q"]
+    >>> generator = headers.PickleHeaderGenerator("hst.pmap", files, None, only_ids=only_ids)
+    >>> generator_headers(generator) == { dataset_id : expected[dataset_id] for dataset_id in only_ids }
+    True
+
+    >>> for generator in generators:
+    ...     generator.close()
+    >>> _ = log.set_verbose(old_verbose)
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_pickle_header_generator_cos_update():
+    """
+    The COS example update file replaces individual reference keywords:
+
+    >>> old_state = test_config.setup(url=None)
+    >>> old_verbose = log.set_verbose(-1)
+    >>> generator = headers.PickleHeaderGenerator("hst.pmap", ["data/test_cos.json", "data/test_cos_update.json"], None)
+    >>> header = generator.header("LCE31SW6Q:LCE31SW6Q")
+    >>> header["BADTTAB"], header["GSAGTAB"], header["WALKTAB"], header["INSTRUME"]
+    ('FOO_BADT.FITS', 'BAR_GSAG.FITS', 'W161831HL_WALK.FITS', 'COS')
+    >>> generator.close()
+    >>> _ = log.set_verbose(old_verbose)
+    >>> test_config.cleanup(old_state)
+    """
+
+# ==================================================================================
+
+def main():
+    """Run module tests,  for now just doctests only."""
+    from crds.tests import test_headers, tstmod
+    return tstmod(test_headers)
+
+if __name__ == "__main__":
+    print(main())
@@ -214,6 +214,68 @@ def dt_pickled_mappings(mapping):
     >>> test_config.cleanup(old_state)
     """
 
+def dt_indexed_context_files(mapping):
+    """
+    >>> old_state = test_config.setup()
+    >>> _ = config.PICKLE_FORMAT.set("indexed")
+
+    >>> ctx_file = config.locate_context_file("jwst_0016.pmap","jwst")
+    >>> ctx_file   # doctest: +ELLIPSIS
+    '.../pickles/jwst/jwst_0016.pmap.ctx'
+
+    >>> _ = heavy_client.get_pickled_mapping("jwst_0016.pmap", cached=False, use_pickles=True, save_pickles=True)  # doctest: +ELLIPSIS
+    CRDS - INFO -  Saved pickled context '.../crds-cache-default-test/pickles/jwst/jwst_0016.pmap.ctx'
+    >>> assert os.path.exists(ctx_file)
+
+    >>> loaded = heavy_client.load_pickled_mapping("jwst_0016.pmap")
+    CRDS - INFO -  Loaded context file 'jwst_0016.pmap'
+    >>> len(loaded.selections._contents)
+    0
+    >>> loaded.get_imap("miri").get_rmap("flat").name.startswith("jwst_miri_flat")
+    True
+    >>> list(loaded.selections._contents)
+    ['miri']
+
+    >>> heavy_client.remove_pickled_mapping("jwst_0016.pmap")  # doctest: +ELLIPSIS
+    CRDS - INFO -  Removed pickle for context '.../pickles/jwst/jwst_0016.pmap.ctx'
+    >>> assert not os.path.exists(ctx_file)
+
+    >>> _ = config.PICKLE_FORMAT.set("pickle")
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_split_pickled_mappings(mapping):
+    """
+    >>> old_state = test_config.setup()
+    >>> _ = config.PICKLE_FORMAT.set("split")
+
+    >>> pickle_file = config.locate_pickle("jwst_0016.pmap","jwst")
+    >>> loaded = heavy_client.get_pickled_mapping("jwst_0016.pmap", cached=False, use_pickles=True, save_pickles=True)  # doctest: +ELLIPSIS
+    CRDS - INFO -  Saved pickled context '.../pickles/jwst/jwst_fgs_0007.imap.pkl'
+    ...
+    CRDS - INFO -  Saved pickled context '.../crds-cache-default-test/pickles/jwst/jwst_0016.pmap.pkl'
+    >>> assert os.path.exists(config.locate_pickle(loaded.get_imap("miri").basename, "jwst"))
+
+    >>> loaded = heavy_client.load_pickled_mapping("jwst_0016.pmap")
+    CRDS - INFO -  Loaded pickled context 'jwst_0016.pmap'
+    >>> len(loaded.selections._contents)
+    0
+    >>> loaded.get_imap("miri").get_rmap("flat").name.startswith("jwst_miri_flat")
+    True
+    >>> list(loaded.selections._contents)
+    ['miri']
+
+    >>> heavy_client.remove_pickled_mapping("jwst_0016.pmap")  # doctest: +ELLIPSIS
+    CRDS - INFO -  Removed pickle for context '.../pickles/jwst/jwst_0016.pmap.pkl'
+    CRDS - INFO -  Removed pickle for context '.../pickles/jwst/jwst_fgs_0007.imap.pkl'
+    ...
+    >>> os.path.exists(config.locate_pickle(loaded.get_imap("miri").basename, "jwst"))
+    False
+
+    >>> _ = config.PICKLE_FORMAT.set("pickle")
+    >>> test_config.cleanup(old_state)
+    """
+
 def dt_check_parameters():
     """
     >>> old_state = test_config.setup(url="https://jwst-crds-serverless.stsci.edu", observatory="jwst")
@@ -252,6 +314,55 @@ def dt_get_context_parkeys():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_get_best_references_batch():
+    """
+    Batch bestrefs group datasets by the parkey values each rmap requires,  here the three
+    ACS datasets share most references but not biasfile or crrejtab,  and the COS dataset
+    uses different rmaps entirely.   Every result must match a per-dataset lookup:
+
+    >>> old_state = test_config.setup()
+    >>> from crds import data_file
+    >>> headers = { dataset : data_file.get_header("data/" + dataset + "_raw.fits")
+    ...             for dataset in ["j8bt05njq", "j8bt06o6q", "j8bt09jcq"] }
+    >>> with open("data/test_cos.json") as handle:
+    ...     headers["LCE31SW6Q"] = json.load(handle)["LCE31SW6Q:LCE31SW6Q"]
+
+    >>> batch = heavy_client.get_best_references_batch("data/hst_0001.pmap", headers)
+    >>> sorted(batch) == sorted(headers)
+    True
+    >>> all(batch[dataset] == heavy_client.hv_best_references("data/hst_0001.pmap", header)
+    ...     for (dataset, header) in headers.items())
+    True
+    >>> sorted(set(batch[dataset]["biasfile"] for dataset in ["j8bt05njq", "j8bt06o6q", "j8bt09jcq"]))
+    ['m4m0925ij_bia.fits', 'm4r1753rj_bia.fits']
+
+    Reference types can be restricted for all datasets or per dataset:
+
+    >>> reftypes = {"j8bt05njq" : ["biasfile"], "j8bt06o6q" : ["biasfile", "crrejtab"], "j8bt09jcq" : ["crrejtab"]}
+    >>> acs_headers = { dataset : headers[dataset] for dataset in reftypes }
+    >>> batch = heavy_client.get_best_references_batch("data/hst_0001.pmap", acs_headers, reftypes)
+    >>> all(batch[dataset] == heavy_client.hv_best_references("data/hst_0001.pmap", acs_headers[dataset], reftypes[dataset])
+    ...     for dataset in reftypes)
+    True
+    >>> pp(heavy_client.get_best_references_batch("data/hst_0001.pmap", acs_headers, ["crrejtab"]))
+    {'j8bt05njq': {'crrejtab': 'NOT FOUND n/a'},
+     'j8bt06o6q': {'crrejtab': 'NOT FOUND n/a'},
+     'j8bt09jcq': {'crrejtab': 'n4e12510j_crr.fits'}}
+
+    A dataset which cannot be grouped fails the batch,  identifying the dataset,  so callers
+    like crds.bestrefs fall back to computing each dataset by itself:
+
+    >>> headers["bad"] = {"DETECTOR" : "HRC"}
+    >>> heavy_client.get_best_references_batch("data/hst_0001.pmap", headers)
+    Traceback (most recent call last):
+    ...
+    crds.core.exceptions.CrdsError: Failed grouping dataset 'bad' for batch bestrefs : Missing 'INSTRUME' keyword in header for determining instrument.
+    >>> heavy_client.hv_best_references("data/hst_0001.pmap", headers["j8bt09jcq"], ["crrejtab"]) == batch["j8bt09jcq"]
+    True
+
+    >>> test_config.cleanup(old_state)
+    """
+
 # ==================================================================================
 
 # class TestHeavyClient(test_config.CRDSTestCase):
@@ -55,6 +55,40 @@ def dt_matches_datasets_minimize_headers_contexts_condition():
     >>> config.set_crds_state(old_state)
     """
 
+def dt_matches_file_matches_index():
+    """
+    >>> old_state = test_config.setup()
+    >>> import pickle
+    >>> pmap = rmap.load_mapping("hst_0001.pmap")
+    >>> index = pmap.file_matches_index()
+    >>> pp(index["lc41311jj_pfl.fits"])
+    [((('observatory', 'hst'), ('instrument', 'acs'), ('filekind', 'pfltfile')),
+      (('DETECTOR', 'WFC'),
+       ('CCDAMP', 'A|ABCD|AC|AD|B|BC|BD|C|D'),
+       ('FILTER1', 'F625W'),
+       ('FILTER2', 'POL0V'),
+       ('OBSTYPE', 'IMAGING'),
+       ('FW1OFFST', 'N/A'),
+       ('FW2OFFST', 'N/A'),
+       ('FWSOFFST', 'N/A')),
+      (('DATE-OBS', '1997-01-01'), ('TIME-OBS', '00:00:00')))]
+    >>> pmap.file_matches("lc41311jj_pfl.fits") == index["lc41311jj_pfl.fits"]
+    True
+
+    Indexes aren't pickled,  they're rebuilt on demand after unpickling:
+
+    >>> pickled = pickle.dumps(pmap)
+    >>> pmap.get_imap("acs").get_rmap("pfltfile").__dict__["_file_matches_index"] is not None
+    True
+    >>> unpickled = pickle.loads(pickled)
+    >>> unpickled.get_imap("acs").get_rmap("pfltfile").__dict__["_file_matches_index"] is None
+    True
+    >>> unpickled.file_matches_index() == index
+    True
+
+    >>> config.set_crds_state(old_state)
+    """
+
 # ==================================================================================
 
 
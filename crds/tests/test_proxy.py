@@ -0,0 +1,160 @@
+"""This module tests crds.client.proxy JSON RPC calls against a local stand-in
+for the CRDS server,  see crds.tests.jsonrpc_server.
+"""
+import os
+import glob
+import doctest
+import tempfile
+from unittest import mock
+
+from crds.core import log, config, exceptions
+from crds.client import proxy, api
+from crds.tests import test_config
+from crds.tests.jsonrpc_server import LocalJsonRpcServer
+
+# ==================================================================================
+
+def fail(message):
+    raise RuntimeError(message)
+
+def terminate():
+    raise RuntimeError("External agent requested calling process termination.")
+
+METHODS = dict(
+    add = lambda x, y: x + y,
+    echo = lambda **keys: keys,
+    fail = fail,
+    terminate = terminate,
+)
+
+# ==================================================================================
+
+def dt_proxy_keep_alive():
+    """
+    >>> old_state = test_config.setup(url=None)
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     [rpc.add(i, i) for i in range(5)]
+    ...     rpc.echo(this="that")
+    ...     server.requests, server.connections
+    [0, 2, 4, 6, 8]
+    {'this': 'that'}
+    (6, 1)
+
+    >>> _ = config.CLIENT_KEEP_ALIVE.set(False)
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     [rpc.add(i, i) for i in range(3)]
+    ...     server.requests, server.connections
+    [0, 2, 4]
+    (3, 3)
+    >>> _ = config.CLIENT_KEEP_ALIVE.set(True)
+
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_proxy_errors():
+    """
+    >>> old_state = test_config.setup(url=None)
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     try:
+    ...         rpc.fail("something went wrong")
+    ...     except exceptions.ServiceError as exc:
+    ...         print(repr(exc))
+    ...     try:
+    ...         rpc.terminate()
+    ...     except exceptions.ServiceError as exc:
+    ...         print(exc.__class__.__name__)
+    ...     rpc.add(1, 1)
+    ServiceError("CRDS jsonrpc failure 'fail' something went wrong")
+    OwningProcessAbortedError
+    2
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_proxy_batch():
+    """
+    >>> old_state = test_config.setup(url=None)
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     rpc._batch_call([("add", (1, 2)), ("echo", dict(a=1)), ("add", [3, 4])])
+    ...     server.requests
+    [3, {'a': 1}, 7]
+    1
+
+    Errors in a batch are classified per call:
+
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     results = rpc._batch_call([("add", (1, 2)), ("fail", ("bad call",)), ("terminate", ())], raise_errors=False)
+    ...     for result in results:
+    ...         print(repr(result))
+    3
+    ServiceError("CRDS jsonrpc failure 'fail' bad call")
+    OwningProcessAbortedError('External agent requested calling process termination.')
+
+    >>> with LocalJsonRpcServer(METHODS) as server:
+    ...     rpc = server.proxy()
+    ...     rpc._batch_call([("add", (1, 2)), ("fail", ("bad call",))])
+    Traceback (most recent call last):
+    ...
+    crds.core.exceptions.ServiceError: CRDS jsonrpc failure 'fail' bad call
+
+    Servers without batch support get the calls individually:
+
+    >>> with LocalJsonRpcServer(METHODS, batch=False) as server:
+    ...     rpc = server.proxy()
+    ...     rpc._batch_call([("add", (1, 2)), ("add", (3, 4))])
+    ...     server.requests, server.connections
+    [3, 7]
+    (3, 1)
+
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_proxy_serverless():
+    """
+    >>> old_state = test_config.setup(url=None)
+    >>> rpc = proxy.CheckingProxy("https://jwst-serverless-mode.stsci.edu/json/")
+    >>> rpc._batch_call([("add", (1, 2))])
+    Traceback (most recent call last):
+    ...
+    crds.core.exceptions.ServiceError: Configured for server-less mode.  Skipping JSON RPC 'batch'
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_proxy_rpc_cache():
+    """
+    With CRDS_RPC_CACHE enabled,  cacheable api RPCs are answered from the on-disk
+    cache after the first call to the server:
+
+    >>> old_state = test_config.setup(cache=tempfile.mkdtemp(), url=None)
+    >>> _ = config.RPC_CACHE.set(True)
+    >>> methods = dict(
+    ...     get_server_info = lambda: dict(crds_version=dict(str="11.0"), download_metadata=""),
+    ...     get_mapping_names = lambda context: [context, "hst_acs.imap"])
+    >>> with LocalJsonRpcServer(methods) as server:
+    ...     with mock.patch.object(api, "S", server.proxy()), mock.patch.object(api, "URL", server.url), \\
+    ...          mock.patch.object(api, "get_crds_server", return_value=server.url):
+    ...         api._cached_rpc("get_mapping_names", "hst.pmap")
+    ...         api._cached_rpc("get_mapping_names", "hst.pmap")
+    ['hst.pmap', 'hst_acs.imap']
+    ['hst.pmap', 'hst_acs.imap']
+    >>> server.calls.count("get_mapping_names")
+    1
+    >>> len(glob.glob(os.path.join(config.get_rpc_cache_path(), "*", "*.json")))
+    1
+    >>> _ = config.RPC_CACHE.set(False)
+    >>> test_config.cleanup(old_state)
+    """
+
+# ==================================================================================
+
+def main():
+    """Run module tests,  for now just doctests only."""
+    from crds.tests import test_proxy, tstmod
+    return tstmod(test_proxy)
+
+if __name__ == "__main__":
+    print(main())
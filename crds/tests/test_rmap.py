@@ -190,6 +190,43 @@ def dt_rmap_warn_checksum():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_rmap_delete():
+    """
+    Deleting a reference edits the UseAfter selections in place,  subsequent lookups
+    must not use the binary search keys of the deleted selections.
+
+    >>> old_state = test_config.setup()
+    >>> r = rmap.ReferenceMapping.from_string('''
+    ... header = {
+    ...    'derived_from' : 'created by hand',
+    ...    'filekind' : 'DARKFILE',
+    ...    'instrument' : 'ACS',
+    ...    'mapping' : 'REFERENCE',
+    ...    'name' : 'hst_acs_darkfile_delete.rmap',
+    ...    'observatory' : 'HST',
+    ...    'parkey' : (('DETECTOR',), ('DATE-OBS', 'TIME-OBS')),
+    ... }
+    ...
+    ... selector = Match({
+    ...    ('HRC',) : UseAfter({
+    ...        '1992-01-01 00:00:00' : 'a_drk.fits',
+    ...        '2002-03-01 00:00:00' : 'b_drk.fits',
+    ...        '2004-01-01 00:00:00' : 'c_drk.fits',
+    ...     }),
+    ... })
+    ... ''', ignore_checksum=True)
+    >>> header = {"DETECTOR" : "HRC", "DATE-OBS" : "2005-01-01", "TIME-OBS" : "00:00:00"}
+    >>> r.get_best_ref(header)
+    'c_drk.fits'
+    >>> r.delete("c_drk.fits").get_best_ref(header)
+    'b_drk.fits'
+    >>> r.delete("a_drk.fits").get_best_ref(dict(header, **{"DATE-OBS" : "2003-01-01"}))
+    'b_drk.fits'
+    >>> r.delete("a_drk.fits").get_best_ref(dict(header, **{"DATE-OBS" : "1993-01-01"}))
+    'NOT FOUND No match found.'
+    >>> test_config.cleanup(old_state)
+    """
+
 def dt_rmap_get_reference_parkeys():
     """
     >>> old_state = test_config.setup()
@@ -494,6 +531,55 @@ def dt_pickling():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_rmap_parser():
+    """
+    Mappings loaded by rmap_parser are identical to mappings verified and exec'ed:
+
+    >>> old_state = test_config.setup()
+
+    >>> old_parser = config.RMAP_PARSER.set(True)
+    >>> parsed = rmap.load_mapping("data/hst_acs_darkfile.rmap")
+    >>> _ = config.RMAP_PARSER.set(False)
+    >>> executed = rmap.load_mapping("data/hst_acs_darkfile.rmap")
+
+    >>> parsed.header == executed.header
+    True
+    >>> parsed.format() == executed.format()
+    True
+    >>> parsed.difference(executed)
+    []
+
+    >>> _ = config.RMAP_PARSER.set(old_parser)
+    >>> test_config.cleanup(old_state)
+    """
+
+def dt_rmap_preload_closure():
+    """
+    Worker processes load the closure of a context into the get_cached_mapping() cache:
+
+    >>> old_state = test_config.setup()
+    >>> utils.clear_function_caches()
+
+    >>> p = rmap.get_cached_mapping("hst.pmap")
+    >>> rmap.preload_closure(p, workers=2)
+    >>> len(rmap._load_mapping.cache) == len(p.mapping_names())
+    True
+    >>> rmap.get_cached_mapping(p.selector["ACS"]) is p.get_imap("acs")
+    True
+
+    They are the same mappings as loading serially:
+
+    >>> q = rmap.load_mapping("hst.pmap")
+    >>> q.force_load()
+    >>> p.difference(q)
+    []
+    >>> sorted(p.reference_names()) == sorted(q.reference_names())
+    True
+
+    >>> utils.clear_function_caches()
+    >>> test_config.cleanup(old_state)
+    """
+
 # ==================================================================================
 
 class TestRmap(test_config.CRDSTestCase):
@@ -761,6 +847,32 @@ selector = Match({
                 "TIME-OBS" : "00:34:32",
                 }) is None
 
+    def test_rmap_lookup_cache(self):
+        old_size = config.LOOKUP_CACHE_SIZE.get()
+        config.LOOKUP_CACHE_SIZE.set(2)
+        try:
+            r = rmap.load_mapping("data/hst_acs_darkfile_na_omit.rmap")
+        finally:
+            config.LOOKUP_CACHE_SIZE.set(old_size)
+        header = {
+                "DETECTOR" : "SBC",
+                "CCDAMP" : "A",
+                "CCDGAIN" : "1.0",
+                "DATE-OBS" : "2002-03-19",
+                "TIME-OBS" : "00:34:32",
+                }
+        self.assertIsNone(r.get_best_ref(header))
+        self.assertIsNone(r.get_best_ref(header))
+        self.assertEqual(r.get_lookup_cache_stats(), (1, 1, 1))
+        self.assertEqual(r.get_best_ref(dict(header, **{"DATE-OBS" : "1993-01-01"})), "NOT FOUND n/a")
+        self.assertEqual(r.get_best_ref(dict(header, **{"DATE-OBS" : "1993-01-02"})), "NOT FOUND n/a")
+        self.assertEqual(r.get_lookup_cache_stats(), (1, 3, 2))
+        # keywords which aren't required parkeys don't affect the cache key
+        header["DATE-OBS"] = "1993-01-02"
+        r.get_best_ref(dict(header, EXPSTART="52352.02", ROOTNAME="J8BT05NJQ"))
+        r.get_best_ref(dict(header, EXPSTART="52353.71", ROOTNAME="J8BT06NKQ"))
+        self.assertEqual(r.get_lookup_cache_stats(), (3, 3, 2))
+
     def test_rmap_todict(self):
         p = rmap.get_cached_mapping("hst.pmap")
         p.todict()
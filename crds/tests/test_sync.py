@@ -33,6 +33,39 @@ class TestSync(test_config.CRDSTestCase):
         self.run_script("crds.sync --contexts hst_cos_deadtab.rmap --fetch-references --check-files --repair-files")
         self.run_script("crds.sync --contexts hst_cos_deadtab.rmap --fetch-references --check-files --repair-files --check-sha1sum")
 
+    def test_sync_check_sha1sum_jobs(self):
+        self.run_script("crds.sync --contexts hst_cos_deadtab.rmap --fetch-references")
+        for name in crds.get_cached_mapping("hst_cos_deadtab.rmap").reference_names():
+            with open(config.locate_file(name, "hst"), "r+b") as handle:   # same size,  bad sha1sum
+                handle.seek(-1, os.SEEK_END)
+                last = handle.read(1)
+                handle.seek(-1, os.SEEK_END)
+                handle.write(bytes([last[0] ^ 0xff]))
+        cmd = "crds.sync --contexts hst_cos_deadtab.rmap --fetch-references --check-files --check-sha1sum"
+        serial = self.run_captured(cmd)
+        self.assertEqual(serial[0], 2)
+        self.assertEqual(self.run_captured(cmd + " --jobs 2"), serial)
+
+    def test_sync_check_sha1sum_ledger(self):
+        self.run_script("crds.sync --contexts hst_cos_deadtab.rmap --fetch-references")
+        config.CHECKSUM_LEDGER.set(True)
+        cmd = "crds.sync --contexts hst_cos_deadtab.rmap --fetch-references --check-files --check-sha1sum"
+        self.run_script(cmd)   # records sha1sums in the ledger
+        for name in crds.get_cached_mapping("hst_cos_deadtab.rmap").reference_names():
+            path = config.locate_file(name, "hst")
+            stat = os.stat(path)
+            with open(path, "r+b") as handle:   # same size and mtime,  bad sha1sum
+                handle.seek(-1, os.SEEK_END)
+                last = handle.read(1)
+                handle.seek(-1, os.SEEK_END)
+                handle.write(bytes([last[0] ^ 0xff]))
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.run_script(cmd, 0)   # unchanged according to the ledger
+        self.run_script(cmd + " --force-rehash", 2)
+        config.FORCE_REHASH.set(False)
+        self.run_script(cmd, 2)   # ledger refreshed by --force-rehash
+        config.CHECKSUM_LEDGER.set(False)
+
     def test_sync_explicit_files(self):
         self.assert_crds_not_exists("hst_cos_deadtab.rmap")
         self.run_script("crds.sync --files hst_cos_deadtab.rmap --check-files --repair-files --check-sha1sum")
@@ -1,9 +1,28 @@
 """This tests, through the use of bestrefs, the functioning of table effects."""
+import os
+import tempfile
 import doctest
 
+import numpy as np
+from astropy.io import fits
+
 from crds import tests
+from crds.core import config
 from crds.tests import test_config
-from crds.bestrefs import BestrefsScript
+from crds.bestrefs import BestrefsScript, table_effects
+
+def write_wcptab(path, rows):
+    """Write a COS WCPTAB-like table of (OPT_ELEM, WAVELENGTH) `rows` to `path`."""
+    columns = [fits.Column(name="OPT_ELEM", format="8A", array=np.array([row[0] for row in rows])),
+               fits.Column(name="WAVELENGTH", format="D", array=np.array([row[1] for row in rows]))]
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(columns)]).writeto(path)
+    return path
+
+def compare(rule_class, header, old_reference, new_reference):
+    """Return (is_different, message) of a new `rule_class` comparing the references for `header`."""
+    rule = rule_class()
+    rule.are_different(header, old_reference, new_reference)
+    return rule.is_different, rule.message
 
 def dt_table_effects_default_always_reprocess():
     """
@@ -96,6 +115,43 @@ def dt_table_effects_reprocess_no():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_table_effects_memoized_comparisons():
+    """
+    Each distinct mode of a pair of references is compared once,  later datasets with the
+    same mode reuse the result,  which is the same as comparing afresh:
+
+    >>> tmpdir = tempfile.mkdtemp(prefix="crds-table-effects-")
+    >>> old = write_wcptab(os.path.join(tmpdir, "old_wcp.fits"), [("G130M", 1.0), ("G160M", 2.0), ("G140L", 3.0)])
+    >>> new = write_wcptab(os.path.join(tmpdir, "new_wcp.fits"), [("G130M", 1.0), ("G160M", 2.5), ("G140L", 3.0)])
+    >>> modes = ["G130M", "G160M", "G140L", "G285M"]
+
+    >>> table_effects.clear_cache()
+    >>> fresh = []
+    >>> for mode in modes:
+    ...     fresh.append(compare(table_effects.DeepLook_COSOpt_elem, {"OPT_ELEM": mode}, old, new))
+    ...     table_effects.clear_cache()
+    >>> [is_different for (is_different, message) in fresh]
+    [False, True, False, False]
+
+    >>> memoized = [compare(table_effects.DeepLook_COSOpt_elem, {"OPT_ELEM": mode}, old, new)
+    ...             for mode in modes + modes]
+    >>> memoized == fresh + fresh
+    True
+    >>> table_effects.get_comparisons().hits, table_effects.get_comparisons().misses
+    (4, 4)
+
+    Remembered comparisons are bounded by CRDS_TABLE_EFFECTS_COMPARISONS_CACHE_SIZE:
+
+    >>> old_size = config.TABLE_EFFECTS_COMPARISONS_CACHE_SIZE.set(2)
+    >>> table_effects.clear_cache()
+    >>> [compare(table_effects.DeepLook_COSOpt_elem, {"OPT_ELEM": mode}, old, new) for mode in modes] == fresh
+    True
+    >>> len(table_effects.get_comparisons())
+    2
+    >>> _ = config.TABLE_EFFECTS_COMPARISONS_CACHE_SIZE.set(old_size)
+    >>> table_effects.clear_cache()
+    """
+
 def main():
     """Run module tests,  for now just doctests only."""
     from crds.tests import test_table_effects, tstmod
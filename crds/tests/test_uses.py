@@ -82,6 +82,56 @@ def dt_disabled_uses_imap():
     >>> test_config.cleanup(old_state)
     """
 
+def dt_uses_index():
+    """
+    >>> import shutil, tempfile
+    >>> cache = tempfile.mkdtemp()
+    >>> old_state = test_config.setup(cache=cache)
+    >>> mappings = os.path.join(cache, "mappings", "hst")
+    >>> os.makedirs(mappings)
+    >>> for name in ["hst_0001.pmap", "hst_cos.imap", "hst_cos_flatfile.rmap"]:
+    ...     _ = shutil.copy(os.path.join(HERE, "data", name), mappings)
+
+    >>> pp(uses.uses_map(["v2e20129l_flat.fits", "hst_cos_flatfile.rmap", "hst_cos.imap", "hst_0001.pmap"], "hst"))
+    {'hst_0001.pmap': [],
+     'hst_cos.imap': ['hst_0001.pmap'],
+     'hst_cos_flatfile.rmap': ['hst_0001.pmap', 'hst_cos.imap'],
+     'v2e20129l_flat.fits': ['hst_0001.pmap',
+                             'hst_cos.imap',
+                             'hst_cos_flatfile.rmap']}
+
+    Mappings added to or removed from the cache are picked up incrementally by
+    update_index(),  as called by crds.sync:
+
+    >>> _ = shutil.copy(os.path.join(HERE, "data", "hst.pmap"), mappings)
+    >>> os.remove(os.path.join(mappings, "hst_0001.pmap"))
+    >>> _ = uses.update_index("hst")
+    >>> uses.uses(["v2e20129l_flat.fits"], "hst")
+    ['hst.pmap', 'hst_cos.imap', 'hst_cos_flatfile.rmap']
+
+    Queries against a current index don't examine the cached mappings:
+
+    >>> from unittest import mock
+    >>> with mock.patch("crds.core.rmap.list_mappings", side_effect=AssertionError("scanned mappings")):
+    ...     uses.uses(["hst_cos.imap"], "hst")
+    ['hst.pmap']
+
+    An out of date index in a readonly cache is reported and the mappings are loaded instead:
+
+    >>> mtime = os.stat(mappings).st_mtime
+    >>> os.utime(mappings, (mtime + 10, mtime + 10))
+    >>> _ = config.set_cache_readonly(True)
+    >>> with mock.patch("crds.uses._findall_pmaps_using_imap", return_value=["scanned.pmap"]):
+    ...     uses.uses(["hst_cos.imap"], "hst")
+    CRDS - INFO -  The crds.uses index for 'hst' is out of date and the cache is readonly,  loading mappings instead.
+    ['scanned.pmap']
+    >>> _ = config.set_cache_readonly(False)
+
+    >>> uses.close_index()
+    >>> test_config.cleanup(old_state)
+    >>> shutil.rmtree(cache)
+    """
+
 class TestUses(test_config.CRDSTestCase):
     '''
     def test_get_imap_except(self):
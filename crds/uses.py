@@ -1,6 +1,16 @@
 """uses.py defines functions which will list the files which use a given
 reference or mapping file.
 
+Queries are answered from a persistent reverse index of the files referred to
+by each mapping in the CRDS cache,  see config.get_uses_index_path().   The
+index is built the first time it is needed and is updated incrementally by
+crds.sync,  re-reading only mappings which were added or changed since they
+were indexed.   Queries only read the index,  checking the modification time of
+the mapping directory to detect mappings added or removed since the last update.
+It can be disabled with CRDS_USES_INDEX=0 which reverts to loading every cached
+mapping for each query,  as do queries against an out of date index in a
+readonly cache.
+
 >> from pprint import pprint as pp
 >> pp(_findall_mappings_using_reference("v2e20129l_flat.fits"))
 ['hst.pmap',
@@ -17,9 +27,168 @@ reference or mapping file.
 """
 import sys
 import os.path
+import sqlite3
+import threading
 
 from crds.core import config, cmdline, utils, log, rmap
 
+# ============================================================================
+
+_INDEX = threading.local()
+
+def _index_connection(observatory):
+    """Return this thread's connection to the `observatory` uses index,  or None if the
+    index is disabled or unavailable.
+    """
+    if not config.USES_INDEX.get():
+        return None
+    path = config.get_uses_index_path(observatory)
+    readonly = config.get_cache_readonly()
+    if readonly and not os.path.exists(path):
+        return None
+    key = (os.getpid(), path, readonly)
+    if getattr(_INDEX, "key", None) != key:   # new thread,  forked process,  or relocated config
+        _INDEX.key, _INDEX.connection = key, None
+        try:
+            if readonly:
+                connection = sqlite3.connect("file:" + path + "?mode=ro", uri=True, timeout=30)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                connection = sqlite3.connect(path, timeout=30)
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS mappings "
+                    "(name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER)")
+                connection.execute("CREATE TABLE IF NOT EXISTS uses (child TEXT, parent TEXT)")
+                connection.execute("CREATE INDEX IF NOT EXISTS uses_child ON uses (child)")
+                connection.execute("CREATE INDEX IF NOT EXISTS uses_parent ON uses (parent)")
+                connection.execute("CREATE TABLE IF NOT EXISTS stamps (name TEXT PRIMARY KEY, value INTEGER)")
+                connection.commit()
+            _INDEX.connection = connection
+        except Exception as exc:
+            log.verbose("Uses index", repr(path), "is unavailable:", str(exc), verbosity=60)
+    return _INDEX.connection
+
+def close_index():
+    """Close this thread's connection to the uses index,  if any."""
+    connection = getattr(_INDEX, "connection", None)
+    if connection is not None:
+        connection.close()
+    _INDEX.key, _INDEX.connection = None, None
+
+def index_exists(observatory):
+    """Return True IFF the `observatory` uses index has been built."""
+    return config.USES_INDEX.get() and os.path.exists(config.get_uses_index_path(observatory))
+
+def update_index(observatory):
+    """Bring the `observatory` uses index up to date with the mappings in the CRDS cache,
+    reading only mappings which were added or changed since they were indexed.   This
+    examines every cached mapping and is called when the cache changes,  e.g. by crds.sync.
+
+    Returns the index connection or None if the index is not available or the cache is readonly.
+    """
+    connection = _index_connection(observatory)
+    if connection is None or config.get_cache_readonly():
+        return None
+    stamp = _mappings_stamp(observatory)   # before listing,  so later changes leave the index stale
+    paths = { os.path.basename(path) : path
+              for path in rmap.list_mappings("*.[pir]map", observatory, full_path=True) }
+    indexed = { row[0] : tuple(row[1:]) for row in connection.execute("SELECT * FROM mappings") }
+    with connection:
+        for name in set(indexed) - set(paths):
+            _remove_mapping(connection, name)
+        for name in sorted(paths):
+            stat_key = _stat_key(os.stat(paths[name]))
+            if indexed.get(name) != stat_key:
+                _index_mapping(connection, name, paths[name], stat_key)
+        connection.execute("INSERT OR REPLACE INTO stamps VALUES ('mappings', ?)", (stamp,))
+    return connection
+
+def _query_index(observatory):
+    """Return the `observatory` uses index connection for answering queries,  or None if
+    queries should load the cached mappings instead.   The index is updated only if the
+    mapping directory was modified since the last update,  so queries against a current
+    index do not examine any mappings.
+    """
+    connection = _index_connection(observatory)
+    if connection is None or _indexed_stamp(connection) == _mappings_stamp(observatory):
+        return connection
+    if config.get_cache_readonly():
+        log.info("The crds.uses index for", repr(observatory),
+                 "is out of date and the cache is readonly,  loading mappings instead.")
+        return None
+    return update_index(observatory)
+
+def _mappings_stamp(observatory):
+    """Return the modification time of the `observatory` mapping directory,  or None."""
+    try:
+        return os.stat(os.path.dirname(config.locate_mapping("*.pmap", observatory))).st_mtime_ns
+    except OSError:
+        return None
+
+def _indexed_stamp(connection):
+    """Return the mapping directory modification time recorded by the last update_index(),
+    or False if the index has never been updated.
+    """
+    try:
+        row = connection.execute("SELECT value FROM stamps WHERE name = 'mappings'").fetchone()
+    except sqlite3.Error:   # readonly index written before stamps were recorded
+        return False
+    return row[0] if row else False
+
+def _remove_mapping(connection, name):
+    """Drop the index entries for mapping `name`."""
+    connection.execute("DELETE FROM uses WHERE parent = ?", (name,))
+    connection.execute("DELETE FROM mappings WHERE name = ?", (name,))
+
+def _index_mapping(connection, name, path, stat_key):
+    """Record the files directly referred to by mapping `name` stored at `path`.   Mappings
+    which fail to load are recorded as using nothing until they change.
+    """
+    log.verbose("Indexing uses of", repr(name), verbosity=60)
+    children = []
+    with log.error_on_exception("Failed indexing", repr(name)):
+        mapping = rmap.load_mapping(path, ignore_checksum=True)
+        if isinstance(mapping, rmap.ReferenceMapping):
+            children = mapping.reference_names()
+        else:
+            children = [child for child in mapping.selector.values() if not rmap.is_special_value(child)]
+    _remove_mapping(connection, name)
+    connection.executemany("INSERT INTO uses VALUES (?, ?)",
+                           [(os.path.basename(child), name) for child in set(children)])
+    connection.execute("INSERT INTO mappings VALUES (?, ?, ?, ?)", (name,) + stat_key)
+
+def _stat_key(stat):
+    """Return the index validity key for os.stat() result `stat`."""
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def _indexed_referrers(connection, files):
+    """Return { file : { mapping referring directly to file, ...}, ... } for all of `files`."""
+    referrers = { file_ : set() for file_ in files }
+    files = sorted(referrers)
+    for i in range(0, len(files), 500):   # stay under the SQLite host parameter limit
+        chunk = files[i:i+500]
+        query = "SELECT child, parent FROM uses WHERE child IN ({})".format(",".join("?" * len(chunk)))
+        for child, parent in connection.execute(query, chunk):
+            referrers[child].add(parent)
+    return referrers
+
+def _indexed_uses(connection, files):
+    """Return { file : sorted([mapping using file directly or indirectly, ...]), ... } for `files`."""
+    closure, pending = {}, set(files)
+    while pending:   # one query per level of the mapping hierarchy
+        level = _indexed_referrers(connection, pending)
+        closure.update(level)
+        pending = set().union(*level.values()) - set(closure)
+    def walk(file_, seen):
+        for parent in closure.get(file_, ()):
+            if parent not in seen:
+                seen.add(parent)
+                walk(parent, seen)
+        return seen
+    return { file_ : sorted(walk(file_, set())) for file_ in files }
+
+# ============================================================================
+
 @utils.cached
 def load_all_mappings(observatory, pattern="*map"):
     """Return a dictionary mapping the names of all CRDS Mappings matching `pattern`
@@ -87,8 +256,20 @@ def _findall_mappings_using_rmap(rmap, observatory="hst"):
             mappings.append(pmap)
     return sorted(list(set(mappings)))
 
+def uses_map(files, observatory="hst"):
+    """Return { file : [ mapping using file, ... ], ... } for all of `files` at once."""
+    files = [os.path.basename(file_) for file_ in files]
+    connection = _query_index(observatory)
+    if connection is not None:
+        return _indexed_uses(connection, files)
+    return { file_ : uses([file_], observatory) for file_ in files }
+
 def uses(files, observatory="hst"):
     """Return the list of mappings which use any of `files`."""
+    connection = _query_index(observatory)
+    if connection is not None:
+        using = _indexed_uses(connection, [os.path.basename(file_) for file_ in files])
+        return sorted(set().union(*using.values()))
     mappings = []
     for file_ in files:
         if file_.endswith(".rmap"):
@@ -163,8 +344,9 @@ hst_acs_darkfile_0005.rmap
 
     def print_mappings_using_files(self):
         """Print out the mappings which refer to the specified mappings or references."""
+        using = uses_map(self.files, self.observatory)
         for file_ in self.files:
-            for use in uses([file_], self.observatory):
+            for use in using[file_]:
                 if self.args.include_used:
                     print(file_, use)
                 else: